@@ -13,6 +13,7 @@
   python analyze.py --file <path>    # 分析指定的结果文件
   python analyze.py --charts         # 仅生成图表
   python analyze.py --report         # 仅生成报告
+  python analyze.py --warehouse      # 跨运行查询：最近 50 次运行各策略下的品牌份额
 """
 
 import os
@@ -33,6 +34,7 @@ sys.path.insert(0, project_root)
 
 from src.analysis.analytics import CoffeeMarketAnalyzer
 from src.analysis.visualizer import CoffeeMarketVisualizer
+from src.analysis.warehouse import ResultsWarehouse, RUN_GROUP_COLUMNS, print_brand_share
 
 
 def find_latest_result():
@@ -52,6 +54,23 @@ def find_latest_result():
     return latest_csv
 
 
+def query_warehouse(args):
+    """增量同步 data/output 下的结果文件到结果仓库，并打印跨运行的品牌份额"""
+    output_dir = os.path.join(project_root, 'data', 'output')
+    warehouse = ResultsWarehouse(os.path.join(output_dir, 'results_warehouse.sqlite'))
+    try:
+        ingested, skipped = warehouse.ingest_directory(output_dir)
+        print(f"🏛️  结果仓库: 新入库 {ingested} 次运行 | 已入库未变化 {skipped} 次")
+        dimension, segment = args.segment.split('=', 1) if args.segment else ('all', 'all')
+        table = warehouse.brand_share_by(by=args.by, brand=args.brand, last=args.last,
+                                         dimension=dimension, segment=segment)
+        print(f"📊 最近 {args.last} 次运行 | 按 {args.by} 分组 | 人群 {dimension}={segment}"
+              + (f" | 品牌 {args.brand}" if args.brand else ""))
+        print_brand_share(table, args.by)
+    finally:
+        warehouse.close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='☕ 咖啡市场仿真数据分析工具',
@@ -62,6 +81,8 @@ def main():
   python analyze.py --file data/output/simulation_results_test_*.csv  # 分析指定文件
   python analyze.py --report         # 仅生成统计报告
   python analyze.py --charts         # 仅生成可视化图表
+  python analyze.py --warehouse --brand 瑞幸咖啡 --by strategy --last 50
+  python analyze.py --warehouse --segment age_group=25-34
         """
     )
     
@@ -89,8 +110,45 @@ def main():
         default=None
     )
     
+    parser.add_argument(
+        '--warehouse', '-w',
+        action='store_true',
+        help='跨运行查询：增量同步 data/output 下的全部结果到结果仓库，按运行属性汇总品牌份额'
+    )
+    
+    parser.add_argument(
+        '--by',
+        choices=RUN_GROUP_COLUMNS,
+        default='strategy',
+        help='--warehouse 的分组属性 (默认: strategy)'
+    )
+    
+    parser.add_argument(
+        '--last',
+        type=int,
+        default=50,
+        help='--warehouse 只统计最近 N 次运行 (默认: 50)'
+    )
+    
+    parser.add_argument(
+        '--brand',
+        default=None,
+        help='--warehouse 只显示该品牌 (如 瑞幸咖啡)'
+    )
+    
+    parser.add_argument(
+        '--segment',
+        default=None,
+        metavar='DIMENSION=SEGMENT',
+        help='--warehouse 限定人群，如 age_group=25-34、income_segment=中高收入(15-25K) (默认: 全部顾客)'
+    )
+    
     args = parser.parse_args()
     
+    if args.warehouse:
+        query_warehouse(args)
+        return
+    
     # 确定要分析的文件
     if args.file:
         csv_path = args.file
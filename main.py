@@ -10,7 +10,7 @@
 使用方式：
   python main.py --mode test      # 测试运行 (5个顾客)
   python main.py --mode full      # 完整运行 (100个顾客)
-  python main.py --mode benchmark # 性能基准测试
+  python main.py --mode benchmark # 离线性能基准 (规则引擎，与基线对比)
 """
 
 import os
@@ -18,6 +18,11 @@ import sys
 import argparse
 import time
 import json
+import random
+import queue
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -26,8 +31,21 @@ if sys.stdout.encoding != 'utf-8':
     import io
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-from src.environment.market import CoffeeMarket
-from src.utils.population_generator import ShanghaiCustomerGenerator
+from src.environment.market import CoffeeMarket, OUTPUT_DIR
+from src.environment.checkpoint import RunCheckpoint
+from src.environment.result_writer import merge_result_files, export_columnar, RESULT_FORMATS
+from src.environment.timestep import TimeSteppedSimulation
+from src.llm.client import DeepSeekClient, DEFAULT_RPM, DEFAULT_TPM
+from src.llm.cache import ResponseCache, CACHE_MODES
+from src.llm.journal import DecisionJournal, ReplayClient, read_journal_meta
+from src.llm.rule_based import RuleBasedBackend
+from src.llm.mock_server import MockLLMServer, LATENCY_DISTRIBUTIONS
+from src.agents.prompt_template import PROMPT_LAYOUTS
+from src.utils.population_generator import ShanghaiCustomerGenerator, require_pyarrow
+from src.utils.benchmark import run_benchmark, DEFAULT_THRESHOLD
+from src.utils.telemetry import merge_snapshots, summarize, write_run_metrics, STAGE_LABELS
+from src.analysis.online import OnlineMarketAggregator, merge_market_snapshots, print_market_report
+from src.analysis.warehouse import ResultsWarehouse, DEFAULT_WAREHOUSE_PATH
 
 
 # ============================================================================
@@ -46,6 +64,22 @@ class SimulationConfig:
     POPULATION_CSV = os.path.join(DATA_INPUT_DIR, "shanghai_population.csv")
     BRAND_LIBRARY_JSON = os.path.join(DATA_INPUT_DIR, "coffee_brands_library.json")
     
+    # LLM 响应缓存 (内容寻址，SQLite)
+    CACHE_DB = os.path.join(PROJECT_ROOT, "data/cache/llm_responses.sqlite")
+    CACHE_MAX_ENTRIES = 200000
+    
+    # 人口数据二进制缓存 (以源数据哈希为键，热启动时内存映射)
+    POPULATION_CACHE_DIR = os.path.join(PROJECT_ROOT, "data/cache/population")
+    
+    # 录制日志目录 (--record 写入，--replay 读取)
+    JOURNAL_DIR = os.path.join(PROJECT_ROOT, "data/journals")
+    
+    # 运行检查点目录 (--resume <运行ID> 读取)
+    CHECKPOINT_DIR = os.path.join(PROJECT_ROOT, "data/checkpoints")
+    
+    # 性能基准结果与基线 (--mode benchmark)
+    BENCHMARK_DIR = os.path.join(PROJECT_ROOT, "data/benchmarks")
+    
     # 模拟规模参数 (根据模式动态设置)
     SIMULATION_MODES = {
         "test": {
@@ -69,8 +103,8 @@ class SimulationConfig:
             "description": "完整运行 (100个顾客)"
         },
         "benchmark": {
-            "sample_size": 200,
-            "description": "性能基准测试 (200个顾客)"
+            "sample_size": 100000,
+            "description": "离线性能基准 (规则引擎，1k/10k/100k 顾客，与基线对比)"
         }
     }
     
@@ -188,6 +222,13 @@ class SimulationConfig:
         "coupon_amount": 0                   # 通用满减金额（暂不启用）
     }
     
+    # 并发决策数 (同时在途的 LLM 请求数，1 表示逐个串行调用)
+    DEFAULT_CONCURRENCY = 8
+    
+    # 决策后端：deepseek=线上 API，mock=本地 OpenAI 兼容 Mock 服务，rule=进程内规则引擎
+    DECISION_BACKENDS = ["deepseek", "mock", "rule"]
+    MOCK_RATE_LIMIT = 10 ** 9
+    
     PLATFORM_RULES_AGGRESSIVE = {
         "event_name": "瑞幸补贴：满15元减5元",
         "free_delivery_campaign": False,
@@ -217,11 +258,53 @@ class SimulationConfig:
 class SimulationRunner:
     """仿真运行器 - 协调整个模拟流程"""
     
-    def __init__(self, api_key=None, mode="test"):
+    def __init__(self, api_key=None, mode="test", concurrency=None, cache_mode=None, cache_ttl=None,
+                 strategy="default", seed=None, record=False, replay_path=None,
+                 backend="deepseek", mock_options=None, rpm=None, tpm=None, prompt_layout="classic",
+                 batch_size=1, checkpoint=None, shards=1, timestep=False, slot_minutes=10, arrivals=None,
+                 population=None, result_format="csv", warehouse=False):
         """初始化仿真运行器"""
         self.mode = mode
+        self.strategy = strategy
         self.config = SimulationConfig.get_simulation_config(mode)
         self.api_key = api_key or os.getenv("DEEPSEEK_API_KEY")
+        self.concurrency = concurrency or SimulationConfig.DEFAULT_CONCURRENCY
+        # 未显式指定时，由 .env 中的 ENABLE_CACHE 决定是否启用缓存
+        if cache_mode is None:
+            cache_mode = "use" if os.getenv("ENABLE_CACHE", "false").lower() == "true" else "bypass"
+        self.cache_mode = cache_mode
+        self.cache_ttl = cache_ttl
+        self.cache = None
+        # 每次运行都有确定的随机种子 (未指定时随机生成并打印)，保证可录制、可回放
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+        self.record = record
+        self.replay_path = replay_path
+        self.journal = None
+        self.backend = backend
+        self.mock_options = mock_options or {}
+        self.mock_server = None
+        self.rpm = rpm
+        self.prompt_layout = prompt_layout
+        self.batch_size = max(1, batch_size or 1)
+        # 人口数据：CSV 文件或 Parquet / Arrow 分块目录
+        self.population_path = population or SimulationConfig.POPULATION_CSV
+        # 结果文件：始终写 CSV；parquet / feather 时运行结束后再写一份同名的列式文件
+        self.result_format = result_format
+        # 运行结束后把结果写入 data/output 下的结果仓库 (多次运行的跨运行查询)；
+        # 只有命令行顶层运行开启，分片子进程等内部创建的运行器不入库
+        self.warehouse = warehouse
+        self.platform_rules = None
+        self.shards = max(1, shards or 1)
+        # 分时段仿真：arrivals 为全天到店人次 (默认取模式的抽样规模)
+        self.timestep = timestep
+        self.slot_minutes = slot_minutes
+        if arrivals:
+            self.config = dict(self.config, sample_size=arrivals)
+        self.tpm = tpm
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 续跑时沿用检查点里的运行 ID 与输出文件名
+        self.checkpoint = checkpoint
+        self.run_id = checkpoint.run_id if checkpoint else f"{mode}_{self.timestamp}"
         self.market = None
         self.start_time = None
         self.end_time = None
@@ -230,15 +313,19 @@ class SimulationRunner:
         """检查环境依赖"""
         print("🔍 检查环境依赖...")
         
-        # 检查 API Key
-        if not self.api_key:
+        # 检查 API Key (离线回放、Mock 服务与规则引擎都不需要)
+        if not self.replay_path and self.backend == "deepseek" and not self.api_key:
             print("❌ 错误：未找到 DEEPSEEK_API_KEY")
             print("   请设置环境变量或在 .env 文件中配置")
             return False
         
+        if self.replay_path and not os.path.exists(self.replay_path):
+            print(f"❌ 错误：找不到录制日志: {self.replay_path}")
+            return False
+        
         # 检查数据文件
-        if not os.path.exists(SimulationConfig.POPULATION_CSV):
-            print(f"❌ 错误：缺少人口数据文件: {SimulationConfig.POPULATION_CSV}")
+        if not os.path.exists(self.population_path):
+            print(f"❌ 错误：缺少人口数据文件: {self.population_path}")
             print("   请先运行: python -m src.utils.population_generator")
             return False
         
@@ -246,6 +333,13 @@ class SimulationRunner:
             print(f"❌ 错误：缺少品牌库文件: {SimulationConfig.BRAND_LIBRARY_JSON}")
             return False
         
+        if self.result_format != "csv":
+            try:
+                require_pyarrow()
+            except ImportError as e:
+                print(f"❌ 错误：{e}")
+                return False
+        
         # 创建输出目录
         os.makedirs(SimulationConfig.DATA_OUTPUT_DIR, exist_ok=True)
         
@@ -256,12 +350,19 @@ class SimulationRunner:
         """初始化市场环境"""
         print("🌍 初始化市场环境...")
         
+        # 固定随机种子：顾客坐标与抽样结果都由它决定
+        random.seed(self.seed)
+        print(f"🎲 随机种子: {self.seed}")
+        
         try:
+            llm_client = self._create_llm_client(platform_rules)
             self.market = CoffeeMarket(
-                population_csv=SimulationConfig.POPULATION_CSV,
+                population_csv=self.population_path,
+                population_cache_dir=SimulationConfig.POPULATION_CACHE_DIR,
                 brand_library_json=SimulationConfig.BRAND_LIBRARY_JSON,
                 map_config=SimulationConfig.HUASHIDA_MAP,
-                api_key=self.api_key
+                api_key=self.api_key,
+                llm_client=llm_client
             )
             print("✅ 市场初始化成功\n")
             return True
@@ -269,6 +370,61 @@ class SimulationRunner:
             print(f"❌ 市场初始化失败: {e}\n")
             return False
     
+    def _create_llm_client(self, platform_rules):
+        """根据运行方式创建决策客户端：离线回放 / 在线调用 (可选缓存与录制)"""
+        if self.replay_path:
+            print(f"⏪ 离线回放: {self.replay_path}")
+            return ReplayClient(self.replay_path)
+        
+        if self.backend == "rule":
+            print("🧮 决策后端: 进程内规则引擎 (离线)")
+            return RuleBasedBackend()
+        
+        api_key, base_url = self.api_key, "https://api.deepseek.com"
+        rpm, tpm = self.rpm, self.tpm
+        if self.backend == "mock":
+            self.mock_server = MockLLMServer(seed=self.seed, **self.mock_options).start()
+            api_key, base_url = "mock", self.mock_server.url
+            # 本地压测默认不受线上额度限制，需要模拟限流时显式传 --rpm/--tpm
+            rpm, tpm = rpm or SimulationConfig.MOCK_RATE_LIMIT, tpm or SimulationConfig.MOCK_RATE_LIMIT
+            print(f"🧪 决策后端: 本地 Mock LLM 服务 {base_url} {self.mock_options}")
+        
+        if self.cache_mode != "bypass":
+            self.cache = ResponseCache(
+                path=SimulationConfig.CACHE_DB,
+                max_entries=SimulationConfig.CACHE_MAX_ENTRIES,
+                ttl=self.cache_ttl
+            )
+            print(f"🗄️  LLM 响应缓存: {self.cache_mode} ({SimulationConfig.CACHE_DB})")
+        
+        if self.record:
+            journal_path = os.path.join(SimulationConfig.JOURNAL_DIR, f"journal_{self.mode}_{self.timestamp}.jsonl")
+            self.journal = DecisionJournal(journal_path, meta={
+                "mode": self.mode,
+                "strategy": self.strategy,
+                "seed": self.seed,
+                "sample_size": self.config['sample_size'],
+                "batch_size": self.batch_size,
+                "concurrency": self.concurrency,
+                "prompt_layout": self.prompt_layout,
+                "timestep": self.timestep,
+                "slot_minutes": self.slot_minutes,
+                "population": self.population_path,
+                "platform_rules": platform_rules
+            })
+            print(f"⏺️  录制日志: {journal_path}")
+        
+        return DeepSeekClient(
+            api_key=api_key,
+            base_url=base_url,
+            rpm=rpm,
+            tpm=tpm,
+            cache=self.cache,
+            cache_mode=self.cache_mode,
+            journal=self.journal,
+            max_concurrency=self.concurrency
+        )
+    
     def run(self, platform_rules=None, output_filename=None):
         """执行仿真"""
         print("=" * 70)
@@ -280,48 +436,217 @@ class SimulationRunner:
         if not self.validate_environment():
             return False
         
+        platform_rules = platform_rules or SimulationConfig.PLATFORM_RULES_DEFAULT
+        self.platform_rules = platform_rules
+        timestamp = self.timestamp
+        if self.checkpoint is not None:
+            output_filename = self.checkpoint.config["output_filename"]
+        elif output_filename:
+            if not output_filename.lower().endswith(".csv"):
+                output_filename += ".csv"
+        elif self.replay_path:
+            output_filename = f"simulation_results_{self.mode}_replay_{timestamp}.csv"
+        elif self.timestep:
+            output_filename = f"simulation_results_{self.mode}_timestep_{timestamp}.csv"
+        else:
+            output_filename = f"simulation_results_{self.mode}_{timestamp}.csv"
+        
+        if self.shards > 1:
+            return self._run_sharded(platform_rules, output_filename)
+        
         # 2. 市场初始化
         if not self.initialize_market(platform_rules):
             return False
         
         # 3. 运行仿真
         self.start_time = time.time()
-        print(f"⏳ 模拟规模: {self.config['sample_size']} 名顾客")
-        print(f"🗺️  地图范围: {len(SimulationConfig.HUASHIDA_MAP)} 家咖啡店")
-        print()
+        self._print_run_settings()
+        if self.timestep:
+            return self._run_timestep(platform_rules, output_filename)
+        
+        if self.checkpoint is None:
+            self.checkpoint = RunCheckpoint(self.run_id, config={
+                "mode": self.mode,
+                "strategy": self.strategy,
+                "seed": self.seed,
+                "backend": self.backend,
+                "replay_path": self.replay_path,
+                "prompt_layout": self.prompt_layout,
+                "batch_size": self.batch_size,
+                "population": self.population_path,
+                "platform_rules": platform_rules,
+                "output_filename": output_filename
+            }, directory=SimulationConfig.CHECKPOINT_DIR)
+        print(f"🔖 运行 ID: {self.run_id} (中断后可用 --resume {self.run_id} 继续)")
         
         try:
             self.market.run_simulation(
                 sample_size=self.config['sample_size'],
-                platform_rules=platform_rules or SimulationConfig.PLATFORM_RULES_DEFAULT
+                platform_rules=platform_rules,
+                concurrency=self.concurrency,
+                prompt_layout=self.prompt_layout,
+                batch_size=self.batch_size,
+                output_filename=output_filename,
+                checkpoint=self.checkpoint
             )
         except Exception as e:
             print(f"❌ 仿真运行出错: {e}")
+            print(f"   已完成的决策已保存，可用 python main.py --resume {self.run_id} 继续")
             return False
+        finally:
+            self._shutdown_backend()
         
         self.end_time = time.time()
+        self._export_results(output_filename)
         
-        # 4. 导出结果
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        if output_filename:
-            if not output_filename.lower().endswith(".csv"):
-                output_filename += ".csv"
-        else:
-            output_filename = f"simulation_results_{self.mode}_{timestamp}.csv"
+        # 4. 打印统计 (结果已在运行中流式写入 data/output)
+        self._print_summary(output_filename)
         
+        return True
+    
+    def _shutdown_backend(self):
+        # 录制日志、缓存访问时间与 Mock 服务无论成败都要收尾，已录制的调用不丢失
+        if self.journal is not None:
+            self.journal.close()
+        if self.cache is not None:
+            self.cache.flush()
+        if self.mock_server is not None:
+            self.mock_server.stop()
+    
+    def _run_timestep(self, platform_rules, output_filename):
+        """分时段仿真：全天客流分时段到店，门店排队随订单实时变化 (不写检查点)"""
+        engine = TimeSteppedSimulation(self.market, slot_minutes=self.slot_minutes)
         try:
-            self.market.export_results(output_filename)
+            engine.run(
+                sample_size=self.config['sample_size'],
+                platform_rules=platform_rules,
+                concurrency=self.concurrency,
+                prompt_layout=self.prompt_layout,
+                batch_size=self.batch_size,
+                output_filename=output_filename
+            )
         except Exception as e:
-            print(f"❌ 结果导出失败: {e}")
+            print(f"❌ 仿真运行出错: {e}")
             return False
+        finally:
+            self._shutdown_backend()
         
-        # 5. 打印统计
-        self._print_summary(timestamp)
+        self.end_time = time.time()
+        self._export_results(output_filename)
+        self._print_summary(output_filename)
+        return True
+    
+    def _export_results(self, output_filename):
+        """--result-format 为 parquet / feather 时，把结果 CSV 转成同名的列式文件 (数据分析时优先读取)"""
+        if self.result_format == "csv":
+            return
+        path = export_columnar(os.path.join(OUTPUT_DIR, output_filename), self.result_format)
+        print(f"🗜️  列式结果文件: {path}")
+    
+    def _print_run_settings(self):
+        print(f"⏳ 模拟规模: {self.config['sample_size']} 名顾客")
+        print(f"🗺️  地图范围: {len(SimulationConfig.HUASHIDA_MAP)} 家咖啡店")
+        print(f"🚦 并发请求数: {self.concurrency}" + (f" (每个分片，共 {self.shards} 个分片)" if self.shards > 1 else ""))
+        print(f"🧱 提示词布局: {self.prompt_layout}")
+        if self.batch_size > 1:
+            print(f"📦 批量决策: 每次请求 {self.batch_size} 名顾客")
+        print()
+    
+    def _shard_options(self):
+        """分片工作进程重建 SimulationRunner 所需的参数"""
+        rpm, tpm = self.rpm, self.tpm
+        if self.backend == "deepseek":
+            rpm, tpm = rpm or DEFAULT_RPM, tpm or DEFAULT_TPM
+        return dict(
+            api_key=self.api_key, mode=self.mode, concurrency=self.concurrency,
+            cache_mode=self.cache_mode, cache_ttl=self.cache_ttl, strategy=self.strategy, seed=self.seed,
+            replay_path=self.replay_path, backend=self.backend, mock_options=self.mock_options,
+            # 限流预算按分片均分，各进程合计不超过账号额度
+            rpm=max(1, rpm // self.shards) if rpm else None,
+            tpm=max(1, tpm // self.shards) if tpm else None,
+            prompt_layout=self.prompt_layout, batch_size=self.batch_size, population=self.population_path
+        )
+    
+    def _run_sharded(self, platform_rules, output_filename):
+        """
+        多进程分片运行：每个分片进程用同一种子完成抽样后只决策其中一段顾客，
+        各自拥有独立的决策客户端与事件循环；主进程汇总进度，最后按分片顺序合并结果文件。
+        同一种子下输出与不分片运行逐行一致。
+        """
+        self.start_time = time.time()
+        self._print_run_settings()
+        stem = output_filename[:-len(".csv")]
+        shard_files = [f"{stem}.shard{k + 1}of{self.shards}.csv" for k in range(self.shards)]
         
+        manager = multiprocessing.Manager()
+        progress_queue = manager.Queue()
+        try:
+            with ProcessPoolExecutor(max_workers=self.shards) as pool:
+                futures = [
+                    pool.submit(run_shard, self._shard_options(), platform_rules, k, self.shards,
+                                shard_files[k], progress_queue)
+                    for k in range(self.shards)
+                ]
+                self._track_shard_progress(futures, progress_queue)
+                results = [future.result() for future in futures]
+        except Exception as e:
+            print(f"❌ 分片运行出错: {e}")
+            return False
+        finally:
+            manager.shutdown()
+        
+        merge_result_files([os.path.join(OUTPUT_DIR, f) for f in shard_files], os.path.join(OUTPUT_DIR, output_filename))
+        self.end_time = time.time()
+        self._export_results(output_filename)
+        
+        decision_counts = sum((r["decision_counts"] for r in results), Counter())
+        print(f"\n📊 完整决策结果已保存至: {os.path.join(OUTPUT_DIR, output_filename)}")
+        print("\n--- 🏆 最终销售统计 ---")
+        for decision, count in decision_counts.most_common():
+            print(f"{decision:<20} {count}")
+        stats = merge_run_stats([r["stats"] for r in results])
+        print_market_report(OnlineMarketAggregator.from_snapshot(stats["market"]))
+        
+        self._print_summary(output_filename, stats)
         return True
     
-    def _print_summary(self, timestamp):
-        """打印仿真总结"""
+    def _track_shard_progress(self, futures, progress_queue, interval=1.0):
+        """汇总各分片上报的完成数，每 interval 秒打印一行总进度"""
+        done = [0] * len(futures)
+        total = self.config['sample_size']
+        last_print = time.time()
+        while True:
+            finished = all(future.done() for future in futures)
+            try:
+                while True:
+                    shard, rows = progress_queue.get_nowait()
+                    done[shard] = rows
+            except queue.Empty:
+                pass
+            if finished or time.time() - last_print >= interval:
+                per_shard = " ".join(str(rows) for rows in done)
+                print(f"   ⏳ 进度: {sum(done)}/{total} | 各分片: {per_shard}")
+                last_print = time.time()
+            if finished:
+                return
+            time.sleep(0.1)
+    
+    def _collect_stats(self):
+        """本进程的运行统计 (分片模式下由各工作进程返回，再经 merge_run_stats 合并)"""
+        market = self.market
+        return {
+            "prompt": market.prompt_template.stats() if market.prompt_template is not None else {},
+            "batch": dict(market.batch_stats),
+            "cache": self.cache.stats() if self.cache is not None else {},
+            "backend_name": market.llm_client.name,
+            "backend": market.llm_client.stats(),
+            "telemetry": market.telemetry.snapshot(),
+            "market": market.aggregator.snapshot()
+        }
+    
+    def _print_summary(self, output_filename, stats=None):
+        """打印仿真总结，并在结果文件旁写出 <文件名>_run_metrics.json"""
+        stats = stats or self._collect_stats()
         elapsed_time = self.end_time - self.start_time
         sample_size = self.config['sample_size']
         time_per_customer = elapsed_time / sample_size if sample_size > 0 else 0
@@ -332,9 +657,139 @@ class SimulationRunner:
         print(f"⏱️  总耗时: {elapsed_time:.2f} 秒")
         print(f"👥 处理顾客数: {sample_size} 人")
         print(f"⚡ 平均耗时/人: {time_per_customer:.2f} 秒")
-        print(f"📊 结果文件: data/output/simulation_results_{self.mode}_{timestamp}.csv")
+        prompt_stats = stats["prompt"]
+        if prompt_stats:
+            print(f"📝 Prompt 估算: 共 {prompt_stats['estimated_prompt_tokens']:,} tokens | 平均 {prompt_stats['avg_prompt_tokens']} tokens/次")
+        batch_stats = stats["batch"]
+        if batch_stats.get("batches"):
+            print(f"📦 批量决策: {batch_stats['batches']} 次批量请求 | 批内有效 {batch_stats['batched_customers']} 人 | 回退单人请求 {batch_stats['fallbacks']} 人")
+        cache_stats = stats["cache"]
+        if cache_stats:
+            print(f"🗄️  缓存命中: {cache_stats['hits']} 次 | 未命中: {cache_stats['misses']} 次 | 命中率: {cache_stats['hit_rate']}% | 缓存条目: {cache_stats['entries']}")
+        if self.journal is not None:
+            print(f"⏺️  已录制 {self.journal.count} 次调用: {self.journal.path}")
+        backend_stats = stats["backend"]
+        if backend_stats.get("prompt_tokens"):
+            hit_rate = backend_stats["prompt_cache_hit_tokens"] / backend_stats["prompt_tokens"] * 100
+            print(f"🧊 上下文缓存: 命中 {backend_stats['prompt_cache_hit_tokens']:,} / {backend_stats['prompt_tokens']:,} prompt tokens ({hit_rate:.1f}%)")
+        if backend_stats:
+            details = " | ".join(f"{k}: {v}" for k, v in backend_stats.items())
+            print(f"🔌 决策后端 {stats['backend_name']}: {details}")
+        telemetry = summarize(stats["telemetry"])
+        if telemetry["stages"]:
+            print("⏱️  分阶段耗时 (次数 | 合计 | p50 / p95 / p99 毫秒 | 阶段):")
+            for stage, summary in telemetry["stages"].items():
+                quantiles = f"{summary['p50_ms']:.2f} / {summary['p95_ms']:.2f} / {summary['p99_ms']:.2f}"
+                print(f"   {summary['count']:>8} | {summary['total_s']:>8.2f}s | {quantiles:<28} | "
+                      f"{STAGE_LABELS.get(stage, stage)}")
+        metrics_path = self._write_run_metrics(output_filename, stats, telemetry, elapsed_time)
+        print(f"🎲 随机种子: {self.seed}")
+        print(f"📊 结果文件: {os.path.join('data/output', output_filename)}")
+        print(f"📐 运行指标: {metrics_path}")
+        self._ingest_warehouse(output_filename)
         print("=" * 70)
         print()
+    
+    def _write_run_metrics(self, output_filename, stats, telemetry, elapsed_time):
+        """机器可读的运行指标：运行参数、各阶段耗时分布 (含直方图)、计数器、各项统计与在线市场统计"""
+        sample_size = self.config['sample_size']
+        metrics = {
+            "run_id": self.run_id,
+            "mode": self.mode,
+            "strategy": self.strategy,
+            "backend": self.backend,
+            "seed": self.seed,
+            "platform_rules": self.platform_rules,
+            "sample_size": sample_size,
+            "concurrency": self.concurrency,
+            "batch_size": self.batch_size,
+            "shards": self.shards,
+            "prompt_layout": self.prompt_layout,
+            "results_file": output_filename,
+            "finished_at": datetime.fromtimestamp(self.end_time).isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed_time, 3),
+            "customers_per_second": round(sample_size / elapsed_time, 2) if elapsed_time > 0 else None,
+            "stages": telemetry["stages"],
+            "counters": telemetry["counters"],
+            "stats": {key: value for key, value in stats.items() if key not in ("telemetry", "market")},
+            "market": OnlineMarketAggregator.from_snapshot(stats["market"]).report()
+        }
+        stem = output_filename[:-len(".csv")] if output_filename.lower().endswith(".csv") else output_filename
+        metrics_path = os.path.join(OUTPUT_DIR, f"{stem}_run_metrics.json")
+        write_run_metrics(metrics_path, metrics)
+        return metrics_path
+    
+    def _ingest_warehouse(self, output_filename):
+        """把本次运行增量写入结果仓库 (跨运行查询用)；写入失败只提示，不影响本次运行"""
+        if not self.warehouse:
+            return
+        try:
+            warehouse = ResultsWarehouse()
+            try:
+                warehouse.ingest(os.path.join(OUTPUT_DIR, output_filename))
+            finally:
+                warehouse.close()
+            print(f"🏛️  已写入结果仓库: {DEFAULT_WAREHOUSE_PATH}")
+        except Exception as e:
+            print(f"⚠️  写入结果仓库失败: {e}")
+
+
+def merge_run_stats(stats_list):
+    """合并各分片的运行统计：计数求和，比率与均值按合计重新计算"""
+    merged = {"prompt": {}, "batch": {}, "cache": {}, "backend_name": stats_list[0]["backend_name"], "backend": {},
+              "telemetry": merge_snapshots([stats["telemetry"] for stats in stats_list]),
+              "market": merge_market_snapshots([stats["market"] for stats in stats_list])}
+    for stats in stats_list:
+        for section in ("prompt", "batch", "cache", "backend"):
+            for key, value in stats[section].items():
+                merged[section][key] = merged[section].get(key, 0) + value
+    prompt = merged["prompt"]
+    if prompt:
+        prompt["avg_prompt_tokens"] = round(prompt["estimated_prompt_tokens"] / prompt["calls"], 1) if prompt["calls"] else 0
+    cache = merged["cache"]
+    if cache:
+        total = cache["hits"] + cache["misses"]
+        cache["hit_rate"] = round(cache["hits"] / total * 100, 2) if total else 0.0
+        # 各进程共用同一个缓存库，条目数取最大值而不是求和
+        cache["entries"] = max(stats["cache"]["entries"] for stats in stats_list)
+    return merged
+
+
+def run_shard(options, platform_rules, shard, shards, output_filename, progress_queue, report_every=20):
+    """
+    分片工作进程入口 (需为模块级函数，便于在 spawn 方式下被子进程导入)。
+    独立初始化市场与决策客户端，只决策第 shard 段顾客，返回行数、决策计数与运行统计。
+    """
+    # 逐条决策的打印交给主进程的汇总进度，避免多个进程的输出交错
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    runner = SimulationRunner(**options)
+    if not runner.initialize_market(platform_rules):
+        raise RuntimeError(f"分片 {shard + 1}/{shards} 市场初始化失败")
+    
+    def report(rows):
+        if rows % report_every == 0:
+            progress_queue.put((shard, rows))
+    
+    try:
+        runner.market.run_simulation(
+            sample_size=runner.config['sample_size'],
+            platform_rules=platform_rules,
+            concurrency=runner.concurrency,
+            prompt_layout=runner.prompt_layout,
+            batch_size=runner.batch_size,
+            output_filename=output_filename,
+            shard=(shard, shards),
+            on_progress=report
+        )
+    finally:
+        if runner.cache is not None:
+            runner.cache.flush()
+        if runner.mock_server is not None:
+            runner.mock_server.stop()
+    
+    writer = runner.market.result_writer
+    progress_queue.put((shard, writer.rows))
+    return {"rows": writer.rows, "decision_counts": writer.decision_counts, "stats": runner._collect_stats()}
 
 
 # ============================================================================
@@ -350,10 +805,22 @@ def create_parser():
 例子:
   python main.py --mode test          # 快速测试 (5个顾客)
   python main.py --mode full          # 完整运行 (100个顾客)
-    python main.py --mode benchmark     # 性能测试 (200个顾客)
+    python main.py --mode benchmark     # 离线性能基准，比基线慢 25% 以上时退出码为 1
+    python main.py --mode benchmark --update-baseline  # 以本次结果作为新基线
     python main.py --mode mass          # 大规模运行 (1000个顾客)
     python main.py --mode test --api-key sk-xxx  # 指定 API Key
     python main.py --mode mass --output data/output/simulation_results_1000.csv
+    python main.py --mode mass --concurrency 32  # 32 个决策请求并发在途
+    python main.py --mode full --cache use      # 复用本地缓存的 LLM 响应
+    python main.py --mode full --record --seed 42  # 录制每次 LLM 调用
+    python main.py --replay data/journals/journal_full_xxx.jsonl  # 离线回放录制结果
+    python main.py --mode mass --backend mock --mock-latency-ms 500  # 离线压测 (本地 Mock 服务)
+    python main.py --mode mass --backend rule   # 进程内规则引擎，零网络
+    python main.py --mode full --prompt-layout prefix  # 共享前缀布局，提高服务端上下文缓存命中
+    python main.py --mode mass --batch-size 5   # 每次请求打包 5 名顾客的决策
+    python main.py --resume mass_20250101_120000  # 从检查点继续中断的运行
+    python main.py --mode mass --backend mock --shards 4  # 4 个进程分片运行，结果合并为一个文件
+    python main.py --timestep --arrivals 50000 --backend rule  # 分时段仿真一整天 5 万人次，排队实时变化
         """
     )
     
@@ -384,6 +851,180 @@ def create_parser():
         default=None,
         help="结果输出文件名 (可包含路径，默认自动生成)"
     )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help=f"同时在途的 LLM 决策请求数，1 为串行 (默认: {SimulationConfig.DEFAULT_CONCURRENCY})"
+    )
+
+    parser.add_argument(
+        "--cache",
+        choices=list(CACHE_MODES),
+        default=None,
+        help="LLM 响应缓存: use=读写缓存, refresh=忽略旧缓存并写入新结果, bypass=不使用缓存 (默认由 ENABLE_CACHE 决定)"
+    )
+
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=None,
+        help="缓存有效期 (秒)，默认永不过期"
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="随机种子 (决定顾客坐标与抽样，默认随机生成)"
+    )
+
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="录制每一次 LLM 请求/响应到 data/journals，供离线回放"
+    )
+
+    parser.add_argument(
+        "--replay",
+        type=str,
+        default=None,
+        metavar="JOURNAL",
+        help="离线回放指定的录制日志 (不访问网络，模式/策略/种子沿用录制时的设置)"
+    )
+
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="分片进程数：抽样顾客按顺序切成 N 段，由 N 个进程各自决策后合并 (默认: 1，不分片)"
+    )
+
+    parser.add_argument(
+        "--timestep",
+        action="store_true",
+        help="分时段仿真：顾客按客流曲线全天陆续到店，下单计入门店排队并按出杯速率消化"
+    )
+
+    parser.add_argument(
+        "--slot-minutes",
+        type=int,
+        default=10,
+        help="分时段仿真每一轮的时长 (分钟，默认: 10)"
+    )
+
+    parser.add_argument(
+        "--arrivals",
+        type=int,
+        default=None,
+        help="分时段仿真的全天到店人次，可超过人口规模 (默认: 模式的抽样人数)"
+    )
+
+    parser.add_argument(
+        "--population",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="人口数据：CSV 文件或 Parquet / Arrow 分块目录 (默认: data/input/shanghai_population.csv)"
+    )
+
+    parser.add_argument(
+        "--result-format",
+        choices=["csv"] + list(RESULT_FORMATS),
+        default="csv",
+        help="结果文件格式：csv=只写 CSV；parquet / feather=另写一份同名的列式文件 (定型、压缩，分析时优先读取，需要 pyarrow) (默认: csv)"
+    )
+
+    parser.add_argument(
+        "--no-warehouse",
+        action="store_true",
+        help="运行结束后不写入结果仓库 (data/output/results_warehouse.sqlite，供 analyze.py --warehouse 跨运行查询)"
+    )
+
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="--mode benchmark 时以本次结果覆盖基线 (data/benchmarks/baseline.json)"
+    )
+
+    parser.add_argument(
+        "--benchmark-threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"--mode benchmark 的回退阈值：比基线慢超过该比例即失败 (默认: {DEFAULT_THRESHOLD})"
+    )
+
+    parser.add_argument(
+        "--resume",
+        type=str,
+        default=None,
+        metavar="RUN_ID",
+        help="从检查点继续中断的运行 (运行 ID 在每次运行开始时打印，配置沿用原运行)"
+    )
+
+    parser.add_argument(
+        "--backend",
+        choices=SimulationConfig.DECISION_BACKENDS,
+        default="deepseek",
+        help="决策后端: deepseek=线上 API, mock=本地 Mock LLM 服务, rule=进程内规则引擎 (默认: deepseek)"
+    )
+
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=None,
+        help="每分钟请求数上限 (默认读取 DEEPSEEK_RPM，未设置为 600)"
+    )
+
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=None,
+        help="每分钟 token 数上限 (默认读取 DEEPSEEK_TPM，未设置为 1000000)"
+    )
+
+    parser.add_argument(
+        "--prompt-layout",
+        choices=list(PROMPT_LAYOUTS),
+        default="classic",
+        help="提示词布局: classic=人设在 system, prefix=规则与门店目录作为共享前缀、顾客信息置后 (默认: classic)"
+    )
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="每次 LLM 请求打包的顾客数，>1 时批量决策，不合格的条目自动回退单人请求 (默认: 1)"
+    )
+
+    parser.add_argument(
+        "--mock-latency-ms",
+        type=float,
+        default=300,
+        help="Mock 服务的时延中位数 (毫秒，默认: 300)"
+    )
+
+    parser.add_argument(
+        "--mock-latency-dist",
+        choices=list(LATENCY_DISTRIBUTIONS),
+        default="lognormal",
+        help="Mock 服务的时延分布 (默认: lognormal)"
+    )
+
+    parser.add_argument(
+        "--mock-error-rate",
+        type=float,
+        default=0.0,
+        help="Mock 服务返回 500 的概率 (默认: 0)"
+    )
+
+    parser.add_argument(
+        "--mock-throttle-rate",
+        type=float,
+        default=0.0,
+        help="Mock 服务返回 429 的概率 (默认: 0)"
+    )
     
     return parser
 
@@ -407,19 +1048,104 @@ def main():
     parser = create_parser()
     args = parser.parse_args()
     
-    # 3. 创建运行器
+    # 性能基准：固定种子 + 规则引擎的离线套件，与仿真运行参数无关
+    if args.mode == "benchmark":
+        sys.exit(run_benchmark(
+            SimulationConfig.BRAND_LIBRARY_JSON,
+            SimulationConfig.HUASHIDA_MAP,
+            get_platform_rules(args.strategy),
+            directory=SimulationConfig.BENCHMARK_DIR,
+            threshold=args.benchmark_threshold,
+            update_baseline=args.update_baseline
+        ))
+    
+    # 3. 离线回放时，模式、策略、种子、抽样规模、分时段与提示词布局都以录制日志为准
+    if args.shards > 1 and (args.record or args.resume):
+        print("❌ 错误：--shards 暂不支持与 --record / --resume 同时使用")
+        sys.exit(1)
+    
+    mode, strategy, seed, batch_size = args.mode, args.strategy, args.seed, args.batch_size
+    backend, replay_path, prompt_layout = args.backend, args.replay, args.prompt_layout
+    population, concurrency = args.population, args.concurrency
+    timestep, slot_minutes, arrivals = args.timestep, args.slot_minutes, args.arrivals
+    platform_rules = None
+    checkpoint = None
+    if args.resume:
+        # 续跑：除并发、缓存、限流等不影响结果的参数外，全部以检查点为准
+        try:
+            checkpoint = RunCheckpoint.load(args.resume, directory=SimulationConfig.CHECKPOINT_DIR)
+        except FileNotFoundError:
+            print(f"❌ 错误：找不到运行 {args.resume} 的检查点 ({SimulationConfig.CHECKPOINT_DIR})")
+            sys.exit(1)
+        if checkpoint.progress.get("status") == "completed":
+            print(f"✅ 运行 {args.resume} 已完成，结果文件: {checkpoint.config['output_filename']}")
+            sys.exit(0)
+        config = checkpoint.config
+        mode, strategy, seed = config["mode"], config["strategy"], config["seed"]
+        batch_size, backend, prompt_layout = config["batch_size"], config["backend"], config["prompt_layout"]
+        replay_path, platform_rules = config.get("replay_path"), config["platform_rules"]
+        population = config.get("population", population)
+    elif args.replay and os.path.exists(args.replay):
+        meta = read_journal_meta(args.replay)
+        mode = meta.get("mode", mode)
+        strategy = meta.get("strategy", strategy)
+        seed = meta.get("seed", seed)
+        batch_size = meta.get("batch_size", batch_size)
+        platform_rules = meta.get("platform_rules")
+        population = meta.get("population", population)
+        prompt_layout = meta.get("prompt_layout", prompt_layout)
+        timestep = meta.get("timestep", timestep)
+        slot_minutes = meta.get("slot_minutes", slot_minutes)
+        arrivals = meta.get("sample_size", arrivals)
+        # 并发数不改变决策，但同一顾客多次到店时会影响回放的匹配顺序：未指定时沿用录制值，指定了不同的值则提示
+        recorded_concurrency = meta.get("concurrency")
+        if concurrency is None:
+            concurrency = recorded_concurrency
+        elif recorded_concurrency is not None and concurrency != recorded_concurrency:
+            print(f"⚠️  录制时并发数为 {recorded_concurrency}，本次为 {concurrency}，回放结果可能与录制不完全一致")
+    if timestep and (args.shards > 1 or args.resume):
+        print("❌ 错误：--timestep 的门店排队在顾客之间共享，不支持 --shards / --resume")
+        sys.exit(1)
+    
+    # 4. 创建运行器
     runner = SimulationRunner(
         api_key=args.api_key,
-        mode=args.mode
+        mode=mode,
+        concurrency=concurrency,
+        cache_mode=args.cache,
+        cache_ttl=args.cache_ttl,
+        strategy=strategy,
+        seed=seed,
+        record=args.record,
+        replay_path=replay_path,
+        backend=backend,
+        mock_options={
+            "latency_ms": args.mock_latency_ms,
+            "latency_dist": args.mock_latency_dist,
+            "error_rate": args.mock_error_rate,
+            "throttle_rate": args.mock_throttle_rate
+        },
+        rpm=args.rpm,
+        tpm=args.tpm,
+        prompt_layout=prompt_layout,
+        batch_size=batch_size,
+        checkpoint=checkpoint,
+        shards=args.shards,
+        timestep=timestep,
+        slot_minutes=slot_minutes,
+        arrivals=arrivals,
+        population=population,
+        result_format=args.result_format,
+        warehouse=not args.no_warehouse
     )
     
-    # 4. 获取平台规则
-    platform_rules = get_platform_rules(args.strategy)
+    # 5. 获取平台规则
+    platform_rules = platform_rules or get_platform_rules(strategy)
     
-    # 5. 执行仿真
+    # 6. 执行仿真
     success = runner.run(platform_rules=platform_rules, output_filename=args.output)
     
-    # 6. 返回退出码
+    # 7. 返回退出码
     sys.exit(0 if success else 1)
 
 
@@ -1,6 +1,7 @@
 import math
 import json
 import random
+from src.agents.prompt_template import DecisionPromptTemplate
 
 BRAND_NAME_MAP = {
     'Luckin': '瑞幸咖啡',
@@ -18,9 +19,53 @@ BRAND_NAME_MAP = {
 
 TOP_N_SHOPS = 3
 
+# 口味偏好 -> 菜单品名关键词 (命中任一关键词即视为匹配)
+PREFERENCE_KEYWORDS = {
+    'Latte': ('拿铁', '奶'),
+    'Americano': ('美式', '清咖'),
+    'Specialty': ('特调', '创意'),
+}
+
+
+def select_menu_item(menu, preference):
+    """根据口味偏好，从菜单中挑选第一个匹配的商品；没有匹配时选菜单第一项兜底"""
+    if not menu:
+        return "默认咖啡", 20.0
+
+    keywords = PREFERENCE_KEYWORDS.get(preference, ())
+    for item_name, price in menu.items():
+        if any(k in item_name for k in keywords):
+            return item_name, float(price)
+
+    first_item = next(iter(menu))
+    return first_item, float(menu[first_item])
+
+
+def compile_menu_index(menu):
+    """
+    把菜单预编译为 {口味偏好: (商品, 价格)} 的索引，None 键存放兜底商品。
+    结果与对每种偏好调用 select_menu_item 相同，但只需扫描菜单一次。
+    """
+    index = {None: select_menu_item(menu, None)}
+    for item_name, price in (menu or {}).items():
+        for preference, keywords in PREFERENCE_KEYWORDS.items():
+            if preference not in index and any(k in item_name for k in keywords):
+                index[preference] = (item_name, float(price))
+    return index
+
+
+def lookup_menu_item(menu_index, preference):
+    """O(1) 查询预编译索引，未命中的偏好返回兜底商品"""
+    return menu_index.get(preference) or menu_index[None]
+
 class Customer:
+    # 只为抽中的顾客创建 (见 PopulationStore)，用 __slots__ 省去每个实例的 __dict__
+    __slots__ = ('id', 'profile', 'location', 'money', 'preference', 'sensitivity',
+                 'preferred_brand', 'brand_loyalty', '_system_prompt')
+
     def __init__(self, profile_data, location=None):
-        self.id = profile_data.get('id', random.randint(1000, 9999))
+        # 只在缺少 ID 时才抽随机数：创建 Customer 不消耗随机数，抽样结果与创建了哪些顾客无关
+        self.id = profile_data['id'] if 'id' in profile_data else random.randint(1000, 9999)
         self.profile = profile_data
         # 假设地图是以华东师范大学为中心的 2000x2000 区域
         self.location = location if location else (random.randint(500, 1500), random.randint(500, 1500))
@@ -30,7 +75,14 @@ class Customer:
         self.sensitivity = profile_data.get('price_sensitivity', 'Medium')
         self.preferred_brand = profile_data.get('brand_preference')
         self.brand_loyalty = float(profile_data.get('brand_loyalty', 0.0) or 0.0)
-        self.system_prompt = self._build_system_prompt()
+        self._system_prompt = None
+
+    @property
+    def system_prompt(self):
+        """人设 system prompt，首次用到时才拼接"""
+        if self._system_prompt is None:
+            self._system_prompt = self._build_system_prompt()
+        return self._system_prompt
 
     def _build_system_prompt(self):
         distance_pref = ""
@@ -50,23 +102,11 @@ class Customer:
 
         return self.profile.get('persona_description', '') + f"\n{distance_pref}\n{brand_pref_text}"
 
-    def _get_item_and_price(self, menu):
-        """核心新增逻辑：根据顾客偏好，从长菜单中挑选商品"""
-        if not menu:
-            return "默认咖啡", 20.0
-            
-        # 遍历菜单，寻找最匹配口味的商品
-        for item_name, price in menu.items():
-            if self.preference == 'Latte' and ('拿铁' in item_name or '奶' in item_name):
-                return item_name, float(price)
-            if self.preference == 'Americano' and ('美式' in item_name or '清咖' in item_name):
-                return item_name, float(price)
-            if self.preference == 'Specialty' and ('特调' in item_name or '创意' in item_name):
-                return item_name, float(price)
-                
-        # 如果没找到完全匹配的，选菜单里的第一个商品兜底
-        first_item = list(menu.keys())[0]
-        return first_item, float(menu[first_item])
+    def _get_item_and_price(self, menu, menu_index=None):
+        """核心新增逻辑：根据顾客偏好，从长菜单中挑选商品 (有预编译索引时直接查表)"""
+        if menu_index is not None:
+            return lookup_menu_item(menu_index, self.preference)
+        return select_menu_item(menu, self.preference)
 
     def _calculate_metrics(self, shop):
         dx = self.location[0] - shop['location'][0]
@@ -142,67 +182,48 @@ class Customer:
         score += max(0.0, 20.0 - float(item_price))
         return round(score, 2)
 
-    def generate_decision_prompt(self, shops, platform_rules=None):
-        options_str = ""
+    def shortlist_shops(self, shops, platform_rules=None):
+        """逐店打分并返回 Top-N 候选 [(score, shop, metrics, item_name, item_price, prices), ...]"""
         scored_shops = []
 
         for shop in shops:
             metrics = self._calculate_metrics(shop)
-            item_name, item_price = self._get_item_and_price(shop['menu'])
+            item_name, item_price = self._get_item_and_price(shop['menu'], shop.get('menu_index'))
             prices = self._calculate_final_price(item_price, metrics['distance'], platform_rules)
             score = self._score_shop(shop, metrics, item_price)
             scored_shops.append((score, shop, metrics, item_name, item_price, prices))
 
         scored_shops.sort(key=lambda x: x[0], reverse=True)
-        top_shops = scored_shops[:min(TOP_N_SHOPS, len(scored_shops))]
-
-        for score, shop, metrics, item_name, item_price, prices in top_shops:
-            promo_text = f"(当前优惠: {prices['discount_tags']})" if prices['discount_tags'] else ""
-
-            if metrics['distance'] <= 2500:
-                options_str += (
-                    f"【选项 {shop['id']}_Walk】步行去 {shop['brand_name']} ({shop['category']})\n"
-                    f"   - 品牌调性: {shop['business_model']}\n"
-                    f"   - 常驻活动: {shop['promotions']}\n"
-                    f"   - 推荐商品: {item_name} (原价: {item_price}元, 叠加平台优惠后到手估算: {prices['pickup_price']}元)\n"
-                    f"   - 物理距离: {metrics['distance']}米 (需步行约 {metrics['walk_time']} 分钟) | 排队: 约 {shop['queue_time']} 分钟\n"
-                    f"   - 综合评分: {score}\n\n"
-                )
-
-            if prices['can_deliver'] and shop.get('supports_delivery', True):
-                coupon_info = f", 已减红包 {prices['delivery_coupon']}元" if prices.get('delivery_coupon', 0) > 0 else ""
-                options_str += (
-                    f"【选项 {shop['id']}_Delivery】点 {shop['brand_name']} (外卖) {promo_text}\n"
-                    f"   - 推荐商品: {item_name} (原价: {item_price}元, 外卖到手总价: {prices['delivery_price']}元, 含运费 {prices['delivery_fee_real']}元{coupon_info})\n"
-                    f"   - 预估等待: {metrics['delivery_time']} 分钟\n"
-                    f"   - 综合评分: {score}\n\n"
-                )
-
-        options_str += "【选项 None】不买了 (原因：都不想喝、嫌贵或太远)\n"
-
-        event_notice = f"!!! 注意：现在是【{platform_rules['event_name']}】活动期间 !!!\n" if platform_rules and platform_rules.get('event_name') else ""
+        return scored_shops[:min(TOP_N_SHOPS, len(scored_shops))]
+
+    def generate_decision_prompt(self, shops, platform_rules=None, top_shops=None, template=None):
+        """
+        生成决策提示词。
+        top_shops 可由 ShopShortlister 批量预筛后传入 (结构同 shortlist_shops 的返回值)，省去逐店计算；
+        template 为本次运行共用的 DecisionPromptTemplate，静态片段只渲染一次。
+        """
+        if top_shops is None:
+            top_shops = self.shortlist_shops(shops, platform_rules)
+        if template is None:
+            template = DecisionPromptTemplate(shops, platform_rules, top_n=TOP_N_SHOPS)
 
         brand_name = BRAND_NAME_MAP.get(self.preferred_brand, self.preferred_brand)
-        brand_pref_notice = ""
-        if brand_name:
-            brand_pref_notice = f"你对{brand_name}有明显偏好，请优先考虑该品牌。\n"
-
-        user_prompt = (
-            f"{event_notice}"
-            f"你当前在地图上的坐标是: {self.location}。\n"
-            f"系统已根据【品牌偏好/距离/排队/价格】进行初筛，仅展示Top {TOP_N_SHOPS} 个候选。\n"
-            f"{brand_pref_notice}"
-            f"根据你的位置，你眼前的咖啡消费方案如下：\n\n{options_str}\n"
-            f"【决策任务】\n"
-            f"请综合考虑你的【消费水平】、【口味偏好】、【步行意愿】以及商家的【品牌调性】做出最符合你人设的选择。\n"
-            f"请严格返回 JSON 格式数据，包含以下字段：\n"
-            f"{{\n"
-            f"  \"decision\": \"选中的选项ID (如 Shop_1_Walk, Shop_2_Delivery 或 None)\",\n"
-            f"  \"brand\": \"购买的品牌名称 (如果不买，请填 null)\",\n"
-            f"  \"method\": \"购买方式，填 '自提' 或 '外卖' (如果不买，请填 null)\",\n"
-            f"  \"item\": \"购买的具体单品名称 (如果不买，请填 null)\",\n"
-            f"  \"price\": 最终需要支付的金额数字 (如果不买，请填 0),\n"
-            f"  \"reason\": \"你的理由 (请用简体中文，限制在15个字以内，必须符合你的人设)\"\n"
-            f"}}"
-        )
-        return user_prompt
\ No newline at end of file
+        return template.render(self.location, brand_name, top_shops)
+
+    def generate_decision_messages(self, shops, platform_rules=None, top_shops=None, template=None):
+        """
+        按模板的布局 (classic / prefix) 生成完整的 (system prompt, user prompt)。
+        classic 布局下等价于 (self.system_prompt, generate_decision_prompt(...))。
+        """
+        if top_shops is None:
+            top_shops = self.shortlist_shops(shops, platform_rules)
+        if template is None:
+            template = DecisionPromptTemplate(shops, platform_rules, top_n=TOP_N_SHOPS)
+
+        brand_name = BRAND_NAME_MAP.get(self.preferred_brand, self.preferred_brand)
+        return template.build_messages(self.system_prompt, self.location, brand_name, top_shops)
+
+    def batch_entry(self, top_shops):
+        """批量决策时本顾客的区块参数，交给 DecisionPromptTemplate.build_batch_messages"""
+        brand_name = BRAND_NAME_MAP.get(self.preferred_brand, self.preferred_brand)
+        return self.id, self.system_prompt, self.location, brand_name, top_shops
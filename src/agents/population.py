@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+from collections.abc import Sequence
+import numpy as np
+import pandas as pd
+from src.agents.customer import Customer
+from src.utils.population_generator import ShanghaiCustomerGenerator, read_population
+
+# 长文本列：不做类别编码，以 PackedStrings 存储
+TEXT_COLUMNS = ("persona_description",)
+
+# 顾客坐标范围：以华东师范大学为中心的 2000x2000 地图上 [500, 1500] 的区域 (与 Customer 的默认坐标一致)
+LOCATION_RANGE = (500, 1500)
+
+# 人口二进制缓存：data/cache/population/<源数据 sha256 前 16 位>/，缓存格式变化时递增版本号；
+# meta.json 记录源数据路径与各文件的 (大小, mtime_ns)，未变化时热启动不再重新计算哈希
+POPULATION_CACHE_DIR = "data/cache/population"
+CACHE_FORMAT_VERSION = 1
+
+# 加载方式 -> 启动时打印的说明
+LOAD_MODES = {
+    "cold": "冷启动，解析源数据并写入缓存",
+    "warm": "热启动，内存映射缓存",
+    "memory": "未使用缓存",
+}
+
+
+class PackedStrings(Sequence):
+    """
+    紧凑的字符串列：所有字符串的 UTF-8 字节拼成一段 data，offsets[i]:offsets[i+1] 为第 i 个字符串。
+    两个数组都可以内存映射，按下标访问时才解码单个字符串。
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def pack(cls, values):
+        """把字符串序列打包 (缺失值存为空串)"""
+        encoded = [v.encode("utf-8") if isinstance(v, str) else b"" for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class PopulationStore(Sequence):
+    """
+    列式人口数据 (struct of arrays)：数值列为 NumPy 数组，取值有限的文本列为类别编码 + 类别表，
+    人设长文本为 PackedStrings，顾客坐标为一个 (n, 2) 的 int32 数组；数组可以是内存映射的缓存文件。
+    按下标访问时才临时生成 Customer，system prompt 也在用到时才拼接；
+    因此初始化与内存只和人口规模的列数据有关，与实际仿真多少名顾客无关。
+    实现 Sequence 接口 (len() 与下标访问)；抽样用 sample_positions + take，
+    不要直接 random.sample(store, k)：k 较大时它会先 list() 整个人口，生成全部 Customer。
+    """
+
+    def __init__(self, columns, numeric, categorical, text, rng=None):
+        self.columns = list(columns)
+        self._numeric = numeric
+        self._categorical = categorical
+        self._text = text
+
+        lengths = [len(v) for v in numeric.values()] + [len(v) for v in text.values()] + \
+            [len(codes) for codes, _ in categorical.values()]
+        n = lengths[0] if lengths else 0
+        self.ids = self._numeric['id'] if 'id' in self._numeric else np.arange(1, n + 1)
+        self._id_index = None
+        # 坐标一次性向量化抽取：生成器的种子取自 random，同一 random.seed 下坐标不变
+        rng = rng or np.random.default_rng(random.getrandbits(64))
+        low, high = LOCATION_RANGE
+        self.locations = rng.integers(low, high + 1, size=(n, 2), dtype=np.int32)
+
+    @classmethod
+    def from_dataframe(cls, population_df, rng=None):
+        return cls(*split_columns(population_df), rng=rng)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("population index out of range")
+        x, y = self.locations[i]
+        return Customer(profile_data=self.profile(i), location=(int(x), int(y)))
+
+    def profile(self, i):
+        """第 i 名顾客的画像字典 (列顺序与人口数据一致，缺失值为 NaN)"""
+        profile = {}
+        for column in self.columns:
+            if column in self._numeric:
+                profile[column] = self._numeric[column][i].item()
+            elif column in self._categorical:
+                codes, categories = self._categorical[column]
+                code = codes[i]
+                profile[column] = categories[code] if code >= 0 else float('nan')
+            else:
+                profile[column] = self._text[column][i]
+        return profile
+
+    def sample_positions(self, k):
+        """无放回抽取 k 个下标 (与 random.sample 的抽样结果相同)，不生成任何 Customer"""
+        return random.sample(range(len(self)), k)
+
+    def take(self, positions):
+        """只为给定下标生成 Customer 列表"""
+        return [self[int(pos)] for pos in positions]
+
+    def by_ids(self, ids):
+        """按顾客 ID 取出 Customer 列表 (检查点续跑时还原抽样名单)"""
+        if self._id_index is None:
+            self._id_index = pd.Index(self.ids)
+        positions = self._id_index.get_indexer(ids)
+        if (positions < 0).any():
+            missing = [cid for cid, pos in zip(ids, positions) if pos < 0]
+            raise KeyError(f"人口数据中找不到顾客 ID: {missing[:5]}")
+        return self.take(positions)
+
+
+def split_columns(population_df):
+    """DataFrame -> (列名, 数值列, 类别列, 文本列)，即 PopulationStore 的构造参数"""
+    numeric, categorical, text = {}, {}, {}
+    for column in population_df.columns:
+        series = population_df[column]
+        if column in TEXT_COLUMNS:
+            text[column] = PackedStrings.pack(series.tolist())
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            numeric[column] = series.to_numpy()
+        else:
+            values = pd.Categorical(series)
+            categorical[column] = (values.codes, [str(c) for c in values.categories])
+    return list(population_df.columns), numeric, categorical, text
+
+
+def source_digest(path, chunk_size=1 << 20):
+    """人口源数据的 sha256：单个文件按内容；分块目录按文件名排序后依次计入文件名与内容"""
+    digest = hashlib.sha256(f"v{CACHE_FORMAT_VERSION}".encode())
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    else:
+        files = [path]
+    for file_path in files:
+        if os.path.isdir(path):
+            digest.update(os.path.basename(file_path).encode("utf-8"))
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_stat(path):
+    """人口源数据的文件指纹：[[文件名, 大小, mtime_ns], ...]，分块目录按文件名排序"""
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    else:
+        files = [path]
+    stat = []
+    for file_path in files:
+        st = os.stat(file_path)
+        stat.append([os.path.basename(file_path), st.st_size, st.st_mtime_ns])
+    return stat
+
+
+def find_cache_by_stat(cache_dir, source):
+    """在 cache_dir 下找 meta.json 记录的源数据 (路径与文件指纹) 与 source 一致的缓存目录，找不到返回 None"""
+    if not os.path.isdir(cache_dir):
+        return None
+    for name in sorted(os.listdir(cache_dir)):
+        meta_path = os.path.join(cache_dir, name, "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                recorded = json.load(f).get("source")
+        except (OSError, ValueError):
+            continue
+        if recorded == source:
+            return os.path.join(cache_dir, name)
+    return None
+
+
+def record_cache_source(cache_path, source):
+    """更新已有缓存 meta.json 中的源数据指纹 (内容未变、只是 mtime 变了时)，写临时文件后原子替换"""
+    meta_path = os.path.join(cache_path, "meta.json")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("source") == source:
+        return
+    meta["source"] = source
+    tmp_path = f"{meta_path}.{os.getpid()}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+
+def read_source_columns(path, digest):
+    """
+    只读地解析人口源数据：缺少品牌偏好列的旧版数据在内存中补齐，不再回写源文件。
+    补齐用的随机数以源数据哈希为种子，同一份数据每次得到相同的品牌偏好。
+    """
+    population_df = read_population(path)
+    if 'brand_preference' not in population_df.columns or 'brand_loyalty' not in population_df.columns:
+        print("ℹ️  人口数据缺少品牌偏好列，已在内存中补齐 (源文件保持不变)")
+        ShanghaiCustomerGenerator(seed=int(digest[:16], 16)).add_brand_preferences(population_df)
+    return split_columns(population_df)
+
+
+def save_population_cache(cache_path, columns, numeric, categorical, text, source=None):
+    """
+    把列数据写成 .npy 文件 + meta.json (source 为源数据路径与文件指纹)。先写本进程独有的临时目录再原子重命名，中途失败不会留下半份缓存；
+    多个进程 (如分片运行) 同时冷启动时，先完成的生效，其余的丢弃自己的临时目录。
+    """
+    tmp_path = f"{cache_path}.{os.getpid()}.part"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    meta = {"version": CACHE_FORMAT_VERSION, "columns": columns, "numeric": [], "categorical": {}, "text": [],
+            "source": source}
+    for k, column in enumerate(columns):
+        if column in numeric:
+            np.save(os.path.join(tmp_path, f"{k}.npy"), numeric[column])
+            meta["numeric"].append(column)
+        elif column in categorical:
+            codes, categories = categorical[column]
+            np.save(os.path.join(tmp_path, f"{k}.npy"), codes)
+            meta["categorical"][column] = categories
+        else:
+            np.save(os.path.join(tmp_path, f"{k}.npy"), text[column].data)
+            np.save(os.path.join(tmp_path, f"{k}.offsets.npy"), text[column].offsets)
+            meta["text"].append(column)
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        if not os.path.exists(os.path.join(cache_path, "meta.json")):
+            raise
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_population_cache(cache_path, columns=None):
+    """内存映射读取缓存，columns 不为空时只打开其中的列；返回 PopulationStore 的构造参数"""
+    with open(os.path.join(cache_path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    selected = [c for c in meta["columns"] if columns is None or c in columns]
+    numeric, categorical, text = {}, {}, {}
+    for column in selected:
+        k = meta["columns"].index(column)
+        array = np.load(os.path.join(cache_path, f"{k}.npy"), mmap_mode="r")
+        if column in meta["numeric"]:
+            numeric[column] = array
+        elif column in meta["categorical"]:
+            categorical[column] = (array, meta["categorical"][column])
+        else:
+            text[column] = PackedStrings(array, np.load(os.path.join(cache_path, f"{k}.offsets.npy"), mmap_mode="r"))
+    return selected, numeric, categorical, text
+
+
+def project_columns(parts, columns):
+    """只保留 columns 中的列"""
+    all_columns, numeric, categorical, text = parts
+    keep = [c for c in all_columns if c in columns]
+    return (keep, {c: v for c, v in numeric.items() if c in keep},
+            {c: v for c, v in categorical.items() if c in keep}, {c: v for c, v in text.items() if c in keep})
+
+
+def load_population_store(path, columns=None, cache_dir=POPULATION_CACHE_DIR):
+    """
+    加载人口数据为 PopulationStore，返回 (store, 加载信息)。
+    源数据只读；首次加载 (冷启动) 解析源数据并在 cache_dir 下写入以源数据哈希为键的二进制缓存，
+    之后 (热启动) 直接内存映射缓存。源数据的路径与文件指纹 (大小, mtime_ns) 和某个缓存的 meta.json 一致时
+    直接使用该缓存，不再读取整份源数据计算哈希。cache_dir 为 None 时不使用缓存。
+    加载信息: {"mode": cold / warm / memory, "seconds": 耗时, "cache_path": 缓存目录}
+    """
+    start = time.perf_counter()
+    mode = "warm"
+    cache_path = None
+    if not cache_dir:
+        mode = "memory"
+        parts = read_source_columns(path, source_digest(path))
+        if columns is not None:
+            parts = project_columns(parts, columns)
+    else:
+        source = {"path": os.path.abspath(path), "stat": source_stat(path)}
+        cache_path = find_cache_by_stat(cache_dir, source)
+        if cache_path is None:
+            digest = source_digest(path)
+            cache_path = os.path.join(cache_dir, digest[:16])
+            if os.path.exists(os.path.join(cache_path, "meta.json")):
+                # 内容未变 (如文件被重新复制过)：记下新的指纹，下次热启动不必再算哈希
+                record_cache_source(cache_path, source)
+            else:
+                mode = "cold"
+                save_population_cache(cache_path, *read_source_columns(path, digest), source=source)
+        parts = load_population_cache(cache_path, columns)
+    store = PopulationStore(*parts)
+    return store, {"mode": mode, "seconds": time.perf_counter() - start, "cache_path": cache_path}
+
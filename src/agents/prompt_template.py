@@ -0,0 +1,275 @@
+from src.llm.tokens import estimate_tokens
+
+NONE_OPTION = "【选项 None】不买了 (原因：都不想喝、嫌贵或太远)\n"
+
+DECISION_TASK = (
+    "【决策任务】\n"
+    "请综合考虑你的【消费水平】、【口味偏好】、【步行意愿】以及商家的【品牌调性】做出最符合你人设的选择。\n"
+    "请严格返回 JSON 格式数据，包含以下字段：\n"
+    "{\n"
+    "  \"decision\": \"选中的选项ID (如 Shop_1_Walk, Shop_2_Delivery 或 None)\",\n"
+    "  \"brand\": \"购买的品牌名称 (如果不买，请填 null)\",\n"
+    "  \"method\": \"购买方式，填 '自提' 或 '外卖' (如果不买，请填 null)\",\n"
+    "  \"item\": \"购买的具体单品名称 (如果不买，请填 null)\",\n"
+    "  \"price\": 最终需要支付的金额数字 (如果不买，请填 0),\n"
+    "  \"reason\": \"你的理由 (请用简体中文，限制在15个字以内，必须符合你的人设)\"\n"
+    "}"
+)
+
+# 提示词布局：classic=人设放 system、全部方案放 user；
+# prefix=把规则、门店目录、输出格式等整次运行不变的内容放在最前面的 system 消息里，
+# 顾客人设与个性化方案放在最后，最大化服务端的前缀缓存 (context caching) 命中
+PROMPT_LAYOUTS = ("classic", "prefix")
+
+PERSONA_HEADER = "【你的人设】\n"
+
+PREFIX_ROLE = "你将扮演一位生活在上海、正在华东师范大学-环球港商圈买咖啡的消费者。用户消息会给出你的人设、当前位置和系统初筛出的候选方案。\n"
+
+# 批量决策：一次请求打包多位顾客，每位顾客一个区块，模型返回 {"decisions": [...]}
+BATCH_CUSTOMER_HEADER = "===== 顾客 {customer_id} =====\n"
+
+BATCH_ROLE = "你将依次扮演多位生活在上海、正在华东师范大学-环球港商圈买咖啡的消费者。用户消息按顾客分块给出每个人的人设、当前位置和系统初筛出的候选方案。\n"
+
+BATCH_TASK = (
+    "\n【批量决策】\n"
+    "本次请求包含多位互不相关的顾客，请逐一代入各自的人设独立决策，不要互相参考。\n"
+    "请严格返回 JSON 对象 {\"decisions\": [...]}，数组中每位顾客恰好一条、按出现顺序排列，\n"
+    "每条包含 \"customer_id\" (与区块标题中的编号一致) 以及上面单人决策要求的全部字段；\n"
+    "decision 只能是该顾客自己区块里的选项ID或 None。"
+)
+
+DECISION_FIELDS = ("decision", "brand", "method", "item", "price", "reason")
+
+
+class DecisionPromptTemplate:
+    """
+    决策提示词模板。
+    门店介绍、活动公告、JSON 输出要求等与顾客无关的片段在构造时渲染一次 (连同其 token 数)，
+    每位顾客只拼接坐标、候选商品、价格、距离等个性化字段。
+    同一次运行 (同一组门店与平台规则) 共用一个实例。
+    """
+
+    def __init__(self, shops, platform_rules=None, top_n=3, layout="classic"):
+        if layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"未知的提示词布局: {layout}。可选值: {list(PROMPT_LAYOUTS)}")
+        self.layout = layout
+        self.event_notice = (
+            f"!!! 注意：现在是【{platform_rules['event_name']}】活动期间 !!!\n"
+            if platform_rules and platform_rules.get('event_name') else ""
+        )
+        self.screening_notice = f"系统已根据【品牌偏好/距离/排队/价格】进行初筛，仅展示Top {top_n} 个候选。\n"
+
+        # 门店静态片段：步行选项的品牌介绍、外卖选项的标题前缀
+        # (prefix 布局下品牌介绍统一放进门店目录，选项里只保留简短标题)
+        self.walk_heads = {}
+        self.delivery_heads = {}
+        catalog = []
+        for shop in shops:
+            profile = (
+                f"   - 品牌调性: {shop['business_model']}\n"
+                f"   - 常驻活动: {shop['promotions']}\n"
+            )
+            if layout == "prefix":
+                catalog.append(f"[{shop['id']}] {shop['brand_name']} ({shop['category']})\n{profile}")
+                walk_head = f"【选项 {shop['id']}_Walk】步行去 {shop['brand_name']} (门店介绍见目录 {shop['id']})\n"
+            else:
+                walk_head = f"【选项 {shop['id']}_Walk】步行去 {shop['brand_name']} ({shop['category']})\n{profile}"
+            self.walk_heads[shop['id']] = self._segment(walk_head)
+            self.delivery_heads[shop['id']] = self._segment(
+                f"【选项 {shop['id']}_Delivery】点 {shop['brand_name']} (外卖) "
+            )
+        self._brand_notices = {}
+
+        # prefix 布局的共享前缀：同一次运行中所有请求逐字相同
+        self.shared_prefix = ""
+        if layout == "prefix":
+            self.shared_prefix = (
+                PREFIX_ROLE
+                + self.event_notice
+                + "\n【商圈门店目录】\n" + "\n".join(catalog) + "\n"
+                + self.screening_notice
+                + DECISION_TASK
+            )
+        self._prefix_tokens = estimate_tokens(self.shared_prefix)
+        self._persona_header_tokens = estimate_tokens(PERSONA_HEADER + "\n\n")
+
+        self._head_tokens = estimate_tokens(self.event_notice) + estimate_tokens(self.screening_notice)
+        self._none_tokens = estimate_tokens(NONE_OPTION)
+        self._tail_tokens = self._none_tokens + estimate_tokens(DECISION_TASK)
+
+        # 批量请求的 system 消息：prefix 布局在共享前缀后追加批量说明，仍保持整次运行逐字相同
+        if layout == "prefix":
+            self.batch_system = self.shared_prefix + BATCH_TASK
+        else:
+            self.batch_system = BATCH_ROLE + DECISION_TASK + BATCH_TASK
+        self._batch_system_tokens = estimate_tokens(self.batch_system)
+
+        # token 估算累计 (build_messages 计入 system + user 两条消息)
+        self.calls = 0
+        self.total_tokens = 0
+        self.last_tokens = 0
+        self.last_options = []
+
+    @staticmethod
+    def _segment(text):
+        return text, estimate_tokens(text)
+
+    def _brand_notice(self, brand_name):
+        if brand_name not in self._brand_notices:
+            text = f"你对{brand_name}有明显偏好，请优先考虑该品牌。\n" if brand_name else ""
+            self._brand_notices[brand_name] = self._segment(text)
+        return self._brand_notices[brand_name]
+
+    def render(self, location, brand_name, top_shops, include_task=True):
+        """
+        拼接单个顾客的方案部分 (classic 布局下即完整的 user prompt)，last_tokens 记录其预估 token 数，
+        last_options 记录本次渲染出的选项ID。
+        top_shops 结构同 Customer.shortlist_shops 的返回值；brand_name 为偏好品牌的展示名 (可为空)。
+        include_task=False 时省略末尾的决策任务 (批量请求把它统一放在 system 消息里)。
+        """
+        options = []
+        if self.layout == "prefix":
+            # 活动公告与初筛说明已在共享前缀里
+            parts = ["", f"你当前在地图上的坐标是: {location}。\n", ""]
+            tokens = 0
+        else:
+            parts = [self.event_notice, f"你当前在地图上的坐标是: {location}。\n", self.screening_notice]
+            tokens = self._head_tokens
+        dynamic = [parts[1]]
+
+        notice, notice_tokens = self._brand_notice(brand_name)
+        parts.append(notice)
+        parts.append("根据你的位置，你眼前的咖啡消费方案如下：\n\n")
+        dynamic.append(parts[-1])
+        tokens += notice_tokens
+
+        for score, shop, metrics, item_name, item_price, prices in top_shops:
+            if metrics['distance'] <= 2500:
+                head, head_tokens = self.walk_heads[shop['id']]
+                body = (
+                    f"   - 推荐商品: {item_name} (原价: {item_price}元, 叠加平台优惠后到手估算: {prices['pickup_price']}元)\n"
+                    f"   - 物理距离: {metrics['distance']}米 (需步行约 {metrics['walk_time']} 分钟) | 排队: 约 {shop['queue_time']} 分钟\n"
+                    f"   - 综合评分: {score}\n\n"
+                )
+                parts.append(head)
+                parts.append(body)
+                dynamic.append(body)
+                tokens += head_tokens
+                options.append(f"{shop['id']}_Walk")
+
+            if prices['can_deliver'] and shop.get('supports_delivery', True):
+                head, head_tokens = self.delivery_heads[shop['id']]
+                promo_text = f"(当前优惠: {prices['discount_tags']})" if prices['discount_tags'] else ""
+                coupon_info = f", 已减红包 {prices['delivery_coupon']}元" if prices.get('delivery_coupon', 0) > 0 else ""
+                body = (
+                    f"{promo_text}\n"
+                    f"   - 推荐商品: {item_name} (原价: {item_price}元, 外卖到手总价: {prices['delivery_price']}元, 含运费 {prices['delivery_fee_real']}元{coupon_info})\n"
+                    f"   - 预估等待: {metrics['delivery_time']} 分钟\n"
+                    f"   - 综合评分: {score}\n\n"
+                )
+                parts.append(head)
+                parts.append(body)
+                dynamic.append(body)
+                tokens += head_tokens
+                options.append(f"{shop['id']}_Delivery")
+
+        parts.append(NONE_OPTION)
+        if self.layout == "prefix" or not include_task:
+            tokens += self._none_tokens
+        else:
+            parts.append("\n")
+            parts.append(DECISION_TASK)
+            tokens += self._tail_tokens
+        tokens += sum(estimate_tokens(text) for text in dynamic)
+
+        self.last_tokens = tokens
+        self.last_options = options
+        return "".join(parts)
+
+    def build_messages(self, persona, location, brand_name, top_shops):
+        """
+        按布局组装 (system, user) 两条消息，并累计整条请求的预估 prompt tokens。
+        persona 为顾客人设 (Customer.system_prompt)。
+        """
+        user_prompt = self.render(location, brand_name, top_shops)
+        if self.layout == "prefix":
+            system_prompt = self.shared_prefix
+            user_prompt = f"{PERSONA_HEADER}{persona}\n\n{user_prompt}"
+            tokens = self._prefix_tokens + self._persona_header_tokens + self.last_tokens + estimate_tokens(persona)
+        else:
+            system_prompt = persona
+            tokens = self.last_tokens + estimate_tokens(persona)
+
+        self.calls += 1
+        self.total_tokens += tokens
+        self.last_tokens = tokens
+        return system_prompt, user_prompt
+
+    def build_batch_messages(self, entries):
+        """
+        把多位顾客打包成一次请求的 (system, user)，last_tokens 为整条请求的预估 prompt tokens。
+        entries 为 (customer_id, persona, location, brand_name, top_shops) 列表；
+        同时返回 {customer_id: 该顾客可选的选项ID列表}，供 validate_batch_decisions 校验。
+        """
+        blocks = []
+        allowed = {}
+        tokens = self._batch_system_tokens
+        for customer_id, persona, location, brand_name, top_shops in entries:
+            body = self.render(location, brand_name, top_shops, include_task=False)
+            header = BATCH_CUSTOMER_HEADER.format(customer_id=customer_id)
+            blocks.append(f"{header}{PERSONA_HEADER}{persona}\n\n{body}")
+            allowed[customer_id] = self.last_options
+            tokens += self.last_tokens + estimate_tokens(header + persona) + self._persona_header_tokens
+
+        self.calls += 1
+        self.total_tokens += tokens
+        self.last_tokens = tokens
+        return self.batch_system, "\n".join(blocks), allowed
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "estimated_prompt_tokens": self.total_tokens,
+            "avg_prompt_tokens": round(self.total_tokens / self.calls, 1) if self.calls else 0
+        }
+
+
+def _valid_decision(entry, options):
+    """单条批量决策是否满足单人决策的输出格式，且选项属于该顾客"""
+    if any(field not in entry for field in DECISION_FIELDS) or not isinstance(entry["reason"], str):
+        return False
+    decision = entry["decision"]
+    if decision == "None":
+        return True
+    if decision not in options:
+        return False
+    price = entry["price"]
+    if isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0:
+        return False
+    method = "外卖" if decision.endswith("_Delivery") else "自提"
+    return (entry["method"] == method
+            and isinstance(entry["brand"], str) and entry["brand"]
+            and isinstance(entry["item"], str) and entry["item"])
+
+
+def validate_batch_decisions(result, allowed):
+    """
+    严格校验批量决策结果，只返回合格条目 {customer_id: 决策字典}。
+    allowed 为 build_batch_messages 返回的 {customer_id: 选项ID列表}；
+    编号对不上、重复、缺字段、选了别人的选项等条目一律丢弃，由调用方对缺失的顾客改走单人决策。
+    """
+    decisions = result.get("decisions") if isinstance(result, dict) else None
+    if not isinstance(decisions, list):
+        return {}
+    # 模型可能把编号写成字符串或数字，统一按字符串对齐
+    id_lookup = {str(customer_id): customer_id for customer_id in allowed}
+    valid = {}
+    for entry in decisions:
+        if not isinstance(entry, dict):
+            continue
+        customer_id = id_lookup.get(str(entry.get("customer_id")))
+        if customer_id is None or customer_id in valid:
+            continue
+        if _valid_decision(entry, allowed[customer_id]):
+            valid[customer_id] = {field: entry[field] for field in DECISION_FIELDS}
+    return valid
@@ -0,0 +1,186 @@
+import numpy as np
+from src.agents.customer import TOP_N_SHOPS, PREFERENCE_KEYWORDS, select_menu_item, lookup_menu_item
+
+# 口味偏好的类别编号：关键词表中的偏好依次编号，其余口味 (如 Tea) 统一归为最后一类 (菜单兜底项)
+PREFERENCE_CATEGORIES = list(PREFERENCE_KEYWORDS.keys())
+OTHER_CATEGORY = len(PREFERENCE_CATEGORIES)
+
+
+class ShortlistResult:
+    """批量预筛结果：顾客×门店矩阵 + 每位顾客的 Top-N 门店下标"""
+
+    def __init__(self, shortlister, top_idx, scores, distance, walk_time, delivery_time,
+                 categories, pickup_raw, delivery_raw, delivery_fee):
+        self.shortlister = shortlister
+        self.top_idx = top_idx
+        self.scores = scores
+        self.distance = distance
+        self.walk_time = walk_time
+        self.delivery_time = delivery_time
+        self.categories = categories
+        self.pickup_raw = pickup_raw
+        self.delivery_raw = delivery_raw
+        self.delivery_fee = delivery_fee
+
+    def __len__(self):
+        return len(self.top_idx)
+
+    def entries(self, i):
+        """
+        还原第 i 位顾客的 Top-N 候选，结构与 Customer.shortlist_shops 完全一致。
+        展示用的数值在这里按 Python 的 round 规则取整，保证提示词与逐店计算的结果逐字相同。
+        """
+        sl = self.shortlister
+        cat = self.categories[i]
+        entries = []
+        for j in self.top_idx[i]:
+            distance = int(self.distance[i, j])
+            metrics = {
+                "distance": distance,
+                "walk_time": int(self.walk_time[i, j]),
+                "delivery_time": int(self.delivery_time[i, j])
+            }
+            prices = {
+                "pickup_price": round(max(0, float(self.pickup_raw[i, j])), 1),
+                "delivery_price": round(max(0, float(self.delivery_raw[i, j])), 1),
+                "delivery_fee_real": int(self.delivery_fee[i, j]),
+                "delivery_coupon": int(sl.delivery_coupon[cat, j]),
+                "can_deliver": distance <= 3000,
+                "discount_tags": sl.discount_tags[cat][j]
+            }
+            item_name = sl.item_names[cat][j]
+            item_price = float(sl.item_prices[cat, j])
+            score = round(float(self.scores[i, j]), 2)
+            entries.append((score, sl.shops[j], metrics, item_name, item_price, prices))
+        return entries
+
+
+class ShopShortlister:
+    """
+    向量化的 Top-N 门店预筛。
+    与 Customer.shortlist_shops 的逐店逻辑等价，但一次性用 NumPy 广播计算整个 顾客×门店 矩阵：
+    距离、步行/外卖时间、自提/外卖到手价以及综合评分。
+    只依赖门店与平台规则，一次构建后可对任意多批顾客复用。
+    """
+
+    def __init__(self, shops, platform_rules=None, top_n=TOP_N_SHOPS):
+        self.shops = shops
+        self.platform_rules = platform_rules or {}
+        self.top_n = min(top_n, len(shops))
+
+        self.shop_locations = np.array([shop['location'] for shop in shops], dtype=np.float64).reshape(-1, 2)
+        self.refresh_queue_times()
+        self.brand_ids = [shop.get('brand_id') for shop in shops]
+        self._brand_codes = {brand: code for code, brand in enumerate(dict.fromkeys(self.brand_ids))}
+        self.shop_brand_codes = np.array([self._brand_codes[b] for b in self.brand_ids])
+
+        self._build_price_tables()
+
+    def refresh_queue_times(self):
+        """重新读取各门店的排队时长 (分时段仿真中排队随客流实时变化)"""
+        self.queue_times = np.array([float(shop.get('queue_time', 0)) for shop in self.shops])
+
+    def _build_price_tables(self):
+        """按 (口味类别, 门店) 预先计算商品、原价、平台满减与外卖红包 —— 这些都与顾客位置无关"""
+        rules = self.platform_rules
+        n_cat = OTHER_CATEGORY + 1
+        n_shop = len(self.shops)
+        self.item_names = [[None] * n_shop for _ in range(n_cat)]
+        self.item_prices = np.zeros((n_cat, n_shop))
+        self.subsidy = np.zeros((n_cat, n_shop))
+        self.delivery_coupon = np.zeros((n_cat, n_shop), dtype=np.int64)
+        self.discount_tags = [[""] * n_shop for _ in range(n_cat)]
+
+        free_delivery = bool(rules.get('free_delivery_campaign', False))
+        coupons_enabled = bool(rules.get('delivery_coupons_enabled', False))
+        for cat in range(n_cat):
+            preference = PREFERENCE_CATEGORIES[cat] if cat < OTHER_CATEGORY else None
+            for j, shop in enumerate(self.shops):
+                if shop.get('menu_index') is not None:
+                    item_name, base_price = lookup_menu_item(shop['menu_index'], preference)
+                else:
+                    item_name, base_price = select_menu_item(shop['menu'], preference)
+                self.item_names[cat][j] = item_name
+                self.item_prices[cat, j] = base_price
+
+                tags = []
+                subsidy = 0
+                if rules and base_price >= rules.get('coupon_threshold', 999):
+                    subsidy = rules.get('coupon_amount', 0)
+                    tags.append(f"满减-{subsidy}")
+                self.subsidy[cat, j] = subsidy
+
+                before_coupon = base_price - subsidy
+                coupon = 0
+                if coupons_enabled:
+                    if before_coupon >= 30:
+                        coupon = 10
+                        tags.append("外卖满30减10")
+                    elif before_coupon >= 15:
+                        coupon = 5
+                        tags.append("外卖满15减5")
+                    elif before_coupon >= 10:
+                        coupon = 3
+                        tags.append("外卖满10减3")
+                self.delivery_coupon[cat, j] = coupon
+
+                if free_delivery:
+                    tags.append("免运费")
+                self.discount_tags[cat][j] = ", ".join(tags)
+
+    def preference_codes(self, preferences):
+        lookup = {p: i for i, p in enumerate(PREFERENCE_CATEGORIES)}
+        return np.array([lookup.get(p, OTHER_CATEGORY) for p in preferences], dtype=np.int64)
+
+    def brand_codes(self, brands):
+        return np.array([self._brand_codes.get(b, -1) if isinstance(b, str) else -1 for b in brands], dtype=np.int64)
+
+    def score(self, locations, preference_codes, brand_codes, loyalties):
+        """
+        Args:
+            locations: (n, 2) 顾客坐标
+            preference_codes: (n,) 口味类别编号 (见 preference_codes)
+            brand_codes: (n,) 偏好品牌编号，-1 表示无偏好或不在地图上
+            loyalties: (n,) 品牌忠诚度
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        cats = np.asarray(preference_codes, dtype=np.int64)
+        loyalties = np.asarray(loyalties, dtype=np.float64)
+
+        # 距离与时间 (与逐店逻辑一致：距离向下取整到米)
+        delta = locations[:, None, :] - self.shop_locations[None, :, :]
+        distance = np.sqrt((delta ** 2).sum(axis=2)).astype(np.int64)
+        walk_time = np.maximum(1, distance // 80)
+        delivery_time = 30 + distance // 500
+
+        # 价格：按口味类别取出每家店的商品原价与优惠
+        base = self.item_prices[cats]
+        subsidy = self.subsidy[cats]
+        pickup_raw = base - subsidy
+        if self.platform_rules.get('free_delivery_campaign', False):
+            delivery_fee = np.zeros_like(distance)
+        else:
+            delivery_fee = np.where(distance > 3000, 999, 3 + distance // 1000)
+        delivery_raw = pickup_raw - self.delivery_coupon[cats] + delivery_fee
+
+        # 综合评分
+        brand_match = np.asarray(brand_codes)[:, None] == self.shop_brand_codes[None, :]
+        scores = np.where(brand_match, 60.0 * loyalties[:, None], 5.0 * (1.0 - loyalties[:, None]))
+        scores = scores + np.maximum(0.0, 30.0 - distance / 100.0)
+        scores = scores + np.maximum(0.0, 12.0 - self.queue_times)[None, :]
+        scores = scores + np.maximum(0.0, 20.0 - base)
+
+        # 与 list.sort(reverse=True) 一致：按两位小数的分数降序，同分保持门店原顺序
+        top_idx = np.argsort(-np.round(scores, 2), axis=1, kind='stable')[:, :self.top_n]
+
+        return ShortlistResult(self, top_idx, scores, distance, walk_time, delivery_time,
+                               cats, pickup_raw, delivery_raw, delivery_fee)
+
+    def score_customers(self, customers):
+        """对一批 Customer 对象做预筛，结果第 i 行对应 customers[i]"""
+        return self.score(
+            [c.location for c in customers],
+            self.preference_codes([c.preference for c in customers]),
+            self.brand_codes([c.preferred_brand for c in customers]),
+            [c.brand_loyalty for c in customers]
+        )
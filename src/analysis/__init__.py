@@ -5,6 +5,12 @@
   基于仿真结果的多维度数据分析与可视化
 """
 
-from .analytics import CoffeeMarketAnalyzer
-
 __all__ = ["CoffeeMarketAnalyzer"]
+
+
+def __getattr__(name):
+    # 按需导入：仿真主循环只用到 src.analysis.online，不必连带加载 pandas 与离线分析模块
+    if name == "CoffeeMarketAnalyzer":
+        from .analytics import CoffeeMarketAnalyzer
+        return CoffeeMarketAnalyzer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -13,10 +13,36 @@
 
 import os
 import sys
+import functools
 import pandas as pd
 import numpy as np
 from collections import Counter, defaultdict
 from pathlib import Path
+from src.environment.result_writer import read_results
+from src.analysis.segments import INCOME_BINS, INCOME_SEGMENTS
+
+
+def memoized(method):
+    """
+    分析结果缓存：同一份数据上重复调用 (如先生成报告再画图) 直接返回缓存结果的副本，调用方修改副本不影响缓存。
+    参数不可哈希 (如传入分组 Series) 时不缓存；数据变化后缓存失效，见 CoffeeMarketAnalyzer.data_signature
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        key = (method.__name__,) + args
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args)
+        
+        signature = self.data_signature()
+        if signature != self._results_signature:
+            self._results.clear()
+            self._results_signature = signature
+        if key not in self._results:
+            self._results[key] = method(self, *args)
+        return self._results[key].copy()
+    return wrapper
 
 
 class CoffeeMarketAnalyzer:
@@ -27,22 +53,52 @@ class CoffeeMarketAnalyzer:
         初始化分析器
         
         Args:
-            csv_path (str): 仿真结果 CSV 文件路径
+            csv_path (str): 仿真结果 CSV 文件路径 (旁边有同名的 Parquet / Feather 文件时优先读取)，也可以直接是列式文件
         """
         if not os.path.exists(csv_path):
             raise FileNotFoundError(f"结果文件不存在: {csv_path}")
         
         self.csv_path = csv_path
-        self.df = pd.read_csv(csv_path, encoding='utf-8')
-        self.total_customers = len(self.df)
-        self.total_sales = self.df['price'].sum()
-        
+        self._results = {}
+        self._results_signature = None
+        df, self.source_path = read_results(csv_path)
+        # 价格以 float32 存储；分析时转回 float64 并按分取整，金额合计与 CSV 中的原值一致
+        df['price'] = df['price'].astype('float64').round(2)
+        self.df = df
+        
+        if self.source_path != csv_path:
+            print(f"🗜️  读取列式结果文件: {self.source_path}")
         print(f"✅ 已加载仿真数据: {self.total_customers} 名顾客, 总销售额: ¥{self.total_sales:.2f}")
     
+    @property
+    def df(self):
+        return self._df
+    
+    @df.setter
+    def df(self, df):
+        """替换数据：重新计算总量并清空分析结果缓存"""
+        self._df = df
+        self.total_customers = len(df)
+        self.total_sales = df['price'].sum()
+        self.invalidate()
+    
+    def data_signature(self):
+        """
+        数据签名 (对象、行列数与列名)：替换 DataFrame 或增删行列后签名改变，缓存的分析结果随之失效。
+        原地修改单元格的值不会改变签名，此时需调用 invalidate()
+        """
+        return id(self._df), self._df.shape, tuple(self._df.columns)
+    
+    def invalidate(self):
+        """清空缓存的分析结果"""
+        self._results.clear()
+        self._results_signature = None
+    
     # ========================================================================
     # 🏪 品牌销售分析
     # ========================================================================
     
+    @memoized
     def brand_sales_analysis(self):
         """
         品牌销售统计分析
@@ -50,28 +106,17 @@ class CoffeeMarketAnalyzer:
         Returns:
             dict: 包含销售量、销售额、市场份额等信息
         """
-        brand_stats = {
-            'brand': [],
-            'quantity': [],
-            'revenue': [],
-            'avg_price': [],
-            'market_share': []
-        }
-        
-        for brand in self.df['brand'].unique():
-            brand_data = self.df[self.df['brand'] == brand]
-            quantity = len(brand_data)
-            revenue = brand_data['price'].sum()
-            avg_price = revenue / quantity if quantity > 0 else 0
-            market_share = (revenue / self.total_sales * 100) if self.total_sales > 0 else 0
-            
-            brand_stats['brand'].append(brand)
-            brand_stats['quantity'].append(quantity)
-            brand_stats['revenue'].append(revenue)
-            brand_stats['avg_price'].append(avg_price)
-            brand_stats['market_share'].append(market_share)
-        
-        result_df = pd.DataFrame(brand_stats)
+        grouped = self.df.groupby('brand', sort=False, observed=True)['price']
+        quantity = grouped.size()
+        revenue = grouped.sum()
+        result_df = pd.DataFrame({
+            'brand': quantity.index.astype(object),
+            'quantity': quantity.values,
+            'revenue': revenue.values,
+            # 均价只按有价格的笔数计算 (价格无法解析的记录计入笔数，不计入均价)
+            'avg_price': (revenue / grouped.count()).values,
+            'market_share': (revenue / self.total_sales * 100).values if self.total_sales > 0 else 0
+        })
         result_df = result_df.sort_values('revenue', ascending=False)
         result_df['quantity_share'] = (result_df['quantity'] / self.total_customers * 100).round(2)
         
@@ -81,165 +126,142 @@ class CoffeeMarketAnalyzer:
     # 👥 消费者分层分析
     # ========================================================================
     
+    def _segment_keys(self, dimension):
+        """分组键：列名取对应列，也可以直接传入与 self.df 等长的 Series (如收入分段)"""
+        return self.df[dimension] if isinstance(dimension, str) else dimension
+    
+    def value_counts_by_segment(self, dimension, column):
+        """
+        各分组内 column 的取值计数，一次 groupby 完成
+        
+        Returns:
+            dict: {分组: [(取值, 次数), ...]}，按次数降序，次数相同按组内首次出现的顺序 (与 value_counts 一致)
+        """
+        keys = self._segment_keys(dimension)
+        counts = self.df.groupby([keys, self.df[column]], sort=False, observed=True).size()
+        counts = counts.sort_values(ascending=False, kind='stable')
+        result = defaultdict(list)
+        for (segment, value), count in counts.items():
+            result[segment].append((value, count))
+        return result
+    
+    @memoized
+    def segment_stats(self, dimension):
+        """
+        分群统计引擎：对一个维度做一次 groupby，得到每个分组的顾客数、购买笔数、消费额、
+        外卖占比与 TOP 3 品牌。各分层分析共用，代价与行数成线性，与分组数无关。
+        品牌计数与外卖笔数按分组编号用 bincount 累计，不再为它们各做一次 groupby。
+        
+        Args:
+            dimension: 列名，或与 self.df 等长的分组 Series
+        
+        Returns:
+            DataFrame: 以分组为索引 (按首次出现的顺序)，列为 total_customers, total_purchases,
+                       total_spend, avg_spend, top_brands, delivery_ratio (均未取整)
+        """
+        keys = self._segment_keys(dimension)
+        grouped = self.df.groupby(keys, sort=False, observed=True)
+        stats = pd.DataFrame({
+            'total_customers': grouped['customer_id'].nunique(),
+            'total_purchases': grouped.size(),
+            'total_spend': grouped['price'].sum(),
+        })
+        stats['avg_spend'] = stats['total_spend'] / stats['total_purchases']
+        
+        # 分组编号：按首次出现的顺序，与 groupby(sort=False) 的行顺序一致，分组键缺失的行为 -1
+        group_ids, _ = pd.factorize(keys)
+        n_groups = len(stats)
+        in_group = group_ids >= 0
+        
+        # 偏好品牌（TOP 3）：(分组, 品牌) 编号上计数，笔数相同时按组内首次出现的顺序 (与 value_counts 一致)
+        brand_codes, brands = pd.factorize(self.df['brand'])
+        valid = in_group & (brand_codes >= 0)
+        pair_ids = group_ids[valid] * len(brands) + brand_codes[valid]
+        counts = np.bincount(pair_ids, minlength=n_groups * len(brands)).reshape(n_groups, len(brands))
+        firsts = np.full(n_groups * len(brands), len(self.df))
+        np.minimum.at(firsts, pair_ids, np.flatnonzero(valid))
+        order = np.lexsort((firsts.reshape(n_groups, len(brands)), -counts), axis=-1)[:, :3]
+        stats['top_brands'] = [
+            ', '.join(f"{brands[k]}({counts[row, k]})" for k in order[row] if counts[row, k] > 0)
+            for row in range(n_groups)
+        ]
+        
+        # 购买方式占比
+        delivery = np.bincount(group_ids[in_group], weights=(self.df['method'] == '外卖').to_numpy()[in_group],
+                               minlength=n_groups)
+        stats['delivery_ratio'] = delivery / stats['total_purchases'] * 100
+        return stats
+    
+    def _segment_report(self, dimension, name, columns, stats=None):
+        """segment_stats -> 报表：分组名作为第一列，金额与占比保留两位小数"""
+        stats = self.segment_stats(dimension) if stats is None else stats
+        result_df = stats.reset_index(drop=True)
+        result_df.insert(0, name, stats.index.astype(object))
+        for column in ('total_spend', 'avg_spend', 'delivery_ratio'):
+            result_df[column] = result_df[column].round(2)
+        return result_df[[name] + columns]
+    
+    @memoized
     def age_group_analysis(self):
         """按年龄段分析购买行为"""
-        age_stats = []
+        result_df = self._segment_report('age_group', 'age_group', [
+            'total_customers', 'total_purchases', 'total_spend', 'avg_spend', 'top_brands', 'delivery_ratio'
+        ])
         
-        for age_group in self.df['age_group'].unique():
-            group_data = self.df[self.df['age_group'] == age_group]
-            
-            # 购买量和金额
-            purchases = len(group_data)
-            total_spend = group_data['price'].sum()
-            avg_spend = total_spend / purchases if purchases > 0 else 0
-            
-            # 偏好品牌（TOP 3）
-            top_brands = group_data['brand'].value_counts().head(3)
-            
-            # 购买方式占比
-            delivery_ratio = (group_data['method'] == '外卖').sum() / purchases * 100 if purchases > 0 else 0
-            
-            # 价格敏感度分布
-            price_sensitivity = group_data['price_sensitivity'].value_counts().to_dict()
-            
-            top_brands_str = ', '.join([f"{b}({c})" for b, c in zip(top_brands.index, top_brands.values)])
-            
-            age_stats.append({
-                'age_group': age_group,
-                'total_customers': len(group_data['customer_id'].unique()),
-                'total_purchases': purchases,
-                'total_spend': round(total_spend, 2),
-                'avg_spend': round(avg_spend, 2),
-                'top_brands': top_brands_str,
-                'delivery_ratio': round(delivery_ratio, 2),
-                'price_sensitivity_dist': price_sensitivity
-            })
-        
-        result_df = pd.DataFrame(age_stats).sort_values('total_spend', ascending=False)
+        # 价格敏感度分布
+        sensitivity = self.value_counts_by_segment('age_group', 'price_sensitivity')
+        result_df['price_sensitivity_dist'] = [dict(sensitivity.get(g, [])) for g in result_df['age_group']]
+        
+        result_df = result_df.sort_values('total_spend', ascending=False)
         return result_df
     
+    @memoized
     def occupation_analysis(self):
         """按职业分析购买行为"""
-        occ_stats = []
-        
-        for occupation in self.df['occupation'].unique():
-            occ_data = self.df[self.df['occupation'] == occupation]
-            
-            purchases = len(occ_data)
-            total_spend = occ_data['price'].sum()
-            avg_spend = total_spend / purchases if purchases > 0 else 0
-            
-            # 偏好品牌
-            top_brands = occ_data['brand'].value_counts().head(3)
-            
-            # 购买方式占比
-            delivery_ratio = (occ_data['method'] == '外卖').sum() / purchases * 100 if purchases > 0 else 0
-            
-            top_brands_str = ', '.join([f"{b}({c})" for b, c in zip(top_brands.index, top_brands.values)])
-            
-            occ_stats.append({
-                'occupation': occupation,
-                'total_customers': len(occ_data['customer_id'].unique()),
-                'total_purchases': purchases,
-                'total_spend': round(total_spend, 2),
-                'avg_spend': round(avg_spend, 2),
-                'top_brands': top_brands_str,
-                'delivery_ratio': round(delivery_ratio, 2)
-            })
-        
-        result_df = pd.DataFrame(occ_stats).sort_values('total_spend', ascending=False)
+        result_df = self._segment_report('occupation', 'occupation', [
+            'total_customers', 'total_purchases', 'total_spend', 'avg_spend', 'top_brands', 'delivery_ratio'
+        ])
+        result_df = result_df.sort_values('total_spend', ascending=False)
         return result_df
     
+    @memoized
     def income_segment_analysis(self):
         """按收入分层分析购买行为"""
-        # 按收入分段
-        self.df['income_segment'] = pd.cut(
-            self.df['income'],
-            bins=[0, 8000, 15000, 25000, 100000],
-            labels=['低收入(0-8K)', '中低收入(8-15K)', '中高收入(15-25K)', '高收入(25K+)']
-        )
-        
-        income_stats = []
-        
-        for segment in ['低收入(0-8K)', '中低收入(8-15K)', '中高收入(15-25K)', '高收入(25K+)']:
-            seg_data = self.df[self.df['income_segment'] == segment]
-            
-            if len(seg_data) == 0:
-                continue
-            
-            purchases = len(seg_data)
-            total_spend = seg_data['price'].sum()
-            avg_spend = total_spend / purchases if purchases > 0 else 0
-            
-            # 偏好品牌
-            top_brands = seg_data['brand'].value_counts().head(3)
-            
-            # 购买方式占比
-            delivery_ratio = (seg_data['method'] == '外卖').sum() / purchases * 100 if purchases > 0 else 0
-            
-            # 平均收入
-            avg_income = seg_data['income'].mean()
-            
-            top_brands_str = ', '.join([f"{b}({c})" for b, c in zip(top_brands.index, top_brands.values)])
-            
-            income_stats.append({
-                'income_segment': segment,
-                'avg_income': round(avg_income, 2),
-                'total_customers': len(seg_data['customer_id'].unique()),
-                'total_purchases': purchases,
-                'total_spend': round(total_spend, 2),
-                'avg_spend': round(avg_spend, 2),
-                'top_brands': top_brands_str,
-                'delivery_ratio': round(delivery_ratio, 2)
-            })
-        
-        result_df = pd.DataFrame(income_stats)
-        
-        # 清理临时列
-        self.df.drop('income_segment', axis=1, inplace=True)
-        
+        # 按收入分段 (分段结果作为分组键传入，不写回 self.df)
+        segments = pd.cut(self.df['income'], bins=INCOME_BINS, labels=INCOME_SEGMENTS)
+        stats = self.segment_stats(segments)
+        # 按收入从低到高排列，没有顾客的分段不出现
+        stats = stats.reindex([s for s in INCOME_SEGMENTS if s in stats.index])
+        
+        result_df = self._segment_report(segments, 'income_segment', [
+            'total_customers', 'total_purchases', 'total_spend', 'avg_spend', 'top_brands', 'delivery_ratio'
+        ], stats=stats)
+        
+        # 平均收入
+        avg_income = self.df['income'].groupby(segments, observed=True).mean()
+        result_df.insert(1, 'avg_income', avg_income.reindex(stats.index).round(2).values)
         return result_df
     
+    @memoized
     def preference_analysis(self):
         """按咖啡偏好分析购买行为"""
-        pref_stats = []
-        
-        for preference in self.df['preference'].unique():
-            pref_data = self.df[self.df['preference'] == preference]
-            
-            purchases = len(pref_data)
-            total_spend = pref_data['price'].sum()
-            avg_spend = total_spend / purchases if purchases > 0 else 0
-            
-            # 实际购买品牌
-            top_brands = pref_data['brand'].value_counts().head(3)
-            
-            # 购买方式占比
-            delivery_ratio = (pref_data['method'] == '外卖').sum() / purchases * 100 if purchases > 0 else 0
-            
-            top_brands_str = ', '.join([f"{b}({c})" for b, c in zip(top_brands.index, top_brands.values)])
-            
-            pref_stats.append({
-                'preference': preference,
-                'total_purchases': purchases,
-                'total_spend': round(total_spend, 2),
-                'avg_spend': round(avg_spend, 2),
-                'top_brands': top_brands_str,
-                'delivery_ratio': round(delivery_ratio, 2)
-            })
-        
-        result_df = pd.DataFrame(pref_stats).sort_values('total_spend', ascending=False)
+        result_df = self._segment_report('preference', 'preference', [
+            'total_purchases', 'total_spend', 'avg_spend', 'top_brands', 'delivery_ratio'
+        ])
+        result_df = result_df.sort_values('total_spend', ascending=False)
         return result_df
     
     # ========================================================================
     # 🚗 购买方式分析
     # ========================================================================
     
+    @memoized
     def delivery_method_analysis(self):
         """外卖 vs 自提 购买方式分析"""
         method_counts = self.df['method'].value_counts()
-        method_revenue = self.df.groupby('method')['price'].sum()
-        method_avg_price = self.df.groupby('method')['price'].mean()
+        method_counts = method_counts[method_counts > 0]
+        method_revenue = self.df.groupby('method', observed=True)['price'].sum()
+        method_avg_price = self.df.groupby('method', observed=True)['price'].mean()
         
         method_stats = {
             'method': [],
@@ -264,63 +286,43 @@ class CoffeeMarketAnalyzer:
         result_df = pd.DataFrame(method_stats)
         return result_df
     
+    @memoized
     def delivery_method_by_group(self):
         """各人群的购买方式偏好"""
-        method_by_age = []
-        
-        for age_group in sorted(self.df['age_group'].unique()):
-            age_data = self.df[self.df['age_group'] == age_group]
-            
-            total = len(age_data)
-            delivery = (age_data['method'] == '外卖').sum()
-            pickup = (age_data['method'] == '自提').sum()
-            
-            method_by_age.append({
-                'age_group': age_group,
-                'delivery_count': delivery,
-                'delivery_ratio': round(delivery / total * 100, 2),
-                'pickup_count': pickup,
-                'pickup_ratio': round(pickup / total * 100, 2)
-            })
-        
-        result_df = pd.DataFrame(method_by_age)
+        methods = self.df['method']
+        grouped = pd.DataFrame({
+            'total': 1,
+            'delivery': methods == '外卖',
+            'pickup': methods == '自提'
+        }).groupby(self.df['age_group'], observed=True).sum()
+        
+        result_df = pd.DataFrame({
+            'age_group': grouped.index.astype(object),
+            'delivery_count': grouped['delivery'].values,
+            'delivery_ratio': (grouped['delivery'] / grouped['total'] * 100).round(2).values,
+            'pickup_count': grouped['pickup'].values,
+            'pickup_ratio': (grouped['pickup'] / grouped['total'] * 100).round(2).values
+        })
         return result_df
     
     # ========================================================================
     # 💰 价格敏感性分析
     # ========================================================================
     
+    @memoized
     def price_sensitivity_analysis(self):
         """价格敏感度与消费行为的关系"""
-        ps_stats = []
+        result_df = self._segment_report('price_sensitivity', 'price_sensitivity', [
+            'total_purchases', 'total_spend', 'avg_spend', 'delivery_ratio'
+        ])
+        
+        # 价格分布
+        prices = self.df.groupby('price_sensitivity', sort=False, observed=True)['price'].agg(['min', 'max', 'median'])
+        prices = prices.reindex(result_df['price_sensitivity']).round(2)
+        result_df.insert(4, 'price_min', prices['min'].values)
+        result_df.insert(5, 'price_max', prices['max'].values)
+        result_df.insert(6, 'price_median', prices['median'].values)
         
-        for sensitivity in self.df['price_sensitivity'].unique():
-            ps_data = self.df[self.df['price_sensitivity'] == sensitivity]
-            
-            purchases = len(ps_data)
-            total_spend = ps_data['price'].sum()
-            avg_spend = total_spend / purchases if purchases > 0 else 0
-            
-            # 购买方式占比
-            delivery_ratio = (ps_data['method'] == '外卖').sum() / purchases * 100 if purchases > 0 else 0
-            
-            # 价格分布
-            price_min = ps_data['price'].min()
-            price_max = ps_data['price'].max()
-            price_median = ps_data['price'].median()
-            
-            ps_stats.append({
-                'price_sensitivity': sensitivity,
-                'total_purchases': purchases,
-                'total_spend': round(total_spend, 2),
-                'avg_spend': round(avg_spend, 2),
-                'price_min': round(price_min, 2),
-                'price_max': round(price_max, 2),
-                'price_median': round(price_median, 2),
-                'delivery_ratio': round(delivery_ratio, 2)
-            })
-        
-        result_df = pd.DataFrame(ps_stats)
         # 按敏感度排序
         sensitivity_order = {'Low': 1, 'Medium': 2, 'High': 3}
         result_df['order'] = result_df['price_sensitivity'].map(sensitivity_order)
@@ -332,11 +334,15 @@ class CoffeeMarketAnalyzer:
     # 📋 决策理由分析
     # ========================================================================
     
+    @memoized
     def reason_analysis(self):
         """购买决策理由分析"""
-        # 提取关键词
-        reasons = self.df['reason'].str.split('，|、', expand=True).stack().reset_index(drop=True)
-        reason_counts = reasons.value_counts().head(15)
+        # 提取关键词：理由文本重复度很高，先对整句计数，只拆分不同的句子，再按句子出现次数累加关键词
+        sentences = self.df['reason'].value_counts(sort=False)
+        keywords = sentences.index.to_series().str.split('，|、', regex=True).explode()
+        reason_counts = pd.Series(sentences.loc[keywords.index].values, index=keywords.values)
+        reason_counts = reason_counts.groupby(level=0, sort=False).sum()
+        reason_counts = reason_counts.sort_values(ascending=False, kind='stable').head(15)
         
         reason_stats = {
             'reason': [],
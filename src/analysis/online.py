@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+☕ 咖啡市场仿真 - 在线统计模块
+
+决策一产生就累加到计数器里，运行中随时可以查看市场份额与消费统计，
+运行结束直接由累计状态出报告，不必重新读取结果 CSV。
+内存只与品牌、门店、人群分组的个数有关，与决策条数无关；状态可序列化，各分片进程的统计可以直接合并。
+"""
+
+import math
+from bisect import bisect_left
+from collections import Counter
+from src.analysis.segments import INCOME_BINS, INCOME_SEGMENTS
+
+# 分群统计的维度 (income_segment 由 income 按 INCOME_BINS 分段得到)
+SEGMENT_DIMENSIONS = ("age_group", "occupation", "preference", "price_sensitivity", "income_segment")
+
+# 价格分位数草图的相对误差 (1%)
+PRICE_SKETCH_ACCURACY = 0.01
+PRICE_QUANTILES = (25, 50, 75, 95)
+
+# 运行中每完成多少条决策打印一行实时统计
+LIVE_REPORT_EVERY = 100
+
+
+def parse_price(value):
+    """结果里的价格可能是数字、数字字符串 (LLM 输出 / 从 CSV 读回) 或空值，无法解析时返回 None"""
+    if value is None or value == "":
+        return None
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(price) else price
+
+
+def _label(value):
+    """分组 / 品牌等文本字段：None、空串与 NaN 都视为缺失"""
+    if value is None or value == "" or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def income_segment(income):
+    """月收入 -> 收入分段名，与 CoffeeMarketAnalyzer 的 pd.cut(INCOME_BINS) 一致 (左开右闭)，超出范围返回 None"""
+    income = parse_price(income)
+    if income is None:
+        return None
+    k = bisect_left(INCOME_BINS, income)
+    if 1 <= k < len(INCOME_BINS):
+        return INCOME_SEGMENTS[k - 1]
+    return None
+
+
+class QuantileSketch:
+    """
+    对数分桶的分位数草图：第 k 个桶收 (γ^(k-1), γ^k] 的样本，γ = (1+α)/(1-α)，
+    取桶的代表值时分位数的相对误差不超过 α。桶边界固定，多个草图按桶号相加即可合并。
+    """
+
+    def __init__(self, relative_accuracy=PRICE_SKETCH_ACCURACY, count=0, zeros=0, minimum=None, maximum=None,
+                 buckets=None):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.count = count
+        self.zeros = zeros
+        self.min = minimum
+        self.max = maximum
+        self.buckets = Counter(buckets or {})
+
+    def add(self, value):
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value, self.gamma))] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.zeros += other.zeros
+        for bound in (other.min, other.max):
+            if bound is not None:
+                self.min = bound if self.min is None else min(self.min, bound)
+                self.max = bound if self.max is None else max(self.max, bound)
+        self.buckets.update(other.buckets)
+
+    def quantile(self, q):
+        """第 q 百分位数 (近似值，限定在实测最小/最大值之间)；没有样本时返回 None"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100))
+        if rank <= self.zeros:
+            return self.min
+        seen = self.zeros
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if seen >= rank:
+                estimate = 2 * self.gamma ** k / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {"relative_accuracy": self.relative_accuracy, "count": self.count, "zeros": self.zeros,
+                "min": self.min, "max": self.max, "buckets": {str(k): n for k, n in sorted(self.buckets.items())}}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        return cls(data["relative_accuracy"], data["count"], data["zeros"], data["min"], data["max"],
+                   {int(k): n for k, n in data["buckets"].items()})
+
+
+def _new_segment():
+    return {"rows": 0, "customers": 0, "spend": 0.0, "delivery": 0, "brands": Counter()}
+
+
+class OnlineMarketAggregator:
+    """
+    在线市场统计：按品牌、购买方式与各人群维度累计笔数、销售额、外卖笔数与品牌计数，价格用分位数草图。
+    口径与 CoffeeMarketAnalyzer 一致：笔数含放弃购买的记录，销售额只累加可解析的价格，均价只除以有价格的笔数。
+    一次运行中每名顾客只决策一次，分群的顾客数按带 customer_id 的记录计数，不保存 ID 集合。
+    CoffeeMarket 每写入一条决策调用一次 add(log_entry)。
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.priced = 0
+        self.total_sales = 0.0
+        self.brands = {}   # 品牌 -> [笔数, 销售额, 有价格的笔数]
+        self.methods = {}  # 购买方式 -> [笔数, 销售额, 有价格的笔数]
+        self.segments = {dimension: {} for dimension in SEGMENT_DIMENSIONS}
+        self.price = QuantileSketch()
+        self.sensitivity_prices = {}  # 价格敏感度 -> QuantileSketch
+
+    def add(self, row):
+        """累加一条决策记录 (CoffeeMarket 的日志字典，或从结果 CSV 读回的一行)"""
+        price = parse_price(row.get("price"))
+        brand = _label(row.get("brand"))
+        method = _label(row.get("method"))
+        self.rows += 1
+        if price is not None:
+            self.priced += 1
+            self.total_sales += price
+            self.price.add(price)
+
+        if brand is not None:
+            stats = self.brands.setdefault(brand, [0, 0.0, 0])
+            stats[0] += 1
+            if price is not None:
+                stats[1] += price
+                stats[2] += 1
+        if method is not None:
+            stats = self.methods.setdefault(method, [0, 0.0, 0])
+            stats[0] += 1
+            if price is not None:
+                stats[1] += price
+                stats[2] += 1
+
+        has_customer = _label(row.get("customer_id")) is not None
+        for dimension in SEGMENT_DIMENSIONS:
+            if dimension == "income_segment":
+                segment = income_segment(row.get("income"))
+            else:
+                segment = _label(row.get(dimension))
+            if segment is None:
+                continue
+            stats = self.segments[dimension].get(segment)
+            if stats is None:
+                stats = self.segments[dimension][segment] = _new_segment()
+            stats["rows"] += 1
+            stats["customers"] += has_customer
+            stats["spend"] += price or 0.0
+            stats["delivery"] += method == "外卖"
+            if brand is not None:
+                stats["brands"][brand] += 1
+
+        sensitivity = _label(row.get("price_sensitivity"))
+        if sensitivity is not None and price is not None:
+            sketch = self.sensitivity_prices.get(sensitivity)
+            if sketch is None:
+                sketch = self.sensitivity_prices[sensitivity] = QuantileSketch(self.price.relative_accuracy)
+            sketch.add(price)
+
+    def merge(self, other):
+        """并入另一份统计 (如另一个分片进程)"""
+        self.rows += other.rows
+        self.priced += other.priced
+        self.total_sales += other.total_sales
+        for brand, values in other.brands.items():
+            stats = self.brands.setdefault(brand, [0, 0.0, 0])
+            for k, value in enumerate(values):
+                stats[k] += value
+        for method, values in other.methods.items():
+            stats = self.methods.setdefault(method, [0, 0.0, 0])
+            for k, value in enumerate(values):
+                stats[k] += value
+        for dimension, segments in other.segments.items():
+            for segment, values in segments.items():
+                stats = self.segments[dimension].setdefault(segment, _new_segment())
+                stats["rows"] += values["rows"]
+                stats["customers"] += values["customers"]
+                stats["spend"] += values["spend"]
+                stats["delivery"] += values["delivery"]
+                stats["brands"].update(values["brands"])
+        self.price.merge(other.price)
+        for sensitivity, sketch in other.sensitivity_prices.items():
+            if sensitivity in self.sensitivity_prices:
+                self.sensitivity_prices[sensitivity].merge(sketch)
+            else:
+                self.sensitivity_prices[sensitivity] = QuantileSketch.from_snapshot(sketch.snapshot())
+
+    def snapshot(self):
+        """可 JSON 序列化 / 跨进程传递的原始状态"""
+        return {
+            "rows": self.rows,
+            "priced": self.priced,
+            "total_sales": self.total_sales,
+            "brands": {brand: list(values) for brand, values in self.brands.items()},
+            "methods": {method: list(values) for method, values in self.methods.items()},
+            "segments": {
+                dimension: {segment: dict(values, brands=dict(values["brands"])) for segment, values in segments.items()}
+                for dimension, segments in self.segments.items()
+            },
+            "price": self.price.snapshot(),
+            "sensitivity_prices": {k: sketch.snapshot() for k, sketch in self.sensitivity_prices.items()}
+        }
+
+    @classmethod
+    def from_snapshot(cls, data):
+        aggregator = cls()
+        aggregator.rows = data["rows"]
+        aggregator.priced = data["priced"]
+        aggregator.total_sales = data["total_sales"]
+        aggregator.brands = {brand: list(values) for brand, values in data["brands"].items()}
+        aggregator.methods = {method: list(values) for method, values in data["methods"].items()}
+        for dimension, segments in data["segments"].items():
+            aggregator.segments[dimension] = {
+                segment: dict(values, brands=Counter(values["brands"])) for segment, values in segments.items()
+            }
+        aggregator.price = QuantileSketch.from_snapshot(data["price"])
+        aggregator.sensitivity_prices = {k: QuantileSketch.from_snapshot(v) for k, v in data["sensitivity_prices"].items()}
+        return aggregator
+
+    # ========================================================================
+    # 📊 报告
+    # ========================================================================
+
+    def brand_shares(self):
+        """品牌销售统计 (按销售额降序)，列与 CoffeeMarketAnalyzer.brand_sales_analysis 一致"""
+        rows = []
+        for brand, (quantity, revenue, priced) in self.brands.items():
+            rows.append({
+                "brand": brand,
+                "quantity": quantity,
+                "revenue": round(revenue, 2),
+                "avg_price": round(revenue / priced, 2) if priced else 0,
+                "market_share": round(revenue / self.total_sales * 100, 2) if self.total_sales > 0 else 0,
+                "quantity_share": round(quantity / self.rows * 100, 2)
+            })
+        return sorted(rows, key=lambda r: r["revenue"], reverse=True)
+
+    def method_shares(self):
+        """购买方式统计 (按笔数降序)，列与 CoffeeMarketAnalyzer.delivery_method_analysis 一致"""
+        rows = []
+        for method, (quantity, revenue, priced) in sorted(self.methods.items(), key=lambda x: x[1][0], reverse=True):
+            rows.append({
+                "method": method,
+                "quantity": quantity,
+                "quantity_ratio": round(quantity / self.rows * 100, 2),
+                "revenue": round(revenue, 2),
+                "revenue_ratio": round(revenue / self.total_sales * 100, 2) if self.total_sales > 0 else 0,
+                "avg_price": round(revenue / priced, 2) if priced else 0
+            })
+        return rows
+
+    def segment_report(self, dimension):
+        """某一维度的分群统计 (按消费额降序)：顾客数、笔数、消费额、笔均消费、外卖占比与 TOP 3 品牌"""
+        rows = []
+        for segment, stats in self.segments[dimension].items():
+            purchases = stats["rows"]
+            top_brands = stats["brands"].most_common(3)
+            rows.append({
+                dimension: segment,
+                "total_customers": stats["customers"],
+                "total_purchases": purchases,
+                "total_spend": round(stats["spend"], 2),
+                "avg_spend": round(stats["spend"] / purchases, 2),
+                "top_brands": ", ".join(f"{b}({c})" for b, c in top_brands),
+                "delivery_ratio": round(stats["delivery"] / purchases * 100, 2)
+            })
+        return sorted(rows, key=lambda r: r["total_spend"], reverse=True)
+
+    def price_summary(self, sketch=None):
+        """价格分布：笔数、均值、最小/最大值与近似分位数"""
+        sketch = sketch or self.price
+        summary = {"count": sketch.count, "min": sketch.min, "max": sketch.max}
+        if sketch is self.price:
+            summary["mean"] = round(self.total_sales / self.priced, 2) if self.priced else None
+        for q in PRICE_QUANTILES:
+            value = sketch.quantile(q)
+            summary[f"p{q}"] = round(value, 2) if value is not None else None
+        return summary
+
+    def report(self):
+        """完整报告 (可 JSON 序列化)"""
+        return {
+            "rows": self.rows,
+            "total_sales": round(self.total_sales, 2),
+            "brands": self.brand_shares(),
+            "methods": self.method_shares(),
+            "segments": {dimension: self.segment_report(dimension) for dimension in SEGMENT_DIMENSIONS},
+            "price": self.price_summary(),
+            "price_by_sensitivity": {k: self.price_summary(sketch) for k, sketch in self.sensitivity_prices.items()}
+        }
+
+    def live_summary(self, top_n=3):
+        """一行实时统计：决策数、购买率、销售额与份额领先的品牌"""
+        purchases = sum(values[0] for values in self.brands.values())
+        leaders = ", ".join(f"{r['brand']} {r['market_share']}%" for r in self.brand_shares()[:top_n])
+        purchase_rate = purchases / self.rows * 100 if self.rows else 0
+        return (f"📈 实时统计: 已决策 {self.rows} | 购买率 {purchase_rate:.1f}% | 销售额 ¥{self.total_sales:,.2f}"
+                + (f" | 份额领先: {leaders}" if leaders else ""))
+
+
+def merge_market_snapshots(snapshots):
+    """合并多个 OnlineMarketAggregator.snapshot() (如各分片进程的统计)"""
+    merged = OnlineMarketAggregator()
+    for snapshot in snapshots:
+        merged.merge(OnlineMarketAggregator.from_snapshot(snapshot))
+    return merged.snapshot()
+
+
+def print_market_report(aggregator):
+    """打印在线统计的品牌份额、购买方式与价格分布"""
+    if not aggregator.rows:
+        return
+    print("\n--- 🏪 品牌市场份额 (在线统计) ---")
+    for row in aggregator.brand_shares():
+        # 品牌名含中文 (双倍显示宽度)，放在行尾避免错位
+        print(f"{row['quantity']:>8} 笔 | ¥{row['revenue']:>12,.2f} | 份额 {row['market_share']:>6.2f}% | {row['brand']}")
+    methods = " | ".join(f"{row['method']} {row['quantity_ratio']}%" for row in aggregator.method_shares())
+    if methods:
+        print(f"🚗 购买方式: {methods}")
+    price = aggregator.price_summary()
+    if price["count"]:
+        print(f"💵 单笔价格: 均值 ¥{price['mean']} | p25 / p50 / p75 / p95: "
+              f"¥{price['p25']} / ¥{price['p50']} / ¥{price['p75']} / ¥{price['p95']}")
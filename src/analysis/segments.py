@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+☕ 咖啡市场仿真 - 人群分段常量
+
+离线分析 (CoffeeMarketAnalyzer)、在线统计 (OnlineMarketAggregator) 与结果仓库共用的收入分层。
+只有常量，不依赖 pandas，仿真主循环导入在线统计时不会连带加载分析模块。
+"""
+
+# 收入分层 (月收入，元)，左开右闭，与 pd.cut(INCOME_BINS) 一致
+INCOME_BINS = [0, 8000, 15000, 25000, 100000]
+INCOME_SEGMENTS = ['低收入(0-8K)', '中低收入(8-15K)', '中高收入(15-25K)', '高收入(25K+)']
@@ -34,7 +34,7 @@ class CoffeeMarketVisualizer:
         初始化可视化工具
         
         Args:
-            analyzer (CoffeeMarketAnalyzer): 数据分析器实例
+            analyzer (CoffeeMarketAnalyzer): 数据分析器实例 (分析结果由分析器缓存，与报告共用，不重复计算)
         """
         self.analyzer = analyzer
         self.output_dir = os.path.dirname(analyzer.csv_path)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+☕ 咖啡市场仿真 - 多次运行结果仓库
+
+把每次运行的结果按 (运行, 维度, 分组, 品牌) 预聚合后存入 SQLite 单文件 (data/output/results_warehouse.sqlite)，
+同时记录运行的模式、策略、种子、决策后端与平台规则，支持跨运行的查询，例如最近 50 次运行中瑞幸在各策略下的份额。
+入库是增量的：只读取新增或有变化的结果文件，已入库的运行只比较文件大小与修改时间。
+"""
+
+import os
+import re
+import glob
+import json
+import time
+import sqlite3
+from datetime import datetime
+import pandas as pd
+from src.environment.result_writer import read_results
+from src.analysis.segments import INCOME_BINS, INCOME_SEGMENTS
+
+DEFAULT_WAREHOUSE_PATH = os.path.join("data", "output", "results_warehouse.sqlite")
+
+# 预聚合的维度：all 为整次运行 (分组名也是 all)，income_segment 由 income 按 INCOME_BINS 分段
+WAREHOUSE_DIMENSIONS = ("all", "age_group", "occupation", "preference", "price_sensitivity", "income_segment", "method")
+
+# 跨运行查询可以按这些运行属性分组
+RUN_GROUP_COLUMNS = ("strategy", "mode", "backend", "seed")
+
+# 没有运行指标文件的旧结果：从文件名 simulation_results_<模式>_... 中取模式
+RESULT_FILENAME_PATTERN = re.compile(r"simulation_results_([a-z]+)_")
+
+
+class ResultsWarehouse:
+    """
+    多次运行的结果仓库 (SQLite 单文件)。
+    runs 表每次运行一行；segment_brands 表存每次运行各维度、各分组下每个品牌的笔数、消费额与外卖笔数
+    (品牌为空串的行是放弃购买)，单次运行只有几百行，跨运行查询不需要回读结果文件。
+    """
+
+    def __init__(self, path=DEFAULT_WAREHOUSE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id TEXT PRIMARY KEY,"
+            " results_file TEXT NOT NULL UNIQUE,"
+            " mode TEXT,"
+            " strategy TEXT,"
+            " seed INTEGER,"
+            " backend TEXT,"
+            " platform_rules TEXT,"
+            " sample_size INTEGER,"
+            " rows INTEGER NOT NULL,"
+            " total_sales REAL NOT NULL,"
+            " finished_at TEXT NOT NULL,"
+            " file_size INTEGER NOT NULL,"
+            " file_mtime REAL NOT NULL,"
+            " ingested_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_finished_at ON runs(finished_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_strategy ON runs(strategy)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS segment_brands ("
+            " run_id TEXT NOT NULL,"
+            " dimension TEXT NOT NULL,"
+            " segment TEXT NOT NULL,"
+            " brand TEXT NOT NULL,"
+            " rows INTEGER NOT NULL,"
+            " spend REAL NOT NULL,"
+            " delivery INTEGER NOT NULL,"
+            " PRIMARY KEY (run_id, dimension, segment, brand)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_segment_brands_segment ON segment_brands(dimension, segment, brand)"
+        )
+        self._conn.commit()
+
+    # ========================================================================
+    # 📥 入库
+    # ========================================================================
+
+    def ingest(self, results_path, metrics=None, force=False):
+        """
+        入库一次运行的结果文件 (CSV，旁边有同名列式文件时读取列式文件)。
+        metrics 为运行指标 (默认读取 <文件名>_run_metrics.json，没有时由文件名推断模式)。
+        文件大小与修改时间都没变的运行直接跳过；返回 True 表示本次写入了数据。
+        """
+        results_file = os.path.abspath(results_path)
+        stat = os.stat(results_file)
+        row = self._conn.execute(
+            "SELECT run_id, file_size, file_mtime FROM runs WHERE results_file = ?", (results_file,)
+        ).fetchone()
+        if row is not None and not force and (row[1], row[2]) == (stat.st_size, stat.st_mtime):
+            return False
+
+        if metrics is None:
+            metrics = read_run_metrics(results_file)
+        run_id = metrics.get("run_id") or os.path.splitext(os.path.basename(results_file))[0]
+        df, _ = read_results(results_file)
+        price = df['price'].astype('float64').round(2)
+        cells = aggregate_segment_brands(df, price)
+        finished_at = metrics.get("finished_at") or datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")
+        platform_rules = metrics.get("platform_rules")
+
+        with self._conn:
+            # 同一结果文件重新入库 (如续跑后文件变化)：先删掉旧数据
+            if row is not None:
+                self._delete_run(row[0])
+            self._delete_run(run_id)
+            self._conn.execute(
+                "INSERT INTO runs (run_id, results_file, mode, strategy, seed, backend, platform_rules, sample_size,"
+                " rows, total_sales, finished_at, file_size, file_mtime, ingested_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, results_file, metrics.get("mode"), metrics.get("strategy"), metrics.get("seed"),
+                 metrics.get("backend"),
+                 json.dumps(platform_rules, ensure_ascii=False) if platform_rules is not None else None,
+                 metrics.get("sample_size"), len(df), float(price.sum()), finished_at,
+                 stat.st_size, stat.st_mtime, time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO segment_brands (run_id, dimension, segment, brand, rows, spend, delivery)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(run_id,) + cell for cell in cells]
+            )
+        return True
+
+    def ingest_directory(self, directory, pattern="simulation_results_*.csv"):
+        """增量入库目录下的结果文件 (已入库且没有变化的只做一次 stat)，返回 (新入库数, 跳过数)"""
+        ingested = skipped = 0
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            # 分片运行的中间文件合并后即删除，这里只跳过残留的分片文件
+            if ".shard" in os.path.basename(path):
+                continue
+            if self.ingest(path):
+                ingested += 1
+            else:
+                skipped += 1
+        return ingested, skipped
+
+    def _delete_run(self, run_id):
+        self._conn.execute("DELETE FROM segment_brands WHERE run_id = ?", (run_id,))
+        self._conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+
+    # ========================================================================
+    # 🔎 查询
+    # ========================================================================
+
+    def query(self, sql, params=()):
+        """执行任意只读 SQL，返回 DataFrame"""
+        return pd.read_sql_query(sql, self._conn, params=params)
+
+    def runs(self, last=50):
+        """最近 last 次运行 (按结束时间倒序)"""
+        return self.query(
+            "SELECT run_id, mode, strategy, seed, backend, sample_size, rows, ROUND(total_sales, 2) AS total_sales,"
+            " finished_at, results_file FROM runs ORDER BY finished_at DESC LIMIT ?", (last,)
+        )
+
+    def brand_share_by(self, by="strategy", brand=None, last=50, dimension="all", segment="all"):
+        """
+        最近 last 次运行中，按运行属性 by (策略/模式/后端/种子) 分组的品牌份额。
+        dimension/segment 限定人群 (如 age_group / 25-34)，默认整体；brand 不为空时只返回该品牌。
+
+        Returns:
+            DataFrame: by, brand, runs (出现该品牌的运行数), quantity, revenue,
+                       market_share (合计销售额份额 %), mean_run_share (各次运行份额的平均 %), quantity_share (%)
+        """
+        if by not in RUN_GROUP_COLUMNS:
+            raise ValueError(f"by 只能是 {', '.join(RUN_GROUP_COLUMNS)}")
+        cells = self.query(
+            f"SELECT r.run_id, r.{by} AS grp, s.brand, s.rows, s.spend FROM segment_brands s"
+            f" JOIN (SELECT run_id, {by} FROM runs ORDER BY finished_at DESC LIMIT ?) r USING (run_id)"
+            " WHERE s.dimension = ? AND s.segment = ?",
+            (last, dimension, segment)
+        )
+        columns = [by, "brand", "runs", "quantity", "revenue", "market_share", "mean_run_share", "quantity_share"]
+        if cells.empty:
+            return pd.DataFrame(columns=columns)
+        cells["grp"] = cells["grp"].fillna("(未记录)")
+
+        run_totals = cells.groupby("run_id")[["rows", "spend"]].sum()
+        group_totals = cells.groupby("grp")[["rows", "spend"]].sum()
+        runs_per_group = cells.groupby("grp")["run_id"].nunique()
+        purchases = cells[cells["brand"] != ""]
+        if brand is not None:
+            purchases = purchases[purchases["brand"] == brand]
+
+        # 每次运行的份额，缺席的运行按 0 计入平均
+        run_share = purchases["spend"] / run_totals.loc[purchases["run_id"], "spend"].values * 100
+        purchases = purchases.assign(run_share=run_share.fillna(0))
+        grouped = purchases.groupby(["grp", "brand"])
+        result = pd.DataFrame({
+            "runs": grouped["run_id"].nunique(),
+            "quantity": grouped["rows"].sum(),
+            "revenue": grouped["spend"].sum().round(2),
+            "run_share_sum": grouped["run_share"].sum(),
+        }).reset_index()
+        group_spend = group_totals.loc[result["grp"], "spend"].values
+        group_rows = group_totals.loc[result["grp"], "rows"].values
+        result["market_share"] = (result["revenue"] / group_spend * 100).round(2)
+        result["mean_run_share"] = (result["run_share_sum"] / runs_per_group.loc[result["grp"]].values).round(2)
+        result["quantity_share"] = (result["quantity"] / group_rows * 100).round(2)
+        result = result.rename(columns={"grp": by}).sort_values([by, "revenue"], ascending=[True, False])
+        return result[columns].reset_index(drop=True)
+
+    def close(self):
+        self._conn.close()
+
+
+def read_run_metrics(results_path):
+    """结果文件对应的运行指标 (<文件名>_run_metrics.json)；没有时只由文件名推断模式"""
+    stem = os.path.splitext(results_path)[0]
+    metrics_path = f"{stem}_run_metrics.json"
+    if os.path.exists(metrics_path):
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    match = RESULT_FILENAME_PATTERN.match(os.path.basename(results_path))
+    return {"mode": match.group(1) if match else None}
+
+
+def aggregate_segment_brands(df, price):
+    """结果 DataFrame -> [(维度, 分组, 品牌, 笔数, 消费额, 外卖笔数), ...]，每个维度一次 groupby"""
+    brand = df['brand'].astype(object).fillna("")
+    values = pd.DataFrame({"rows": 1, "spend": price.fillna(0.0), "delivery": (df['method'] == '外卖').astype(int)})
+    cells = []
+    for dimension in WAREHOUSE_DIMENSIONS:
+        if dimension == "all":
+            keys = pd.Series("all", index=df.index)
+        elif dimension == "income_segment":
+            keys = pd.cut(df['income'], bins=INCOME_BINS, labels=INCOME_SEGMENTS)
+        else:
+            keys = df[dimension]
+        grouped = values.groupby([keys, brand], observed=True).sum()
+        for (segment, brand_name), (rows, spend, delivery) in zip(grouped.index, grouped.itertuples(index=False)):
+            cells.append((dimension, str(segment), brand_name, int(rows), round(float(spend), 2), int(delivery)))
+    return cells
+
+
+def print_brand_share(table, by):
+    """打印 brand_share_by 的结果：每个分组一段，品牌名放在行尾避免中文错位"""
+    if table.empty:
+        print("⚠️  结果仓库中没有符合条件的运行")
+        return
+    for group, rows in table.groupby(by, sort=False):
+        print(f"\n--- 🏛️ {by} = {group} ---")
+        for row in rows.itertuples(index=False):
+            print(f"{row.runs:>4} 次运行 | {row.quantity:>8} 笔 | ¥{row.revenue:>12,.2f} | "
+                  f"份额 {row.market_share:>6.2f}% | 单次平均 {row.mean_run_share:>6.2f}% | {row.brand}")
@@ -0,0 +1,84 @@
+import os
+import json
+
+CHECKPOINT_DIR = "data/checkpoints"
+
+
+def encode_rng_state(state):
+    """random.getstate() 的结果转成可写入 JSON 的列表"""
+    version, internal, gauss_next = state
+    return [version, list(internal), gauss_next]
+
+
+def decode_rng_state(data):
+    version, internal, gauss_next = data
+    return version, tuple(internal), gauss_next
+
+
+class RunCheckpoint:
+    """
+    单次仿真运行的检查点：data/checkpoints/<run_id>.json。
+    config 为复现本次运行所需的参数 (模式、策略、种子、平台规则、输出文件名等)，由 main.py 写入；
+    抽样顾客 ID (按决策顺序) 在抽样完成时写一次到旁路文件 <run_id>.sampled_ids.json，
+    之后每次落盘只更新体积固定的 progress，不再重写整份名单。
+    progress 为运行进度，由 CoffeeMarket 写入：
+      - rng_state:   抽样完成后的随机数状态
+      - rows:        已落盘的结果行数 (结果按抽样顺序写入，已完成的顾客即 sampled_ids[:rows])
+      - offset:      对应的 .part 文件字节偏移，续跑时先截断到这里
+      - status:      running / completed
+    每次写入都先写临时文件再原子替换，进程随时被杀也不会留下半个 JSON。
+    """
+
+    def __init__(self, run_id, config=None, progress=None, directory=CHECKPOINT_DIR):
+        self.run_id = run_id
+        self.config = config or {}
+        self.progress = progress or {}
+        self.path = os.path.join(directory, f"{run_id}.json")
+        self.sampled_ids_path = os.path.join(directory, f"{run_id}.sampled_ids.json")
+        self._sampled_ids = None
+
+    @property
+    def resumable(self):
+        if "rng_state" not in self.progress or self.progress.get("status") == "completed":
+            return False
+        # 旧版检查点把名单存在 progress 里
+        return bool(self.progress.get("sampled_ids")) or os.path.exists(self.sampled_ids_path)
+
+    @property
+    def sampled_ids(self):
+        """抽样顾客 ID (按决策顺序)，首次访问时读取旁路文件"""
+        if self._sampled_ids is None:
+            if "sampled_ids" in self.progress:
+                self._sampled_ids = self.progress["sampled_ids"]
+            else:
+                with open(self.sampled_ids_path, "r", encoding="utf-8") as f:
+                    self._sampled_ids = json.load(f)
+        return self._sampled_ids
+
+    def save_sampled_ids(self, sampled_ids):
+        """写入抽样名单 (每次运行只写一次)"""
+        self._sampled_ids = list(sampled_ids)
+        self.progress.pop("sampled_ids", None)
+        self._write_json(self.sampled_ids_path, self._sampled_ids)
+
+    def save(self, **progress):
+        self.progress.update(progress)
+        self._write_json(self.path, {"run_id": self.run_id, "config": self.config, "progress": self.progress})
+
+    @staticmethod
+    def _write_json(path, data):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, run_id, directory=CHECKPOINT_DIR):
+        """按运行 ID 读取检查点；找不到时抛出 FileNotFoundError"""
+        path = os.path.join(directory, f"{run_id}.json")
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["run_id"], data.get("config"), data.get("progress"), directory)
@@ -1,38 +1,96 @@
-import pandas as pd
 import json
-import time
 import os
 import random
-from src.agents.customer import Customer
+import asyncio
+from src.agents.customer import compile_menu_index, TOP_N_SHOPS
+from src.agents.population import load_population_store, POPULATION_CACHE_DIR, LOAD_MODES
+from src.agents.shortlist import ShopShortlister
+from src.agents.prompt_template import DecisionPromptTemplate, validate_batch_decisions
+from src.analysis.online import OnlineMarketAggregator, print_market_report, LIVE_REPORT_EVERY
+from src.environment.result_writer import StreamingResultWriter
+from src.environment.checkpoint import encode_rng_state, decode_rng_state
 from src.llm.client import DeepSeekClient
+from src.utils.telemetry import RunTelemetry
+
+OUTPUT_DIR = "data/output"
+
+# 门店默认出杯速率 (杯/分钟)，地图配置可用 service_rate 覆盖；分时段仿真中排队按此速率消化
+DEFAULT_SERVICE_RATE = 2.0
+
+# 批量决策时每位顾客预留的输出 token 数 (单条决策约 60~100 tokens，另留出 JSON 包装的余量)
+BATCH_MAX_TOKENS_PER_CUSTOMER = 150
+
+# 仿真实际用到的人口列 (列式格式的人口数据只解码这些列)
+SIMULATION_POPULATION_COLUMNS = [
+    "id", "age_group", "occupation", "income", "preference", "price_sensitivity",
+    "brand_preference", "brand_loyalty", "persona_description"
+]
+
+# 品牌库编译缓存：{绝对路径: ((mtime_ns, size), 品牌库, {品牌: 菜单索引})}
+_BRAND_LIBRARY_CACHE = {}
+
+
+def load_brand_library(library_path):
+    """
+    读取品牌库 JSON 并为每个品牌预编译菜单索引。
+    同一文件在进程内只解析一次；文件修改时间或大小变化时自动失效重建。
+    """
+    path = os.path.abspath(library_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _BRAND_LIBRARY_CACHE.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        brand_library = json.load(f)
+    menu_indexes = {brand_id: compile_menu_index(info.get('menu')) for brand_id, info in brand_library.items()}
+    _BRAND_LIBRARY_CACHE[path] = (version, brand_library, menu_indexes)
+    return brand_library, menu_indexes
+
 
 class CoffeeMarket:
-    def __init__(self, population_csv, brand_library_json, map_config, api_key=None):
+    def __init__(self, population_csv, brand_library_json, map_config, api_key=None, llm_client=None,
+                 population_columns=SIMULATION_POPULATION_COLUMNS, population_cache_dir=POPULATION_CACHE_DIR):
+        """
+        population_csv 可以是 CSV 文件、Parquet / Arrow 文件或 ShanghaiCustomerGenerator.write_population 写出的分块目录，
+        只读不改；population_columns 为读取的列 (None 读取全部列)。
+        population_cache_dir 下缓存人口数据的二进制列文件 (以源数据哈希为键)，再次启动时直接内存映射；None 为不使用缓存。
+        """
         print("🌍 正在初始化咖啡市场 (华东师范大学-环球港 虚拟商圈)...")
+        # 分阶段计时：市场各环节与决策后端 (网络、限流、解析) 记到同一份
+        self.telemetry = RunTelemetry()
         
-        # 1. 加载顾客数据
-        self.population_df = pd.read_csv(population_csv)
-        if 'brand_preference' not in self.population_df.columns or 'brand_loyalty' not in self.population_df.columns:
-            self._add_brand_preference_columns()
-            self.population_df.to_csv(population_csv, index=False, encoding='utf-8-sig')
-        self.customers = []
-        for _, row in self.population_df.iterrows():
-            self.customers.append(Customer(profile_data=row.to_dict()))
+        # 1. 加载顾客数据 (列式存储，只有被抽中的顾客才生成 Customer 对象)
+        self.customers, self.population_load = load_population_store(
+            population_csv, columns=population_columns, cache_dir=population_cache_dir)
+        load = self.population_load
+        self.telemetry.record("population_load", load['seconds'])
+        print(f"⏱️  人口数据加载: {load['seconds']:.2f}s ({LOAD_MODES[load['mode']]})")
         print(f"👥 成功加载 {len(self.customers)} 名虚拟顾客数据。")
         
         # 2. 实体化店铺 (将 JSON 模板映射到地图上)
         self.shops = self._load_shops(brand_library_json, map_config)
         print(f"🏪 成功在地图上开出 {len(self.shops)} 家咖啡门店。")
         
-        # 3. 接入大模型客户端
-        self.llm_client = DeepSeekClient(api_key=api_key)
-        self.simulation_logs = []
+        # 3. 接入大模型客户端 (允许外部注入已配置好缓存等选项的客户端)
+        self.llm_client = llm_client or DeepSeekClient(api_key=api_key)
+        self.llm_client.telemetry = self.telemetry
+        self.result_writer = None
+        # 在线市场统计：每条决策写入时累加，运行中与结束后直接由它出份额与消费统计
+        self.aggregator = None
+        self.prompt_template = None
+        self.batch_stats = {}
+        self._on_progress = None
+        # 每条决策写入前依次调用 hook(i, customer, decision_data, log_entry)，可在 log_entry 里追加列
+        self.decision_hooks = []
+        self._number_offset = 0
+        self._number_total = None
 
     def _load_shops(self, library_path, map_config):
         """读取品牌库并根据地图配置生成实体店"""
-        with open(library_path, 'r', encoding='utf-8') as f:
-            brand_library = json.load(f)
-            
+        brand_library, menu_indexes = load_brand_library(library_path)
+
         actual_shops = []
         for shop_id, setup in map_config.items():
             brand_id = setup['brand']
@@ -49,96 +107,269 @@ class CoffeeMarket:
                 "business_model": brand_info['business_model'],
                 "promotions": brand_info['promotions'],
                 "menu": brand_info['menu'],
+                "menu_index": menu_indexes[brand_id],  # 口味偏好 -> (商品, 价格)，同品牌门店共用
                 "supports_delivery": True,  # 强制所有店铺支持外卖配送
                 # 实体特有的动态物理属性
                 "location": setup['location'],
-                "queue_time": setup['current_queue']
+                "queue_time": setup['current_queue'],
+                "service_rate": setup.get('service_rate', DEFAULT_SERVICE_RATE)
             }
             actual_shops.append(shop_instance)
         return actual_shops
 
-    def _add_brand_preference_columns(self):
-        """为现有人口数据补充品牌偏好与忠诚度"""
-        brand_preference_weights = {
-            'Luckin': 0.45,
-            'Starbucks': 0.14,
-            'Nowwa': 0.10,
-            'Manner': 0.08,
-            'Tims': 0.04,
-            'Seesaw': 0.03,
-            'MStand': 0.03,
-            'Arabica': 0.02,
-            'PiYe': 0.02,
-            'BluebottleC': 0.01,
-            'Yongbo': 0.08
-        }
-        brands = list(brand_preference_weights.keys())
-        weights = list(brand_preference_weights.values())
-
-        preferred_brands = random.choices(brands, weights=weights, k=len(self.population_df))
-        loyalties = [round(random.uniform(0.2, 0.8), 2) for _ in range(len(self.population_df))]
-
-        self.population_df['brand_preference'] = preferred_brands
-        self.population_df['brand_loyalty'] = loyalties
-
-    def run_simulation(self, sample_size=10, platform_rules=None):
-            print(f"\n⏳ 开始模拟，随机抽取 {sample_size} 名顾客进行决策测试...")
+    def run_simulation(self, sample_size=10, platform_rules=None, concurrency=1, prompt_layout="classic", batch_size=1,
+                       output_filename="simulation_results.csv", checkpoint=None, shard=None, on_progress=None):
+            """
+            抽样并逐个决策，结果边跑边写入 data/output/<output_filename>.part，跑完后原子重命名为正式文件。
+            中途出错时已写入的行保留在 .part 文件中。
+            传入 checkpoint (RunCheckpoint) 时每次结果落盘都同步更新检查点；
+            检查点里已有未完成的进度时，按原抽样名单与随机数状态跳过已完成的顾客继续运行。
+            shard=(序号, 分片数) 时照常完成整体抽样，只决策其中连续的一段 (多进程分片运行)；
+            on_progress(已完成数) 在每条结果写入后调用。
+            """
+            start = 0
+            resume_offset = None
+            if checkpoint is not None and checkpoint.resumable:
+                progress = checkpoint.progress
+                test_customers = self.customers.by_ids(checkpoint.sampled_ids)
+                random.setstate(decode_rng_state(progress["rng_state"]))
+                start = progress.get("rows", 0)
+                resume_offset = progress.get("offset")
+                if resume_offset is None:
+                    start = 0
+                print(f"\n⏩ 从检查点续跑: 共 {len(test_customers)} 名顾客，已完成 {start} 名")
+            else:
+                print(f"\n⏳ 开始模拟，随机抽取 {sample_size} 名顾客进行决策测试...")
+                # 只抽下标，切片后再为本进程的顾客生成 Customer
+                positions = self.customers.sample_positions(min(sample_size, len(self.customers)))
+                if shard is not None:
+                    # 各分片进程用同一种子得到同一份抽样名单，按序号切出互不重叠的连续区间
+                    index, count = shard
+                    total = len(positions)
+                    positions = positions[total * index // count: total * (index + 1) // count]
+                    print(f"🧩 分片 {index + 1}/{count}: {len(positions)} 名顾客")
+                test_customers = self.customers.take(positions)
+                if checkpoint is not None:
+                    checkpoint.save_sampled_ids([c.id for c in test_customers])
+                    checkpoint.save(rng_state=encode_rng_state(random.getstate()),
+                                    rows=0, offset=None, status="running")
             
-            import random
-            test_customers = random.sample(self.customers, min(sample_size, len(self.customers)))
+            on_sync = None
+            if checkpoint is not None:
+                on_sync = lambda rows, offset: checkpoint.save(rows=rows, offset=offset)
+            # 续跑时已写入的结果行先计入在线统计
+            aggregator = OnlineMarketAggregator()
+            writer = StreamingResultWriter(os.path.join(OUTPUT_DIR, output_filename),
+                                           on_sync=on_sync, resume_offset=resume_offset, on_restore=aggregator.add)
+            self.start_run(platform_rules, prompt_layout, writer, on_progress, aggregator)
             
-            for i, customer in enumerate(test_customers):
-                print(f"[{i+1}/{sample_size}] 顾客 ID:{customer.id} | 职业:{customer.profile.get('occupation')} | 月收:{customer.profile.get('income')} | 偏好:{customer.preference}")
-                
-                sys_prompt = customer.system_prompt
-                user_prompt = customer.generate_decision_prompt(self.shops, platform_rules)
-                
-                decision_data = self.llm_client.get_decision(sys_prompt, user_prompt)
-                
-                # ========= 更新打印语句，直观展示购买细节 =========
-                brand = decision_data.get('brand')
-                if brand:
-                    print(f"   👉 决策: 选择了【{brand}】的【{decision_data.get('item')}】")
-                    print(f"   👉 方式: {decision_data.get('method')} | 花费: {decision_data.get('price')}元")
-                else:
-                    print(f"   👉 决策: 放弃购买 (None)")
-                print(f"   👉 理由: {decision_data.get('reason')}\n")
-                
-                # ========= 更新日志字典，增加我们要求的四个新字段 =========
-                log_entry = {
-                    "customer_id": customer.id,
-                    "age_group": customer.profile.get('age_group'),
-                    "occupation": customer.profile.get('occupation'),
-                    "income": customer.profile.get('income'),
-                    "preference": customer.profile.get('preference'),
-                    "price_sensitivity": customer.profile.get('price_sensitivity'),
-                    "decision": decision_data.get('decision'),
-                    "brand": decision_data.get('brand'),         # 新增
-                    "method": decision_data.get('method'),       # 新增
-                    "item": decision_data.get('item'),           # 新增
-                    "price": decision_data.get('price'),         # 新增
-                    "reason": decision_data.get('reason')
-                }
-                self.simulation_logs.append(log_entry)
-                
-                time.sleep(0.5) 
-                
+            # 批量预筛：一次性算出全部抽样顾客 × 全部门店的评分矩阵与 Top-N 候选
+            with self.telemetry.timer("shortlist"):
+                self._shortlist = self._shortlister.score_customers(test_customers)
+            self._print_prompt_budget(test_customers)
+            
+            print(f"💾 决策结果实时写入: {self.result_writer.part_path}")
+            try:
+                self._decide_all(test_customers, concurrency, batch_size, start)
+            except BaseException:
+                # 包括 Ctrl+C：已完成的决策都已落盘，保留 .part 文件便于排查
+                self.result_writer.abort()
+                print(f"⚠️ 模拟中断，已完成的 {self.result_writer.rows} 条结果保留在: {self.result_writer.part_path}")
+                raise
+            
+            self.result_writer.close()
+            if checkpoint is not None:
+                checkpoint.save(status="completed")
             print("✅ 模拟循环结束！")
+            self._print_results_summary()
+
+    def start_run(self, platform_rules, prompt_layout, result_writer, on_progress=None, aggregator=None):
+        """
+        一次运行的公共准备：预筛器、提示词模板 (静态片段整次运行只渲染一次)、批量统计、结果写入器与在线统计。
+        run_simulation 与分时段仿真 (TimeSteppedSimulation) 共用。
+        """
+        self._platform_rules = platform_rules
+        self._shortlister = ShopShortlister(self.shops, platform_rules)
+        self.prompt_template = DecisionPromptTemplate(self.shops, platform_rules, top_n=TOP_N_SHOPS, layout=prompt_layout)
+        self.batch_stats = {"batches": 0, "batched_customers": 0, "fallbacks": 0}
+        self.result_writer = result_writer
+        self.aggregator = aggregator or OnlineMarketAggregator()
+        self._on_progress = on_progress
+        self._number_offset = 0
+        self._number_total = None
 
-    def export_results(self, output_filename="simulation_results.csv"):
-        if not self.simulation_logs:
+    def decide_round(self, customers, concurrency=1, batch_size=1, number_offset=0, total=None):
+        """
+        按门店当前状态 (排队时长等) 为一组顾客重新预筛并决策，结果按顺序写入结果文件。
+        供分时段仿真逐时段调用，需先调用 start_run；number_offset/total 只影响进度打印的编号。
+        """
+        self._shortlister.refresh_queue_times()
+        with self.telemetry.timer("shortlist"):
+            self._shortlist = self._shortlister.score_customers(customers)
+        self._number_offset = number_offset
+        self._number_total = total
+        self._decide_all(customers, concurrency, batch_size)
+
+    def _decide_all(self, test_customers, concurrency, batch_size, start=0):
+        if concurrency > 1 or batch_size > 1:
+            # 并发模式：同时保持 concurrency 个决策请求在途；batch_size > 1 时每个请求打包多位顾客
+            asyncio.run(self._run_concurrent(test_customers, concurrency, batch_size, start))
             return
+        for i in range(start, len(test_customers)):
+            customer = test_customers[i]
+            with self.telemetry.timer("prompt_build"):
+                sys_prompt, user_prompt, prompt_tokens = self._prepare_prompts(i, customer)
             
-        df_results = pd.DataFrame(self.simulation_logs)
-        output_dir = "data/output"
-        os.makedirs(output_dir, exist_ok=True)
+            with self.telemetry.timer("llm_call"):
+                decision_data = self.llm_client.get_decision(sys_prompt, user_prompt, customer_id=customer.id)
+            with self.telemetry.timer("result_logging"):
+                self._record_decision(i, len(test_customers), customer, decision_data, prompt_tokens)
+
+    def _prepare_prompts(self, i, customer, template=None):
+        """渲染第 i 位抽样顾客的 (system prompt, user prompt, 预估 prompt tokens)"""
+        template = template or self.prompt_template
+        sys_prompt, user_prompt = customer.generate_decision_messages(
+            self.shops, self._platform_rules, self._shortlist.entries(i), template
+        )
+        return sys_prompt, user_prompt, template.last_tokens
+
+    def _print_prompt_budget(self, test_customers, probe_size=20):
+        """开跑前试渲染少量提示词，预估整次运行的 prompt token 消耗"""
+        if not test_customers:
+            return
+        probe = DecisionPromptTemplate(self.shops, self._platform_rules, top_n=TOP_N_SHOPS,
+                                       layout=self.prompt_template.layout)
+        probe_customers = test_customers[:probe_size]
+        tokens = sum(self._prepare_prompts(i, c, probe)[2] for i, c in enumerate(probe_customers))
+        avg_tokens = tokens / len(probe_customers)
+        print(f"📝 预估 prompt 消耗: 约 {avg_tokens:.0f} tokens/次，全程约 {avg_tokens * len(test_customers):,.0f} tokens")
+
+    async def _decide_single(self, i, customer):
+        with self.telemetry.timer("prompt_build"):
+            sys_prompt, user_prompt, prompt_tokens = self._prepare_prompts(i, customer)
+        with self.telemetry.timer("llm_call"):
+            decision_data = await self.llm_client.get_decision_async(sys_prompt, user_prompt, customer_id=customer.id)
+        return decision_data, prompt_tokens
+
+    async def _decide_batch(self, start, customers):
+        """
+        一次请求为 customers (抽样序号从 start 起连续) 批量决策，返回 [(决策, 均摊 prompt tokens), ...]。
+        校验不合格或缺失的顾客自动改走单人请求。
+        """
+        template = self.prompt_template
+        with self.telemetry.timer("prompt_build"):
+            entries = [c.batch_entry(self._shortlist.entries(start + k)) for k, c in enumerate(customers)]
+            sys_prompt, user_prompt, allowed = template.build_batch_messages(entries)
+        shared_tokens = round(template.last_tokens / len(customers))
+        # 录制日志按整批的顾客编号对齐，回放时不依赖提示词逐字一致
+        batch_id = "batch:" + ",".join(str(c.id) for c in customers)
+        with self.telemetry.timer("llm_call"):
+            result = await self.llm_client.get_decision_async(
+                sys_prompt, user_prompt, customer_id=batch_id,
+                max_tokens=BATCH_MAX_TOKENS_PER_CUSTOMER * len(customers)
+            )
+        valid = validate_batch_decisions(result, allowed)
+
+        self.batch_stats["batches"] += 1
+        self.batch_stats["batched_customers"] += len(valid)
+        self.batch_stats["fallbacks"] += len(customers) - len(valid)
+        results = []
+        for k, customer in enumerate(customers):
+            if customer.id in valid:
+                results.append((valid[customer.id], shared_tokens))
+            else:
+                results.append(await self._decide_single(start + k, customer))
+        return results
+
+    async def _run_concurrent(self, test_customers, concurrency, batch_size=1, first_index=0):
+        """
+        并发决策引擎：concurrency 个 worker 依次领取下一个请求，在途请求数与任务数都等于 concurrency，
+        不随抽样规模增长。
+        请求可能乱序返回，结果先暂存，再严格按抽样顺序写入结果文件，保证输出可复现；
+        暂存的只是最早未完成请求之后已返回的结果，数量取决于时延波动而不是顾客总数。
+        first_index 之前的顾客已在上次运行中完成 (续跑)。
+        """
+        total = len(test_customers)
+        # 各 worker 共用同一个迭代器领取请求的起始序号
+        starts = iter(range(first_index, total, batch_size))
+        finished = {}
+        next_index = first_index
+
+        async def worker():
+            nonlocal next_index
+            for start in starts:
+                customers = test_customers[start:start + batch_size]
+                if len(customers) == 1:
+                    results = [await self._decide_single(start, customers[0])]
+                else:
+                    results = await self._decide_batch(start, customers)
+                for k, result in enumerate(results):
+                    finished[start + k] = result
+                # 只有前面的顾客都已完成，才按顺序落盘，避免结果顺序依赖网络时延
+                while next_index in finished:
+                    with self.telemetry.timer("result_logging"):
+                        self._record_decision(next_index, total, test_customers[next_index], *finished.pop(next_index))
+                    next_index += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # 异步 HTTP 连接池绑定当前事件循环，asyncio.run 结束前关闭
+            await self.llm_client.aclose()
+
+    def _record_decision(self, i, total, customer, decision_data, prompt_tokens=None):
+        """打印单个顾客的决策并写入日志"""
+        number = self._number_offset + i + 1
+        total = self._number_total or total
+        print(f"[{number}/{total}] 顾客 ID:{customer.id} | 职业:{customer.profile.get('occupation')} | 月收:{customer.profile.get('income')} | 偏好:{customer.preference}")
+        if prompt_tokens is not None:
+            print(f"   📝 Prompt: 约 {prompt_tokens} tokens")
+        
+        # ========= 更新打印语句，直观展示购买细节 =========
+        brand = decision_data.get('brand')
+        if brand:
+            print(f"   👉 决策: 选择了【{brand}】的【{decision_data.get('item')}】")
+            print(f"   👉 方式: {decision_data.get('method')} | 花费: {decision_data.get('price')}元")
+        else:
+            print(f"   👉 决策: 放弃购买 (None)")
+        print(f"   👉 理由: {decision_data.get('reason')}\n")
         
-        filepath = os.path.join(output_dir, output_filename)
-        df_results.to_csv(filepath, index=False, encoding='utf-8-sig')
-        print(f"\n📊 完整决策结果已保存至: {filepath}")
+        # ========= 更新日志字典，增加我们要求的四个新字段 =========
+        log_entry = {
+            "customer_id": customer.id,
+            "age_group": customer.profile.get('age_group'),
+            "occupation": customer.profile.get('occupation'),
+            "income": customer.profile.get('income'),
+            "preference": customer.profile.get('preference'),
+            "price_sensitivity": customer.profile.get('price_sensitivity'),
+            "decision": decision_data.get('decision'),
+            "brand": decision_data.get('brand'),         # 新增
+            "method": decision_data.get('method'),       # 新增
+            "item": decision_data.get('item'),           # 新增
+            "price": decision_data.get('price'),         # 新增
+            "reason": decision_data.get('reason')
+        }
+        for hook in self.decision_hooks:
+            hook(i, customer, decision_data, log_entry)
+        self.result_writer.write(log_entry)
+        self.aggregator.add(log_entry)
+        if self.aggregator.rows % LIVE_REPORT_EVERY == 0:
+            print(self.aggregator.live_summary() + "\n")
+        if self._on_progress is not None:
+            self._on_progress(self.result_writer.rows)
+
+    def _print_results_summary(self):
+        writer = self.result_writer
+        print(f"\n📊 完整决策结果已保存至: {writer.path}")
         
         print("\n--- 🏆 最终销售统计 ---")
-        print(df_results['decision'].value_counts())
+        for decision, count in writer.decision_counts.most_common():
+            print(f"{decision:<20} {count}")
+        print_market_report(self.aggregator)
 
 
 # --- 运行入口 ---
@@ -173,5 +404,4 @@ if __name__ == "__main__":
     )
     
     # 抽取 5 名顾客进行测试，跑通后再调大数值
-    market.run_simulation(sample_size=5, platform_rules=TODAY_RULES)
-    market.export_results("test_huashida_run.csv")
\ No newline at end of file
+    market.run_simulation(sample_size=5, platform_rules=TODAY_RULES, output_filename="test_huashida_run.csv")
\ No newline at end of file
@@ -0,0 +1,251 @@
+import os
+import csv
+import time
+from collections import Counter
+import pandas as pd
+from src.utils.population_generator import pa, require_pyarrow
+
+if pa is not None:
+    import pyarrow.feather as pa_feather
+    import pyarrow.parquet as pa_parquet
+
+# 结果文件的列顺序 (与 CoffeeMarket._record_decision 生成的日志字典一致)
+RESULT_COLUMNS = [
+    "customer_id", "age_group", "occupation", "income", "preference", "price_sensitivity",
+    "decision", "brand", "method", "item", "price", "reason"
+]
+
+# 结果列的类型：取值有限的文本列为 categorical，价格为 float32，决策理由等自由文本为 string；
+# 分时段仿真另有 arrival_time / queue_time 两列。未列出的列一律按字符串处理，不按内容推断
+RESULT_DTYPES = {
+    "customer_id": "int64",
+    "age_group": "category",
+    "occupation": "category",
+    "income": "Int32",
+    "preference": "category",
+    "price_sensitivity": "category",
+    "decision": "category",
+    "brand": "category",
+    "method": "category",
+    "item": "category",
+    "price": "float32",
+    "reason": "string",
+    "arrival_time": "string",
+    "queue_time": "float32",
+}
+
+# 数值列：LLM 返回的价格可能是 "约20元" 之类的文本，无法解析的记为缺失
+NUMERIC_RESULT_COLUMNS = ("customer_id", "income", "price", "queue_time")
+
+# 列式结果文件格式 -> 扩展名 (feather 即 Arrow IPC)
+RESULT_FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+
+# RESULT_DTYPES -> 列式文件的列类型 (categorical 写成字符串列，Parquet 按字典编码存储，读取时还原为 categorical)
+ARROW_TYPES = {"category": "string", "string": "string", "int64": "int64", "Int32": "int32", "float32": "float32"}
+
+
+class StreamingResultWriter:
+    """
+    流式结果写入器：决策一产生就追加写入 <文件名>.part，定期 flush + fsync，
+    全部写完后再原子重命名为正式文件名。
+    进程中途崩溃时，已落盘的行都保留在 .part 文件里；内存里只保留决策计数，不随顾客数增长。
+    on_sync(rows, offset) 在每次 fsync 之后调用，用于写检查点；
+    resume_offset 不为空时接着已有的 .part 续写 (先截断到该偏移，丢掉上次未确认落盘的半截内容)，
+    已有的每一行依次交给 on_restore(row) (如重建在线统计)。
+    """
+
+    def __init__(self, path, fieldnames=RESULT_COLUMNS, fsync_every=200, fsync_interval=5.0,
+                 on_sync=None, resume_offset=None, on_restore=None):
+        self.path = path
+        self.part_path = path + ".part"
+        self.fieldnames = list(fieldnames)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.rows = 0
+        self.decision_counts = Counter()
+
+        self.on_sync = on_sync
+        self.on_restore = on_restore
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if resume_offset is None:
+            # utf-8-sig：带 BOM，Excel 打开中文不乱码 (与原先 DataFrame.to_csv 的编码一致)
+            self._file = open(self.part_path, "w", newline="", encoding="utf-8-sig")
+        else:
+            self._file = self._reopen(resume_offset)
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction="ignore",
+                                      lineterminator="\n")
+        if resume_offset is None:
+            self._writer.writeheader()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self.closed = False
+
+    def _reopen(self, offset):
+        """截断 .part 到 offset，并重建已写入部分的行数与决策计数 (逐行读取，不占内存)"""
+        with open(self.part_path, "r+b") as f:
+            f.truncate(offset)
+        with open(self.part_path, "r", newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                self.rows += 1
+                # 与直接写入时保持一致：None 在 CSV 中是空串
+                self.decision_counts[row["decision"] or None] += 1
+                if self.on_restore is not None:
+                    self.on_restore(row)
+        # BOM 已在文件头部，续写时用不带 BOM 的 utf-8
+        return open(self.part_path, "a", newline="", encoding="utf-8")
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self.rows += 1
+        self.decision_counts[row.get("decision")] += 1
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """把缓冲区内容刷到磁盘，之后即使进程被杀也不会丢失这些行"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        if self.on_sync is not None:
+            self.on_sync(self.rows, self._file.tell())
+
+    def close(self):
+        """写完：最后一次 fsync 后把 .part 原子替换为正式文件"""
+        if self.closed:
+            return
+        self.sync()
+        self._file.close()
+        os.replace(self.part_path, self.path)
+        self.closed = True
+
+    def abort(self):
+        """运行出错：落盘已有的行并保留 .part 文件，不生成正式结果文件"""
+        if self.closed:
+            return
+        self.sync()
+        self._file.close()
+        self.closed = True
+
+
+def merge_result_files(part_paths, path, chunk_size=1 << 20):
+    """
+    按顺序拼接多个结果 CSV (如各分片的输出) 为一个文件：只保留第一个文件的 BOM 与表头，
+    逐块复制不整体读入内存，写完 fsync 后原子重命名，并删除被合并的文件。
+    """
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as out:
+        for k, part_path in enumerate(part_paths):
+            with open(part_path, "rb") as f:
+                header = f.readline()
+                if k == 0:
+                    out.write(header)
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    for part_path in part_paths:
+        os.remove(part_path)
+
+
+def apply_result_schema(df):
+    """按 RESULT_DTYPES 转换结果 DataFrame 的列类型 (原地修改并返回)"""
+    for column, dtype in RESULT_DTYPES.items():
+        if column not in df.columns:
+            continue
+        if column in NUMERIC_RESULT_COLUMNS and not pd.api.types.is_numeric_dtype(df[column].dtype):
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+        df[column] = df[column].astype(dtype)
+        if dtype == "category" and not df[column].cat.categories.is_monotonic_increasing:
+            # 类别表统一按取值排序：不论来自 CSV 还是列式文件，分组排序结果都相同
+            df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+    return df
+
+
+def _arrow_schema(columns):
+    """
+    列式文件的 schema：完全由 RESULT_DTYPES 决定，未声明类型的列为字符串，
+    不依赖某一分块的内容推断 (如第一块的 reason 全为空时会被推断成浮点数)。
+    """
+    fields = []
+    for column in columns:
+        type_name = ARROW_TYPES.get(RESULT_DTYPES.get(column), "string")
+        fields.append(pa.field(column, getattr(pa, type_name)()))
+    return pa.schema(fields)
+
+
+def columnar_path(csv_path, fmt):
+    """结果 CSV 对应的列式文件路径 (同名，扩展名换成格式对应的扩展名)"""
+    return os.path.splitext(csv_path)[0] + RESULT_FORMATS[fmt]
+
+
+def export_columnar(csv_path, fmt="parquet", chunk_size=500000):
+    """
+    把结果 CSV 按块转换为同名的 Parquet / Feather 文件 (按 RESULT_DTYPES 定型)，内存占用与结果行数无关。
+    先写 <文件名>.part 再原子替换，返回列式文件路径。
+    """
+    require_pyarrow()
+    path = columnar_path(csv_path, fmt)
+    tmp_path = path + ".part"
+    columns = list(pd.read_csv(csv_path, encoding="utf-8-sig", nrows=0).columns)
+    if not columns:
+        raise ValueError(f"结果文件为空: {csv_path}")
+    schema = _arrow_schema(columns)
+    # 未声明类型的列按字符串读取，各分块的类型一致
+    undeclared = {column: str for column in columns if column not in RESULT_DTYPES}
+    writer = sink = None
+    try:
+        if fmt == "parquet":
+            writer = pa_parquet.ParquetWriter(tmp_path, schema, compression="zstd")
+        else:
+            sink = pa.OSFile(tmp_path, "wb")
+            writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        for chunk in pd.read_csv(csv_path, encoding="utf-8-sig", chunksize=chunk_size, dtype=undeclared):
+            chunk = apply_result_schema(chunk)
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    except BaseException:
+        # 转换失败不留下半截的 .part 文件
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    writer.close()
+    if sink is not None:
+        sink.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_results(path, prefer_columnar=True):
+    """
+    读取结果文件并按 RESULT_DTYPES 定型，返回 (DataFrame, 实际读取的文件路径)。
+    path 可以是 CSV，也可以直接是 Parquet / Feather 文件；prefer_columnar 时若 CSV 旁有不早于它的同名列式文件，优先读取列式文件。
+    """
+    fmt = next((f for f, ext in RESULT_FORMATS.items() if path.lower().endswith(ext)), None)
+    if fmt is None and prefer_columnar and pa is not None:
+        for candidate_fmt in RESULT_FORMATS:
+            candidate = columnar_path(path, candidate_fmt)
+            if os.path.exists(candidate) and os.path.getmtime(candidate) >= os.path.getmtime(path):
+                path, fmt = candidate, candidate_fmt
+                break
+
+    if fmt is None:
+        return apply_result_schema(pd.read_csv(path, encoding="utf-8-sig")), path
+
+    require_pyarrow()
+    if fmt == "parquet":
+        names = pa_parquet.read_schema(path).names
+        categorical = [c for c, dtype in RESULT_DTYPES.items() if dtype == "category" and c in names]
+        table = pa_parquet.read_table(path, read_dictionary=categorical)
+    else:
+        table = pa_feather.read_table(path)
+    return apply_result_schema(table.to_pandas()), path
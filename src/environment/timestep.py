@@ -0,0 +1,183 @@
+import os
+import heapq
+import random
+from src.environment.market import OUTPUT_DIR, DEFAULT_SERVICE_RATE
+from src.environment.result_writer import StreamingResultWriter, RESULT_COLUMNS
+
+# 分时段仿真在结果文件末尾追加的列：到店时刻、所选门店在决策时的排队时长 (分钟)
+TIMESTEP_COLUMNS = RESULT_COLUMNS + ["arrival_time", "queue_time"]
+
+# 营业时段内每小时的到店客流权重：早高峰与午后两个峰值
+HOURLY_ARRIVAL_WEIGHTS = {
+    7: 4, 8: 10, 9: 9, 10: 6, 11: 5, 12: 6, 13: 8, 14: 9,
+    15: 7, 16: 5, 17: 4, 18: 3, 19: 2, 20: 2, 21: 1
+}
+
+
+def format_minute(minute):
+    """一天中的第几分钟 -> 'HH:MM'"""
+    minute = int(minute)
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+class EventQueue:
+    """按时间排序的最小堆事件队列，同一时刻按入队顺序出队"""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, time, payload):
+        heapq.heappush(self._heap, (time, self._seq, payload))
+        self._seq += 1
+
+    def pop_until(self, time, inclusive=False):
+        """弹出时间早于 time (inclusive=True 时含 time) 的全部事件，返回 [(时间, 事件), ...]"""
+        events = []
+        heap = self._heap
+        while heap and (heap[0][0] < time or (inclusive and heap[0][0] == time)):
+            event_time, _, payload = heapq.heappop(heap)
+            events.append((event_time, payload))
+        return events
+
+
+class ShopQueue:
+    """
+    单店出杯队列：自提与外卖订单共用门店产能，按 service_rate (杯/分钟) 依次完成。
+    waiting 为尚未完成的订单数，对外展示的排队时长 = waiting / service_rate。
+    """
+
+    def __init__(self, shop, open_minute):
+        self.shop = shop
+        self.service_rate = float(shop.get('service_rate') or DEFAULT_SERVICE_RATE)
+        self.waiting = 0
+        self.busy_until = open_minute
+
+    def add_order(self, now):
+        """接一单，返回该单的完成时刻"""
+        start = max(now, self.busy_until)
+        self.busy_until = start + 1.0 / self.service_rate
+        self.waiting += 1
+        return self.busy_until
+
+    def finish_order(self):
+        self.waiting -= 1
+
+    @property
+    def queue_minutes(self):
+        return round(self.waiting / self.service_rate)
+
+
+class TimeSteppedSimulation:
+    """
+    分时段离散事件仿真：顾客按客流曲线在营业时段内陆续到店，每个时段 (slot_minutes 分钟) 为一轮：
+      1. 处理时段开始前已完成的订单，刷新各店排队时长 (提示词里展示的即实时排队)
+      2. 本时段到店的顾客按当时的门店状态预筛、决策 (复用 CoffeeMarket 的并发/批量决策)
+      3. 下单的顾客计入对应门店队列，并按出杯速率排定完成事件
+    到店与出杯事件都放在最小堆里，5 万人次的全天仿真只需 O(n log n) 的事件调度。
+    """
+
+    def __init__(self, market, slot_minutes=10, open_hour=7, close_hour=22):
+        self.market = market
+        self.slot_minutes = slot_minutes
+        self.open_minute = open_hour * 60
+        self.close_minute = close_hour * 60
+        self.shops_by_id = {shop['id']: shop for shop in market.shops}
+        self.queues = {}
+        self.completions = EventQueue()
+        self._slot_times = []
+
+    def _init_queues(self):
+        """按地图配置的初始排队时长，在开门时预置等量的待出杯订单"""
+        for shop_id, shop in self.shops_by_id.items():
+            queue = ShopQueue(shop, self.open_minute)
+            for _ in range(round(float(shop['queue_time']) * queue.service_rate)):
+                self.completions.push(queue.add_order(self.open_minute), shop_id)
+            self.queues[shop_id] = queue
+
+    def schedule_arrivals(self, customers):
+        """按小时客流权重为每位顾客抽一个到店时刻，返回到店事件队列"""
+        hours = [h for h in HOURLY_ARRIVAL_WEIGHTS if self.open_minute <= h * 60 < self.close_minute]
+        weights = [HOURLY_ARRIVAL_WEIGHTS[h] for h in hours]
+        arrivals = EventQueue()
+        for customer, hour in zip(customers, random.choices(hours, weights=weights, k=len(customers))):
+            arrivals.push(hour * 60 + random.uniform(0, 60), customer)
+        return arrivals
+
+    def _on_decision(self, i, customer, decision_data, log_entry):
+        """决策写入前的回调：记录到店时刻与所见排队，下单则计入门店队列"""
+        arrival = self._slot_times[i]
+        log_entry["arrival_time"] = format_minute(arrival)
+        shop_id = str(decision_data.get('decision') or "").rsplit("_", 1)[0]
+        queue = self.queues.get(shop_id)
+        if queue is None:
+            log_entry["queue_time"] = None
+            return
+        log_entry["queue_time"] = queue.shop['queue_time']
+        self.completions.push(queue.add_order(arrival), shop_id)
+
+    def run(self, sample_size, platform_rules=None, concurrency=1, prompt_layout="classic", batch_size=1,
+            output_filename="simulation_results_timestep.csv"):
+        """
+        仿真一个营业日共 sample_size 人次到店。人次超过人口规模时允许同一顾客多次光顾。
+        结果按到店时间顺序流式写入 data/output/<output_filename>。
+        """
+        market = self.market
+        print(f"\n⏳ 分时段仿真: {format_minute(self.open_minute)}-{format_minute(self.close_minute)}，"
+              f"每 {self.slot_minutes} 分钟一轮，共 {sample_size} 人次到店...")
+        if sample_size <= len(market.customers):
+            customers = market.customers.take(market.customers.sample_positions(sample_size))
+        else:
+            customers = random.choices(market.customers, k=sample_size)
+        arrivals = self.schedule_arrivals(customers)
+        initial_queues = {shop_id: shop['queue_time'] for shop_id, shop in self.shops_by_id.items()}
+        self.completions = EventQueue()
+        self._init_queues()
+
+        writer = StreamingResultWriter(os.path.join(OUTPUT_DIR, output_filename), fieldnames=TIMESTEP_COLUMNS)
+        market.start_run(platform_rules, prompt_layout, writer)
+        market.decision_hooks.append(self._on_decision)
+        print(f"💾 决策结果实时写入: {writer.part_path}")
+
+        self.queue_history = []
+        done = 0
+        try:
+            for slot_start in range(self.open_minute, self.close_minute, self.slot_minutes):
+                for _, shop_id in self.completions.pop_until(slot_start, inclusive=True):
+                    self.queues[shop_id].finish_order()
+                for shop_id, queue in self.queues.items():
+                    queue.shop['queue_time'] = queue.queue_minutes
+                self.queue_history.append(
+                    (format_minute(slot_start), {shop_id: q.shop['queue_time'] for shop_id, q in self.queues.items()})
+                )
+
+                slot_arrivals = arrivals.pop_until(slot_start + self.slot_minutes)
+                if not slot_arrivals:
+                    continue
+                self._slot_times = [time for time, _ in slot_arrivals]
+                market.decide_round([c for _, c in slot_arrivals], concurrency, batch_size,
+                                    number_offset=done, total=sample_size)
+                done += len(slot_arrivals)
+        except BaseException:
+            writer.abort()
+            print(f"⚠️ 模拟中断，已完成的 {writer.rows} 条结果保留在: {writer.part_path}")
+            raise
+        finally:
+            market.decision_hooks.remove(self._on_decision)
+            # 排队时长在仿真中被实时改写，结束后恢复地图配置的初始值
+            for shop_id, queue_time in initial_queues.items():
+                self.shops_by_id[shop_id]['queue_time'] = queue_time
+
+        writer.close()
+        print("✅ 分时段仿真结束！")
+        self._print_queue_peaks()
+        market._print_results_summary()
+
+    def _print_queue_peaks(self):
+        print("\n--- ⏱️ 各门店全天排队峰值 ---")
+        for shop_id, shop in self.shops_by_id.items():
+            peak_time, peak = max(((t, q[shop_id]) for t, q in self.queue_history), key=lambda x: x[1])
+            print(f"{shop_id:<8} {shop['brand_name']:<16} 峰值 {peak} 分钟 @ {peak_time}")
@@ -0,0 +1,32 @@
+class DecisionBackend:
+    """
+    决策后端接口：CoffeeMarket 只依赖这组方法，不关心决策来自哪里。
+    现有实现：
+      - DeepSeekClient  (src.llm.client)      在线调用 DeepSeek / 任意 OpenAI 兼容接口 (含本地 Mock 服务)
+      - ReplayClient    (src.llm.journal)     回放录制日志，完全离线
+      - RuleBasedBackend (src.llm.rule_based) 进程内规则引擎，零网络、零成本，用于压测
+    """
+
+    name = "base"
+    # 可选的分阶段计时 (src.utils.telemetry.RunTelemetry)，由 CoffeeMarket 挂载
+    telemetry = None
+
+    def get_decision(self, system_prompt, user_prompt, model="deepseek-chat", customer_id=None, max_tokens=None):
+        """
+        返回决策字典 (decision/brand/method/item/price/reason)。
+        批量请求返回 {"decisions": [...]}，由调用方校验；max_tokens 为空时使用单人决策的默认值。
+        """
+        raise NotImplementedError
+
+    async def get_decision_async(self, system_prompt, user_prompt, model="deepseek-chat", customer_id=None,
+                                 max_tokens=None):
+        # 默认直接复用同步实现，纯 CPU 的后端无需真正的异步 IO
+        return self.get_decision(system_prompt, user_prompt, model, customer_id=customer_id, max_tokens=max_tokens)
+
+    async def aclose(self):
+        """释放绑定当前事件循环的异步资源 (如 HTTP 连接池)，并发决策结束、事件循环关闭前调用"""
+        return None
+
+    def stats(self):
+        """后端自身的运行统计，用于运行结束后的汇总打印"""
+        return {}
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join("data", "cache", "llm_responses.sqlite")
+
+# 缓存模式：use=先查缓存再请求，refresh=跳过读取但写回新结果，bypass=完全不经过缓存
+CACHE_MODES = ("use", "refresh", "bypass")
+
+# 命中时的最近访问时间先记在内存里，攒够这么多条 (或下一次写入、flush 时) 再一次性写回，
+# 命中不必每次提交一个磁盘事务；进程崩溃只会丢失尚未写回的访问时间，LRU 次序略有偏差
+ACCESS_FLUSH_EVERY = 256
+
+
+class ResponseCache:
+    """
+    内容寻址的 LLM 响应缓存 (SQLite 单文件)。
+    以完整请求 (模型、温度、messages、输出格式等) 的 SHA-256 为键，存储模型返回的原始文本；
+    按最近访问时间做容量上限的 LRU 淘汰，可选 TTL 过期。
+    分片运行时多个进程共用同一个库文件，条目数每次写入时都在写事务内重新统计，不在进程内单独计数。
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=100000, ttl=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # 并发仿真中异步任务与线程会共用连接，由 _lock 串行化访问
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._pending_access = {}
+
+    @staticmethod
+    def make_key(request):
+        """对完整请求参数做规范化序列化后取哈希，任何字段不同都视为不同请求"""
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """命中返回原始响应文本，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self._pending_access.pop(key, None)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._pending_access[key] = now
+            if len(self._pending_access) >= ACCESS_FLUSH_EVERY:
+                self._write_access()
+                self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            # 先写回攒下的访问时间，淘汰时按最新的访问次序
+            self._write_access()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            # 写事务内重新统计：其他进程写入的条目也计算在内
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if size > self.max_entries:
+                self._evict(size - self.max_entries)
+            self._conn.commit()
+
+    def flush(self):
+        """写回尚未落盘的访问时间 (运行结束时调用)"""
+        with self._lock:
+            self._write_access()
+            self._conn.commit()
+
+    def _write_access(self):
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                [(now, key) for key, now in self._pending_access.items()]
+            )
+            self._pending_access.clear()
+
+    def _evict(self, count):
+        """淘汰最久未访问的 count 条记录"""
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+            (count,)
+        )
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 2) if total else 0.0,
+            "entries": entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._write_access()
+            self._conn.commit()
+            self._conn.close()
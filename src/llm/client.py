@@ -1,12 +1,70 @@
 import os
 import json
-from openai import OpenAI
+import time
+import asyncio
+import threading
+from contextlib import nullcontext
+import openai
+from openai import OpenAI, AsyncOpenAI
+from src.llm.backend import DecisionBackend
+from src.llm.tokens import estimate_tokens
+from src.llm.rate_limiter import get_shared_rate_limiter, get_shared_concurrency_controller
 
-class DeepSeekClient:
-    def __init__(self, api_key=None):
+# 限流预算默认值，可通过环境变量按账号实际额度调整
+DEFAULT_RPM = int(os.getenv("DEEPSEEK_RPM", 600))
+DEFAULT_TPM = int(os.getenv("DEEPSEEK_TPM", 1000000))
+MAX_RETRIES = 3
+DECISION_MAX_TOKENS = 200
+
+
+def build_decision_request(system_prompt, user_prompt, model="deepseek-chat", max_tokens=None):
+    """
+    组装决策请求参数 (同步/异步调用、缓存键、录制回放共用同一份结构)。
+    max_tokens 默认按单人决策设置，批量决策按顾客数放大。
+    """
+    return dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        # 设置 response_format 为 json_object 可以强制要求模型输出 JSON 
+        # (注意：提示词里必须也提到 "json" 单词，咱们前面已经写了)
+        response_format={"type": "json_object"},
+        temperature=0.7,  # 0.7 给予一定的随机性，符合人类消费的非绝对理性
+        max_tokens=max_tokens or DECISION_MAX_TOKENS    # 决策结果很短，限制 token 节省成本和时间
+    )
+
+
+def parse_decision_json(text):
+    """
+    清理 LLM 返回的文本并解析为 JSON。
+    即便开启了 json_object，有时模型也会加上 ```json ``` 的 Markdown 标记。
+    """
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+        
+    try:
+        return json.loads(text.strip())
+    except json.JSONDecodeError:
+        print(f"❌ JSON 解析失败，原始文本:\n{text}")
+        return {"decision": "None", "reason": "JSON_PARSE_ERROR"}
+
+
+class DeepSeekClient(DecisionBackend):
+    name = "deepseek"
+
+    def __init__(self, api_key=None, base_url="https://api.deepseek.com", rpm=None, tpm=None,
+                 cache=None, cache_mode="use", journal=None, max_concurrency=None):
         """
         初始化 DeepSeek 客户端。
         推荐将 API Key 写在系统环境变量里，或者在测试时直接传入。
+        max_concurrency 为配置的在途请求数 (--concurrency)，作为并发控制器的上限。
         """
         # 如果代码里没传，就去环境变量找 DEEPSEEK_API_KEY
         self.api_key = api_key or os.getenv("DEEPSEEK_API_KEY")
@@ -14,59 +72,247 @@ class DeepSeekClient:
             raise ValueError("未找到 API Key！请传入 api_key 或设置 DEEPSEEK_API_KEY 环境变量。")
         
         # DeepSeek 的接口地址完全兼容 OpenAI SDK
+        # SDK 自带的重试会把 429 藏起来，这里关闭它，由下面的并发控制器统一退避
+        self.base_url = base_url
+        self.timeout = float(os.getenv("API_TIMEOUT", 30))
         self.client = OpenAI(
             api_key=self.api_key,
-            base_url="https://api.deepseek.com"
+            base_url=self.base_url,
+            timeout=self.timeout,
+            max_retries=0
         )
-        
-    def get_decision(self, system_prompt, user_prompt, model="deepseek-chat"):
+        # 异步客户端按事件循环懒加载 (httpx 的异步连接池不能跨事件循环复用)
+        self._async_client = None
+        self._async_loop = None
+
+        # 限流器与并发控制器按接口地址在进程内共享，所有调用方共用同一份预算
+        self.rate_limiter = get_shared_rate_limiter(self.base_url, rpm or DEFAULT_RPM, tpm or DEFAULT_TPM)
+        self.concurrency = get_shared_concurrency_controller(self.base_url, max_limit=max_concurrency)
+
+        # API 返回的 usage 累计 (含 DeepSeek 上下文缓存命中/未命中的 prompt tokens)
+        self.usage = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": 0
+        }
+        self._usage_lock = threading.Lock()
+
+        # 可选的本地响应缓存 (ResponseCache)，cache_mode 见 src.llm.cache.CACHE_MODES
+        self.cache = cache
+        self.cache_mode = cache_mode
+
+        # 可选的录制日志 (DecisionJournal)，记录每一次请求/响应原文，供 --replay 离线回放
+        self.journal = journal
+
+    def stats(self):
+        stats = {
+            "throttled": self.concurrency.throttle_count,
+            "concurrency_limit": self.concurrency.current_limit
+        }
+        stats.update(self.usage)
+        return stats
+
+    def _record_usage(self, usage):
         """
-        向大模型发送请求，获取顾客的购买决策
+        累计一次成功请求的 usage。
+        DeepSeek 直接返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens；
+        其他 OpenAI 兼容服务则从 prompt_tokens_details.cached_tokens 推算。
         """
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        hit_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+        if hit_tokens is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            hit_tokens = getattr(details, "cached_tokens", 0) or 0
+        miss_tokens = getattr(usage, "prompt_cache_miss_tokens", None)
+        if miss_tokens is None:
+            miss_tokens = prompt_tokens - hit_tokens
+        with self._usage_lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += prompt_tokens
+            self.usage["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+            self.usage["prompt_cache_hit_tokens"] += hit_tokens
+            self.usage["prompt_cache_miss_tokens"] += miss_tokens
+
+    def _timer(self, stage):
+        return self.telemetry.timer(stage) if self.telemetry is not None else nullcontext()
+
+    def _count(self, name):
+        if self.telemetry is not None:
+            self.telemetry.count(name)
+
+    @staticmethod
+    def _estimate_request_tokens(request):
+        """按 prompt 长度 + max_tokens 预估本次请求消耗的 TPM 预算"""
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in request["messages"])
+        return prompt_tokens + request.get("max_tokens", 0)
+
+    @staticmethod
+    def _is_throttled(error):
+        """429 / 5xx / 网络超时视为服务端过载，需要退避；其余错误 (如 401) 重试也无济于事"""
+        if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    @staticmethod
+    def _backoff_seconds(attempt):
+        return min(2 ** attempt, 30)
+
+    def _complete(self, request):
+        """
+        发送请求并返回原始文本；经过限流、并发控制，过载时指数退避重试。
+        先等令牌桶再占并发名额 (排队等预算时不占名额)，名额在 finally 中归还，取消或中断也不会泄漏。
+        """
+        estimated = self._estimate_request_tokens(request)
+        for attempt in range(MAX_RETRIES + 1):
+            with self._timer("rate_limit_wait"):
+                self.rate_limiter.acquire(estimated)
+                self.concurrency.acquire()
+            throttled = False
+            try:
+                with self._timer("llm_network"):
+                    response = self.client.chat.completions.create(**request)
+            except Exception as e:
+                throttled = self._is_throttled(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    raise
+            finally:
+                self.concurrency.release(throttled=throttled)
+            if throttled:
+                self._count("retries")
+                time.sleep(self._backoff_seconds(attempt))
+                continue
+            usage = getattr(response, "usage", None)
+            self.rate_limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            self._record_usage(usage)
+            return response.choices[0].message.content
+
+    async def _complete_async(self, request):
+        estimated = self._estimate_request_tokens(request)
+        for attempt in range(MAX_RETRIES + 1):
+            with self._timer("rate_limit_wait"):
+                await self.rate_limiter.acquire_async(estimated)
+                await self.concurrency.acquire_async()
+            throttled = False
+            try:
+                with self._timer("llm_network"):
+                    response = await self._get_async_client().chat.completions.create(**request)
+            except Exception as e:
+                throttled = self._is_throttled(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    raise
+            finally:
+                self.concurrency.release(throttled=throttled)
+            if throttled:
+                self._count("retries")
+                await asyncio.sleep(self._backoff_seconds(attempt))
+                continue
+            usage = getattr(response, "usage", None)
+            self.rate_limiter.settle(estimated, getattr(usage, "total_tokens", None))
+            self._record_usage(usage)
+            return response.choices[0].message.content
+
+    def _cache_lookup(self, request):
+        """返回 (缓存键, 命中的原始文本)；未启用缓存或未命中时文本为 None"""
+        if self.cache is None or self.cache_mode == "bypass":
+            return None, None
+        key = self.cache.make_key(request)
+        if self.cache_mode == "refresh":
+            return key, None
+        return key, self.cache.get(key)
+
+    def _cache_store(self, key, raw_content, decision):
+        # 解析失败的响应不入缓存，否则下次重跑会一直命中坏结果
+        if key is None or decision.get("reason") == "JSON_PARSE_ERROR":
+            return
+        self.cache.put(key, raw_content)
+
+    def _finish(self, customer_id, request, key, raw_content, from_cache):
+        """解析原始文本，并写回缓存 / 录制日志"""
+        with self._timer("json_parse"):
+            decision = parse_decision_json(raw_content)
+        self._count("cache_hits" if from_cache else "api_responses")
+        if not from_cache:
+            self._cache_store(key, raw_content, decision)
+        if self.journal is not None:
+            self.journal.append(customer_id, request, response=raw_content)
+        return decision
+
+    def _fail(self, customer_id, request, error):
+        print(f"❌ API 调用失败: {error}")
+        self._count("api_errors")
+        if self.journal is not None:
+            self.journal.append(customer_id, request, error=str(error))
+        # 如果出错（比如网络断了），返回一个默认的不购买决策，防止程序崩溃
+        return {"decision": "None", "reason": "API_ERROR"}
+
+    def get_decision(self, system_prompt, user_prompt, model="deepseek-chat", customer_id=None, max_tokens=None):
+        """
+        向大模型发送请求，获取顾客的购买决策。
+        customer_id 仅用于录制日志，便于回放时按顾客对齐。
+        """
+        request = build_decision_request(system_prompt, user_prompt, model, max_tokens)
         try:
-            # 调用 API
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                # 设置 response_format 为 json_object 可以强制要求模型输出 JSON 
-                # (注意：提示词里必须也提到 "json" 单词，咱们前面已经写了)
-                response_format={"type": "json_object"},
-                temperature=0.7,  # 0.7 给予一定的随机性，符合人类消费的非绝对理性
-                max_tokens=200    # 决策结果很短，限制 token 节省成本和时间
-            )
-            
-            # 获取模型返回的纯文本
-            raw_content = response.choices[0].message.content
-            
-            # 解析并返回 Python 字典
-            return self._parse_json(raw_content)
-            
+            key, raw_content = self._cache_lookup(request)
+            from_cache = raw_content is not None
+            if not from_cache:
+                # 调用 API，获取模型返回的纯文本
+                raw_content = self._complete(request)
         except Exception as e:
-            print(f"❌ API 调用失败: {e}")
-            # 如果出错（比如网络断了），返回一个默认的不购买决策，防止程序崩溃
-            return {"decision": "None", "reason": "API_ERROR"}
+            return self._fail(customer_id, request, e)
+
+        # 解析并返回 Python 字典
+        return self._finish(customer_id, request, key, raw_content, from_cache)
 
-    def _parse_json(self, text):
+    def _get_async_client(self):
+        """获取绑定当前事件循环的 AsyncOpenAI 客户端"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self.timeout,
+                max_retries=0
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    async def aclose(self):
+        """关闭当前事件循环上的 AsyncOpenAI 客户端 (httpx 连接池)，下次并发运行时重新创建"""
+        if self._async_client is not None:
+            client = self._async_client
+            self._async_client = None
+            self._async_loop = None
+            await client.close()
+
+    async def get_decision_async(self, system_prompt, user_prompt, model="deepseek-chat", customer_id=None,
+                                 max_tokens=None):
         """
-        内部辅助方法：清理 LLM 返回的文本并解析为 JSON。
-        即便开启了 json_object，有时模型也会加上 ```json ``` 的 Markdown 标记。
+        get_decision 的异步版本，供并发仿真使用。
+        失败时同样返回默认的不购买决策，保证单个顾客出错不会拖垮整批请求。
+        缓存 (SQLite) 与录制日志的读写放到线程池执行，不阻塞事件循环。
         """
-        text = text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.startswith("```"):
-            text = text[3:]
-        if text.endswith("```"):
-            text = text[:-3]
-            
+        request = build_decision_request(system_prompt, user_prompt, model, max_tokens)
+        blocking_io = self.cache is not None or self.journal is not None
         try:
-            return json.loads(text.strip())
-        except json.JSONDecodeError:
-            print(f"❌ JSON 解析失败，原始文本:\n{text}")
-            return {"decision": "None", "reason": "JSON_PARSE_ERROR"}
+            if self.cache is not None:
+                key, raw_content = await asyncio.to_thread(self._cache_lookup, request)
+            else:
+                key, raw_content = None, None
+            from_cache = raw_content is not None
+            if not from_cache:
+                raw_content = await self._complete_async(request)
+        except Exception as e:
+            if blocking_io:
+                return await asyncio.to_thread(self._fail, customer_id, request, e)
+            return self._fail(customer_id, request, e)
+
+        if blocking_io:
+            return await asyncio.to_thread(self._finish, customer_id, request, key, raw_content, from_cache)
+        return self._finish(customer_id, request, key, raw_content, from_cache)
 
 # --- 简单测试逻辑 ---
 if __name__ == "__main__":
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from src.llm.backend import DecisionBackend
+from src.llm.cache import ResponseCache
+from src.llm.client import build_decision_request, parse_decision_json
+
+# 请求指纹与缓存键同源，回放时用于校验 prompt 是否与录制时一致
+request_fingerprint = ResponseCache.make_key
+
+
+class DecisionJournal:
+    """
+    仿真录制日志 (追加写入的 JSONL)。
+    第一行是 header，记录随机种子、模式、策略等复现整次运行所需的参数；
+    之后每行是一次 LLM 调用的原始请求与原始响应 (或错误信息)。
+    """
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._write({"type": "header", "created_at": time.time(), "meta": meta or {}})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def append(self, customer_id, request, response=None, error=None):
+        with self._lock:
+            self.count += 1
+            self._write({
+                "type": "call",
+                "seq": self.count,
+                "customer_id": customer_id,
+                "fingerprint": request_fingerprint(request),
+                "request": request,
+                "response": response,
+                "error": error
+            })
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_journal_meta(path):
+    """只读取 header，不加载整份日志"""
+    with open(path, "r", encoding="utf-8") as f:
+        record = json.loads(f.readline())
+    return record.get("meta", {}) if record.get("type") == "header" else {}
+
+
+def read_journal(path):
+    """读取录制日志，返回 (header 的 meta, 调用记录列表)"""
+    meta = {}
+    calls = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("type") == "header":
+                meta = record.get("meta", {})
+            elif record.get("type") == "call":
+                calls.append(record)
+    return meta, calls
+
+
+class ReplayClient(DecisionBackend):
+    """
+    离线回放客户端：接口与 DeepSeekClient 一致，但完全不访问网络。
+    优先按 customer_id 顺序匹配录制结果 (这样修改了提示词渲染也能回放)，
+    其次按请求指纹匹配；两者都找不到时返回 REPLAY_MISS 的不购买决策。
+    """
+
+    name = "replay"
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.meta, calls = read_journal(journal_path)
+        self._by_customer = defaultdict(deque)
+        self._by_fingerprint = defaultdict(deque)
+        for record in calls:
+            if record.get("customer_id") is not None:
+                self._by_customer[record["customer_id"]].append(record)
+            self._by_fingerprint[record["fingerprint"]].append(record)
+        self.total_calls = len(calls)
+        self.replayed = 0
+        self.misses = 0
+        self.prompt_changed = 0
+        self._lock = threading.Lock()
+
+    def _take(self, customer_id, request):
+        fingerprint = request_fingerprint(request)
+        with self._lock:
+            queue = self._by_customer.get(customer_id)
+            if queue:
+                record = queue.popleft()
+            else:
+                queue = self._by_fingerprint.get(fingerprint)
+                record = queue.popleft() if queue else None
+            if record is None:
+                self.misses += 1
+                return None
+            self.replayed += 1
+            if record["fingerprint"] != fingerprint:
+                self.prompt_changed += 1
+            return record
+
+    def get_decision(self, system_prompt, user_prompt, model="deepseek-chat", customer_id=None, max_tokens=None):
+        record = self._take(customer_id, build_decision_request(system_prompt, user_prompt, model, max_tokens))
+        if record is None:
+            return {"decision": "None", "reason": "REPLAY_MISS"}
+        if record.get("error") is not None:
+            return {"decision": "None", "reason": "API_ERROR"}
+        return parse_decision_json(record["response"])
+
+    def stats(self):
+        return {
+            "recorded": self.total_calls,
+            "replayed": self.replayed,
+            "misses": self.misses,
+            "prompt_changed": self.prompt_changed
+        }
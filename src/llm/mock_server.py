@@ -0,0 +1,161 @@
+"""
+本地 OpenAI 兼容的 Mock LLM 服务，用于离线压测整条仿真链路。
+
+  python -m src.llm.mock_server --port 8765 --latency-ms 400 --error-rate 0.02
+
+任意以 /chat/completions 结尾的 POST 请求都会按配置的时延分布休眠，
+按配置的概率返回 429/500，其余情况用规则引擎生成 JSON 决策。
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.llm.rule_based import decide
+from src.llm.tokens import estimate_tokens
+
+LATENCY_DISTRIBUTIONS = ("fixed", "lognormal", "exponential")
+
+
+class MockLLMServer:
+    """
+    可配置时延/错误分布的 OpenAI 兼容服务：
+      - latency_ms / latency_dist: 时延中位数与分布 (fixed / lognormal / exponential)
+      - error_rate: 返回 500 的概率；throttle_rate: 返回 429 的概率
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=300, latency_dist="lognormal",
+                 latency_sigma=0.5, error_rate=0.0, throttle_rate=0.0, seed=None):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知的时延分布: {latency_dist}。可选值: {list(LATENCY_DISTRIBUTIONS)}")
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self._seen_prefixes = set()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _sample(self):
+        """抽取本次请求的 (时延秒数, 错误状态码或 None)"""
+        with self._lock:
+            self.requests += 1
+            roll = self._rng.random()
+            if self.latency_dist == "fixed":
+                latency = self.latency_ms
+            elif self.latency_dist == "exponential":
+                latency = self._rng.expovariate(1.0 / self.latency_ms) if self.latency_ms > 0 else 0
+            else:
+                latency = self._rng.lognormvariate(0, self.latency_sigma) * self.latency_ms
+        if roll < self.throttle_rate:
+            return latency / 1000.0, 429
+        if roll < self.throttle_rate + self.error_rate:
+            return latency / 1000.0, 500
+        return latency / 1000.0, None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                latency, error_status = server._sample()
+                time.sleep(latency)
+                if error_status is not None:
+                    return self._send(error_status, {"error": {"message": "mock error", "type": "server_error", "code": error_status}})
+                self._send(200, server.build_completion(request))
+
+            def _send(self, status, body):
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                # 压测时每秒上百个请求，不打印访问日志
+                pass
+
+        return Handler
+
+    def build_completion(self, request):
+        """按 OpenAI chat.completion 格式返回规则引擎的决策"""
+        messages = request.get("messages", [])
+        system_prompt = "\n".join(m["content"] for m in messages if m.get("role") == "system")
+        user_prompt = "\n".join(m["content"] for m in messages if m.get("role") == "user")
+        content = json.dumps(decide(system_prompt, user_prompt), ensure_ascii=False)
+        system_tokens = estimate_tokens(system_prompt)
+        prompt_tokens = system_tokens + estimate_tokens(user_prompt)
+        completion_tokens = estimate_tokens(content)
+        # 模拟 DeepSeek 的上下文硬盘缓存：重复出现的 system 前缀按 64 token 为单位命中
+        with self._lock:
+            cache_hit = (system_tokens // 64) * 64 if system_prompt in self._seen_prefixes else 0
+            self._seen_prefixes.add(system_prompt)
+        return {
+            "id": f"mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_cache_hit_tokens": cache_hit,
+                "prompt_cache_miss_tokens": prompt_tokens - cache_hit
+            }
+        }
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 Mock LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300, help="时延中位数 (毫秒)")
+    parser.add_argument("--latency-dist", choices=list(LATENCY_DISTRIBUTIONS), default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的概率")
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        host=args.host, port=args.port, latency_ms=args.latency_ms, latency_dist=args.latency_dist,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate
+    )
+    print(f"🧪 Mock LLM 服务已启动: {server.url}  (DeepSeekClient(base_url=...) 指向该地址即可)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
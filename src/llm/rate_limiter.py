@@ -0,0 +1,196 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为 capacity，每秒补充 refill_rate 个令牌。
+    采用"预约"方式扣减 —— 令牌可以透支为负数，调用方据返回的等待时间排队，
+    这样并发请求天然按到达顺序排队，不会出现饥饿。
+    """
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+
+    def reserve(self, amount, now):
+        """扣减 amount 个令牌，返回需要等待的秒数 (0 表示立即可用)"""
+        self._refill(now)
+        # 单次请求超过桶容量时按容量计，否则永远等不到
+        self.tokens -= min(float(amount), self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_rate
+
+    def configure(self, capacity, refill_rate):
+        """修改容量与补充速率，已有令牌不超过新容量"""
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def refund(self, amount):
+        """归还 (或追加扣减，amount 为负) 令牌，用于按实际 usage 校正预估值"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    双预算限流器：同时约束每分钟请求数 (RPM) 与每分钟 token 数 (TPM)。
+    线程安全，同步与异步调用方共用同一组令牌桶。
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._request_bucket = TokenBucket(rpm, rpm / 60.0)
+        self._token_bucket = TokenBucket(tpm, tpm / 60.0)
+        self._lock = threading.Lock()
+
+    def configure(self, rpm, tpm):
+        """更新 RPM / TPM 预算 (共享实例被以不同预算再次获取时)"""
+        with self._lock:
+            self.rpm = rpm
+            self.tpm = tpm
+            self._request_bucket.configure(rpm, rpm / 60.0)
+            self._token_bucket.configure(tpm, tpm / 60.0)
+
+    def _reserve(self, tokens):
+        with self._lock:
+            now = time.monotonic()
+            wait_requests = self._request_bucket.reserve(1, now)
+            wait_tokens = self._token_bucket.reserve(tokens, now)
+        return max(wait_requests, wait_tokens)
+
+    def acquire(self, tokens):
+        """阻塞直到 1 个请求名额和 tokens 个 token 预算都可用"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """请求结束后用 API 返回的真实 token 数校正 TPM 预算"""
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._token_bucket.refund(estimated_tokens - actual_tokens)
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD 并发控制器 (加性增、乘性减，同 TCP 拥塞控制)：
+    - 请求成功：并发上限每轮约 +1 (每次成功 +increase/limit)
+    - 遇到 429/5xx/超时：并发上限减半，cooldown 秒内只减一次，避免同一波失败反复减半
+    max_limit 取用户配置的并发数 (--concurrency)，初始上限默认与之相同：不做慢启动，
+    没有过载信号时并发就是用户要求的值，限流后再按 AIMD 收缩、恢复。
+    """
+
+    def __init__(self, initial_limit=None, min_limit=1, max_limit=64,
+                 increase=1.0, decrease_factor=0.5, cooldown=2.0, poll_interval=0.01):
+        self.limit = float(initial_limit if initial_limit is not None else max_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self.throttle_count = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def try_acquire(self):
+        with self._cond:
+            if self.in_flight < self.current_limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.current_limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        # 控制器跨线程、跨事件循环共享，这里用短间隔轮询代替 asyncio 原语
+        while not self.try_acquire():
+            await asyncio.sleep(self.poll_interval)
+
+    def raise_max_limit(self, max_limit):
+        """调高并发上限 (共享实例被更大的 --concurrency 再次获取时)，当前上限一并提到该值"""
+        with self._cond:
+            if max_limit <= self.max_limit:
+                return
+            self.max_limit = max_limit
+            self.limit = max(self.limit, float(max_limit))
+            self._cond.notify_all()
+
+    def release(self, throttled=False):
+        """释放一个名额，并根据本次请求结果调整并发上限"""
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_count += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_limit), self.limit + self.increase / self.limit)
+            self._cond.notify_all()
+
+
+# 进程级共享实例：同一进程内所有 DeepSeekClient (无论同步/异步) 共用一套预算
+_shared_lock = threading.Lock()
+_shared_limiters = {}
+_shared_controllers = {}
+
+# 调用方没有给出并发数时，从这个上限起步 (慢启动)，再按 AIMD 增长到控制器默认的 max_limit
+UNCONFIGURED_INITIAL_LIMIT = 8
+
+
+def get_shared_rate_limiter(key, rpm, tpm):
+    """进程内按 key 共享的限流器；再次获取时预算不同则改用新预算"""
+    with _shared_lock:
+        limiter = _shared_limiters.get(key)
+        if limiter is None:
+            limiter = _shared_limiters[key] = RateLimiter(rpm, tpm)
+        elif (limiter.rpm, limiter.tpm) != (rpm, tpm):
+            print(f"⚠️  {key} 的限流预算由 RPM {limiter.rpm} / TPM {limiter.tpm} 改为 RPM {rpm} / TPM {tpm}")
+            limiter.configure(rpm, tpm)
+        return limiter
+
+
+def get_shared_concurrency_controller(key, max_limit=None):
+    """
+    进程内按 key 共享的并发控制器，max_limit 为调用方配置的并发数 (None 时用控制器默认值)。
+    已存在且 max_limit 更大时调高上限，不会被先创建的调用方压低。
+    """
+    with _shared_lock:
+        controller = _shared_controllers.get(key)
+        if controller is None:
+            if max_limit is None:
+                controller = AdaptiveConcurrencyController(initial_limit=UNCONFIGURED_INITIAL_LIMIT)
+            else:
+                controller = AdaptiveConcurrencyController(max_limit=max_limit)
+            _shared_controllers[key] = controller
+        elif max_limit is not None:
+            controller.raise_max_limit(max_limit)
+        return controller
@@ -0,0 +1,110 @@
+import re
+from src.llm.backend import DecisionBackend
+
+# 从决策提示词中解析候选方案 (格式由 Customer.generate_decision_prompt 生成)
+OPTION_HEADER_RE = re.compile(r"【选项 (\S+?)】(?:步行去|点) (.+?) \(")
+ITEM_RE = re.compile(r"推荐商品: (.+?) \(原价: ([\d.]+)元")
+PICKUP_PRICE_RE = re.compile(r"到手估算: ([\d.]+)元")
+DELIVERY_PRICE_RE = re.compile(r"外卖到手总价: ([\d.]+)元")
+WALK_WAIT_RE = re.compile(r"需步行约 (\d+) 分钟\) \| 排队: 约 (\d+) 分钟")
+DELIVERY_WAIT_RE = re.compile(r"预估等待: (\d+) 分钟")
+SCORE_RE = re.compile(r"综合评分: ([\d.]+)")
+SENSITIVITY_RE = re.compile(r"敏感度属于(Low|Medium|High)")
+# 批量请求中每位顾客的区块标题 (格式见 prompt_template.BATCH_CUSTOMER_HEADER)
+BATCH_HEADER_RE = re.compile(r"^===== 顾客 (\S+) =====$", re.MULTILINE)
+
+# 价格敏感度 -> 每元价格扣减的效用
+PRICE_WEIGHTS = {"Low": 0.2, "Medium": 0.5, "High": 1.0}
+WAIT_WEIGHT = 0.3
+
+
+def parse_options(user_prompt):
+    """把提示词里的每个【选项】解析为字典，'None' 选项不在其中"""
+    options = []
+    for block in user_prompt.split("【选项 ")[1:]:
+        block = "【选项 " + block
+        header = OPTION_HEADER_RE.search(block)
+        item = ITEM_RE.search(block)
+        score = SCORE_RE.search(block)
+        if not (header and item and score):
+            continue
+        option_id = header.group(1)
+        is_delivery = option_id.endswith("_Delivery")
+        if is_delivery:
+            price = DELIVERY_PRICE_RE.search(block)
+            wait = DELIVERY_WAIT_RE.search(block)
+            wait_minutes = int(wait.group(1)) if wait else 30
+        else:
+            price = PICKUP_PRICE_RE.search(block)
+            wait = WALK_WAIT_RE.search(block)
+            wait_minutes = int(wait.group(1)) + int(wait.group(2)) if wait else 0
+        options.append({
+            "decision": option_id,
+            "brand": header.group(2),
+            "method": "外卖" if is_delivery else "自提",
+            "item": item.group(1),
+            "price": float(price.group(1)) if price else float(item.group(2)),
+            "wait": wait_minutes,
+            "score": float(score.group(1))
+        })
+    return options
+
+
+def decide_batch(user_prompt):
+    """批量请求：按顾客区块逐一决策，返回 {"decisions": [...]}"""
+    pieces = BATCH_HEADER_RE.split(user_prompt)
+    decisions = []
+    # split 结果为 [区块前文本, 编号1, 区块1, 编号2, 区块2, ...]
+    for customer_id, block in zip(pieces[1::2], pieces[2::2]):
+        decision = _decide_one("", block)
+        decision["customer_id"] = int(customer_id) if customer_id.isdigit() else customer_id
+        decisions.append(decision)
+    return {"decisions": decisions}
+
+
+def decide(system_prompt, user_prompt):
+    """
+    确定性的规则决策：效用 = 综合评分 - 价格权重 × 到手价 - 等待权重 × 等待分钟。
+    价格权重取自人设中的价格敏感度；人设明确不接受外卖时排除外卖选项。
+    user prompt 是批量请求时对每位顾客分别决策。
+    """
+    if BATCH_HEADER_RE.search(user_prompt):
+        return decide_batch(user_prompt)
+    return _decide_one(system_prompt, user_prompt)
+
+
+def _decide_one(system_prompt, user_prompt):
+    text = f"{system_prompt}\n{user_prompt}"
+    options = parse_options(user_prompt)
+    if "不接受外卖" in text:
+        options = [o for o in options if o["method"] != "外卖"]
+    if not options:
+        return {"decision": "None", "brand": None, "method": None, "item": None, "price": 0, "reason": "没有合适的选择"}
+
+    sensitivity = SENSITIVITY_RE.search(text)
+    price_weight = PRICE_WEIGHTS.get(sensitivity.group(1) if sensitivity else "Medium", 0.5)
+    best = max(options, key=lambda o: o["score"] - price_weight * o["price"] - WAIT_WEIGHT * o["wait"])
+    return {
+        "decision": best["decision"],
+        "brand": best["brand"],
+        "method": best["method"],
+        "item": best["item"],
+        "price": best["price"],
+        "reason": "外卖省时又划算" if best["method"] == "外卖" else "综合性价比最高"
+    }
+
+
+class RuleBasedBackend(DecisionBackend):
+    """进程内规则决策后端：不访问网络，输出与 LLM 相同结构的决策，用于离线压测与基准测试"""
+
+    name = "rule"
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_decision(self, system_prompt, user_prompt, model="deepseek-chat", customer_id=None, max_tokens=None):
+        self.calls += 1
+        return decide(system_prompt, user_prompt)
+
+    def stats(self):
+        return {"calls": self.calls}
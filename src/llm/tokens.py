@@ -0,0 +1,14 @@
+import math
+
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的 token 数 (DeepSeek 官方经验值)：
+    1 个中文字符 ≈ 0.6 token，1 个英文字符/数字/符号 ≈ 0.3 token。
+    仅用于限流预算和成本预估，精确值以 API 返回的 usage 为准。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿' or '　' <= ch <= '〿' or '＀' <= ch <= '￯')
+    other = len(text) - cjk
+    return int(math.ceil(cjk * 0.6 + other * 0.3))
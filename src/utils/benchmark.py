@@ -0,0 +1,231 @@
+import gc
+import os
+import json
+import time
+import random
+import shutil
+import platform
+from contextlib import redirect_stdout
+from datetime import datetime
+from src.agents.population import load_population_store
+from src.analysis.analytics import CoffeeMarketAnalyzer
+from src.environment.market import CoffeeMarket
+from src.llm.rule_based import RuleBasedBackend
+from src.utils.population_generator import ShanghaiCustomerGenerator
+
+BENCHMARK_DIR = "data/benchmarks"
+BASELINE_FILENAME = "baseline.json"
+
+# 端到端吞吐的顾客规模；人口规模取其中最大值
+DEFAULT_SIZES = (1000, 10000, 100000)
+# 指标比基线慢超过该比例即视为性能回退
+DEFAULT_THRESHOLD = 0.25
+# 固定种子：人口、坐标、抽样与规则决策全部确定，每次运行的工作量完全相同
+BENCHMARK_SEED = 20240601
+# 每项指标重复测量取最小值，降低机器抖动的影响 (最大规模的端到端只跑一次)
+REPEATS = 3
+# 绝对差值小于该秒数的变化不算回退 (毫秒级指标的相对抖动很大)
+MIN_REGRESSION_SECONDS = 0.02
+# 提示词渲染的测量规模
+PROMPT_SAMPLE = 10000
+
+
+def _timed(fn, repeats=1):
+    """执行 repeats 次取最短耗时，返回 (秒, 最后一次的返回值)。与 timeit 一样，计时期间关闭垃圾回收"""
+    best, result = None, None
+    for _ in range(repeats):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BenchmarkSuite:
+    """
+    离线性能基准：规则决策后端 (RuleBasedBackend) + 固定种子，不访问网络，结果可复现。
+    测量人口生成与加载 (冷/热启动)、批量预筛、提示词渲染、1k/10k/100k 顾客的端到端吞吐以及分析报告生成。
+    各项指标均为耗时 (秒，越小越好)，与 data/benchmarks/baseline.json 对比判断是否回退。
+    所有中间文件写在 data/benchmarks/work/ 下，跑完删除。
+    """
+
+    def __init__(self, brand_library_json, map_config, platform_rules, sizes=DEFAULT_SIZES,
+                 directory=BENCHMARK_DIR, seed=BENCHMARK_SEED, repeats=REPEATS):
+        self.brand_library_json = brand_library_json
+        self.map_config = map_config
+        self.platform_rules = platform_rules
+        self.sizes = sorted(sizes)
+        self.directory = directory
+        self.seed = seed
+        self.repeats = repeats
+        self.work_dir = os.path.join(directory, "work")
+        self.metrics = {}
+
+    def _record(self, name, seconds, **extra):
+        self.metrics[name] = dict(seconds=round(seconds, 4), **extra)
+        details = " | ".join(f"{k}: {v}" for k, v in extra.items())
+        print(f"   {name:<32} {seconds:>9.3f}s" + (f" | {details}" if details else ""))
+
+    def run(self):
+        """运行全部基准，返回结果字典 (含环境信息与各项指标)"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir)
+        population_size = self.sizes[-1]
+        print(f"🏁 基准测试: 人口 {population_size:,} 人 | 端到端规模 {', '.join(f'{n:,}' for n in self.sizes)} | 种子 {self.seed}")
+        try:
+            # 逐条决策的打印会主导耗时且刷屏，测量期间丢弃标准输出
+            with open(os.devnull, "w", encoding="utf-8") as devnull:
+                self._run_all(population_size, devnull)
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        return {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": self.seed,
+            "sizes": self.sizes,
+            "metrics": self.metrics
+        }
+
+    def _run_all(self, population_size, devnull):
+        # 1. 人口生成与加载
+        population_csv = os.path.join(self.work_dir, "population.csv")
+        generator = ShanghaiCustomerGenerator()
+        seconds, population_df = _timed(lambda: generator.generate_population(population_size, seed=self.seed),
+                                        self.repeats)
+        self._record(f"population_generate_{population_size}", seconds)
+        population_df.to_csv(population_csv, index=False, encoding='utf-8-sig')
+
+        cache_dir = os.path.join(self.work_dir, "population_cache")
+
+        def load_cold():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return load_population_store(population_csv, cache_dir=cache_dir)
+
+        with redirect_stdout(devnull):
+            seconds, _ = _timed(load_cold, self.repeats)
+        self._record(f"population_load_cold_{population_size}", seconds)
+        with redirect_stdout(devnull):
+            seconds, _ = _timed(lambda: load_population_store(population_csv, cache_dir=cache_dir), self.repeats)
+        self._record(f"population_load_warm_{population_size}", seconds)
+
+        random.seed(self.seed)
+        with redirect_stdout(devnull):
+            market = CoffeeMarket(population_csv, self.brand_library_json, self.map_config,
+                                  llm_client=RuleBasedBackend(), population_cache_dir=cache_dir)
+            market.start_run(self.platform_rules, "classic", result_writer=None)
+
+        # 2. 批量预筛 (全部人口 × 全部门店)
+        customers = list(market.customers)
+        seconds, shortlist = _timed(lambda: market._shortlister.score_customers(customers), self.repeats)
+        self._record(f"shortlist_score_{population_size}", seconds)
+
+        # 3. 提示词渲染
+        market._shortlist = shortlist
+        prompt_sample = customers[:min(PROMPT_SAMPLE, len(customers))]
+        seconds, _ = _timed(lambda: [market._prepare_prompts(i, c) for i, c in enumerate(prompt_sample)], self.repeats)
+        self._record(f"prompt_render_{len(prompt_sample)}", seconds)
+
+        # 4. 端到端：抽样 -> 预筛 -> 渲染 -> 规则决策 -> 流式写入结果
+        results_csv = None
+        for n in self.sizes:
+            results_csv = os.path.abspath(os.path.join(self.work_dir, f"results_{n}.csv"))
+            repeats = self.repeats if n < self.sizes[-1] else 1
+
+            def simulate():
+                random.seed(self.seed)
+                market.run_simulation(sample_size=n, platform_rules=self.platform_rules, output_filename=results_csv)
+
+            with redirect_stdout(devnull):
+                seconds, _ = _timed(simulate, repeats)
+            self._record(f"end_to_end_{n}", seconds, customers_per_second=round(n / seconds, 1))
+
+        # 5. 分析报告 (最大规模的结果文件)
+        report_dir = os.path.join(self.work_dir, "report")
+        with redirect_stdout(devnull):
+            seconds, _ = _timed(lambda: CoffeeMarketAnalyzer(results_csv).generate_comprehensive_report(report_dir),
+                                self.repeats)
+        self._record(f"analytics_report_{self.sizes[-1]}", seconds)
+
+
+def load_baseline(directory=BENCHMARK_DIR):
+    """读取基线；不存在时返回 None"""
+    path = os.path.join(directory, BASELINE_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_results(results, directory=BENCHMARK_DIR, as_baseline=False):
+    """保存本次结果 (benchmark_<时间戳>.json)，as_baseline 时同时写为基线；返回结果文件路径"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(directory, f"benchmark_{timestamp}.json")
+    _write_json(path, results)
+    if as_baseline:
+        _write_json(os.path.join(directory, BASELINE_FILENAME), results)
+    return path
+
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    逐项对比耗时，返回 (对比行, 回退的指标名列表)：比基线慢超过 threshold 且绝对差值不小于 MIN_REGRESSION_SECONDS 即为回退。
+    对比行: (指标, 基线秒数, 本次秒数, 变化比例)；基线中没有的指标基线秒数为 None，不参与判定。
+    """
+    rows, regressions = [], []
+    baseline_metrics = baseline.get("metrics", {})
+    for name, metric in results["metrics"].items():
+        base = baseline_metrics.get(name)
+        if base is None:
+            rows.append((name, None, metric["seconds"], None))
+            continue
+        change = metric["seconds"] / base["seconds"] - 1 if base["seconds"] > 0 else 0.0
+        rows.append((name, base["seconds"], metric["seconds"], change))
+        if change > threshold and metric["seconds"] - base["seconds"] >= MIN_REGRESSION_SECONDS:
+            regressions.append(name)
+    return rows, regressions
+
+
+def run_benchmark(brand_library_json, map_config, platform_rules, directory=BENCHMARK_DIR,
+                  threshold=DEFAULT_THRESHOLD, update_baseline=False, sizes=DEFAULT_SIZES):
+    """
+    运行基准并与基线对比，返回进程退出码：0 为通过，1 为存在回退。
+    没有基线或 update_baseline=True 时，以本次结果作为新基线。
+    """
+    results = BenchmarkSuite(brand_library_json, map_config, platform_rules, sizes=sizes, directory=directory).run()
+    baseline = load_baseline(directory)
+    as_baseline = update_baseline or baseline is None
+    path = save_results(results, directory, as_baseline=as_baseline)
+    print(f"\n💾 基准结果: {path}")
+    if as_baseline:
+        print(f"📌 已写入基线: {os.path.join(directory, BASELINE_FILENAME)}")
+        return 0
+
+    rows, regressions = compare_to_baseline(results, baseline, threshold)
+    print(f"\n--- 📏 与基线对比 (基线: {baseline.get('created_at')}，回退阈值 +{threshold:.0%}) ---")
+    for name, base, current, change in rows:
+        if base is None:
+            print(f"   {name:<32} {'-':>9}  -> {current:>9.3f}s   (基线中无此项)")
+            continue
+        flag = "❌ 回退" if name in regressions else "✅"
+        print(f"   {name:<32} {base:>9.3f}s -> {current:>9.3f}s  {change:+7.1%}  {flag}")
+    if regressions:
+        print(f"\n❌ 性能回退: {', '.join(regressions)}")
+        return 1
+    print("\n✅ 所有指标均在阈值内")
+    return 0
+
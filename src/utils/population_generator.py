@@ -1,8 +1,83 @@
+import os
+import shutil
 import numpy as np
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_dataset
+    import pyarrow.feather as pa_feather
+    import pyarrow.parquet as pa_parquet
+except ImportError:  # pyarrow 为可选依赖，只有 Parquet / Arrow 格式的读写需要
+    pa = None
+
+# 顾客人设描述 (作为决策时的 system prompt)
+PERSONA_TEMPLATE = (
+    "你是一名{}岁的{}，生活在上海。"
+    "月收入约{}元。你对咖啡的需求频率是{}。"
+    "你最喜欢的口味是{}。在价格方面，你的敏感度属于{}。"
+    "你对{}有一定偏好，品牌忠诚度约{}。"
+)
+
+# 人口数据的列顺序
+POPULATION_COLUMNS = [
+    "id", "age_group", "occupation", "income", "preference", "frequency",
+    "price_sensitivity", "brand_preference", "brand_loyalty", "persona_description"
+]
+
+# 取值有限的列在 Parquet / Arrow 文件里存为 categorical (字典编码)，类别固定，各分块一致
+CATEGORICAL_COLUMNS = ["age_group", "occupation", "preference", "brand_preference"]
+
+# 分块文件格式 -> 文件扩展名 (arrow 即 Arrow IPC / Feather v2)
+POPULATION_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("读写 Parquet / Arrow 格式的人口数据需要 pyarrow: pip install pyarrow")
+
+
+def population_format(path):
+    """按路径判断人口数据格式：分块目录按其中的文件扩展名，单个文件按自身扩展名，其余视为 CSV"""
+    if os.path.isdir(path):
+        extensions = {os.path.splitext(name)[1].lower() for name in os.listdir(path)}
+    else:
+        extensions = {os.path.splitext(path)[1].lower()}
+    for fmt, ext in POPULATION_FORMATS.items():
+        if ext in extensions or (fmt == "arrow" and ".feather" in extensions):
+            return fmt
+    if os.path.isdir(path):
+        raise ValueError(f"目录中没有 Parquet / Arrow 分块文件: {path}")
+    return "csv"
+
+
+def read_population(path, columns=None):
+    """
+    读取人口数据：CSV 文件、单个 Parquet / Arrow 文件，或 write_population 写出的分块目录。
+    columns 不为空时只读取其中存在的列 (列式格式只解码这些列)，缺少的列由调用方补齐。
+    """
+    fmt = population_format(path)
+    if fmt == "csv":
+        usecols = None if columns is None else (lambda c: c in columns)
+        return pd.read_csv(path, usecols=usecols)
+
+    require_pyarrow()
+    if os.path.isdir(path):
+        # 分块文件名带零填充序号，按文件名排序即生成顺序
+        sources = sorted(os.path.join(path, name) for name in os.listdir(path)
+                         if os.path.splitext(name)[1].lower() in (".parquet", ".arrow", ".feather"))
+    else:
+        sources = [path]
+    dataset = pa_dataset.dataset(sources, format="parquet" if fmt == "parquet" else "ipc")
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+    return dataset.to_table(columns=columns).to_pandas()
+
 class ShanghaiCustomerGenerator:
-    def __init__(self):
+    def __init__(self, seed=None):
+        # 全部抽样都走同一个 numpy.random.Generator，给定 seed 即可复现整份人口数据
+        self.rng = np.random.default_rng(seed)
+
         # 1. 年龄分布 (基于上海统计年鉴2024修正)
         # 核心消费力集中在 25-34 岁 (新上海人/打工人主力)
         self.age_dist = {
@@ -53,133 +128,229 @@ class ShanghaiCustomerGenerator:
             'Yongbo': '永璞咖啡'
         }
 
-    def _get_occupation_by_age(self, age_group):
-        """基于年龄的职业条件概率 P(Occupation|Age)"""
-        # 逻辑：年轻人多为学生/初级白领，中年人多为管理/高薪，老年人退休
-        if age_group == '18-24':
-            return np.random.choice(self.occupations, p=[0.60, 0.20, 0.05, 0.05, 0.10, 0.00])
-        elif age_group == '25-34':
-            return np.random.choice(self.occupations, p=[0.02, 0.45, 0.25, 0.15, 0.13, 0.00])
-        elif age_group == '35-44':
-            return np.random.choice(self.occupations, p=[0.00, 0.40, 0.30, 0.15, 0.15, 0.00])
-        elif age_group in ['55-64', '65+']:
-            # 55岁以上大部分退休或返聘
-            p_retire = 0.8 if age_group == '65+' else 0.4
-            p_work = (1 - p_retire) / 4
-            return np.random.choice(self.occupations, p=[0.00, p_work, p_work, p_work, p_work, p_retire])
-        else:
-            return np.random.choice(self.occupations, p=[0.00, 0.30, 0.15, 0.20, 0.35, 0.00])
-
-    def _get_income(self, occupation):
-        """生成符合对数正态分布的收入"""
-        stats = self.income_stats[occupation]
-        # Log-Normal生成: mu需要根据mean计算 (mean = exp(mu + sigma^2/2))
-        # 简化处理：直接视为正态分布取对数后的还原，或者直接用lognormal函数
-        # 这里为了控制方便，使用 np.random.lognormal
-        # 需反推 mu: mu = ln(mean) - sigma^2 / 2
-        mu = np.log(stats['mean']) - (stats['sigma']**2) / 2
-        income = np.random.lognormal(mu, stats['sigma'])
-        return int(max(1500, income)) # 兜底最低收入
-
-    def _get_preferences(self, age_group, occupation, income):
+    def _occupation_table(self):
+        """
+        职业的条件概率表 P(Occupation|Age)，行按 age_dist['groups'] 排列、列按 occupations 排列。
+        逻辑：年轻人多为学生/初级白领，中年人多为管理/高薪，老年人退休
+        """
+        table = []
+        for age_group in self.age_dist['groups']:
+            if age_group == '18-24':
+                probs = [0.60, 0.20, 0.05, 0.05, 0.10, 0.00]
+            elif age_group == '25-34':
+                probs = [0.02, 0.45, 0.25, 0.15, 0.13, 0.00]
+            elif age_group == '35-44':
+                probs = [0.00, 0.40, 0.30, 0.15, 0.15, 0.00]
+            elif age_group in ['55-64', '65+']:
+                # 55岁以上大部分退休或返聘
+                p_retire = 0.8 if age_group == '65+' else 0.4
+                p_work = (1 - p_retire) / 4
+                probs = [0.00, p_work, p_work, p_work, p_work, p_retire]
+            else:
+                probs = [0.00, 0.30, 0.15, 0.20, 0.35, 0.00]
+            table.append(probs)
+        return np.array(table)
+
+    @staticmethod
+    def _choice_rows(cum_probs, u):
+        """按每行各自的累积概率做逆 CDF 抽样：cum_probs 为 (n, k)，u 为 (n,) 的 [0,1) 均匀数"""
+        idx = (u[:, None] >= cum_probs).sum(axis=1)
+        # 累积概率的浮点误差可能让最后一列略小于 1
+        return np.minimum(idx, cum_probs.shape[1] - 1)
+
+    def _draw_occupations(self, age_idx, rng):
+        """按年龄组逐行查条件概率表，一次性抽出全部职业"""
+        cum = np.cumsum(self._occupation_table(), axis=1)
+        return self._choice_rows(cum[age_idx], rng.random(len(age_idx)))
+
+    def _draw_incomes(self, occ_idx, rng):
         """
-        生成消费偏好 (核心逻辑)
+        生成符合对数正态分布的收入。
+        需反推 mu: mean = exp(mu + sigma^2/2) => mu = ln(mean) - sigma^2 / 2
+        """
+        means = np.array([self.income_stats[o]['mean'] for o in self.occupations], dtype=float)
+        sigmas = np.array([self.income_stats[o]['sigma'] for o in self.occupations])
+        mus = np.log(means) - sigmas ** 2 / 2
+        incomes = rng.lognormal(mus[occ_idx], sigmas[occ_idx])
+        return np.maximum(1500, incomes).astype(np.int64)  # 兜底最低收入
+
+    def _draw_preferences(self, age_group, occupation, income, rng):
+        """
+        生成消费偏好 (核心逻辑)，参数均为整列数组
         上海市场特征：特调多、对品质有要求、但对价格也敏感
         """
         # 1. 咖啡因需求 (Frequency)
-        if occupation in ['Tech/Finance', 'White Collar'] or age_group == '25-34':
-            caffeine_need = 'High' # 续命水
-        elif occupation == 'Retired':
-            caffeine_need = 'Low'
-        else:
-            caffeine_need = 'Medium'
+        is_senior = np.isin(age_group, ['55-64', '65+'])
+        high_need = np.isin(occupation, ['Tech/Finance', 'White Collar']) | (age_group == '25-34')
+        caffeine_need = np.where(high_need, 'High', np.where(occupation == 'Retired', 'Low', 'Medium'))  # High=续命水
 
         # 2. 口味偏好 (Type)
         # 上海特色：拿铁(Latte)是绝对主流，特调(Specialty)占比高
-        rand = np.random.random()
-        if occupation == 'Student':
-            fav_type = 'Specialty' if rand < 0.6 else 'Latte' # 学生喜欢生椰/果咖
-        elif occupation in ['Tech/Finance'] and caffeine_need == 'High':
-            fav_type = 'Americano' if rand < 0.5 else 'Latte' # 程序员喝冰美式
-        elif age_group in ['55-64', '65+']:
-            fav_type = 'Americano' if rand < 0.3 else 'Tea' # 老上海喜欢清咖或茶
-        else:
-            # 大众市场
-            fav_type = np.random.choice(['Latte', 'Americano', 'Specialty'], p=[0.5, 0.3, 0.2])
+        rand = rng.random(len(age_group))
+        # 大众市场：Latte/Americano/Specialty = 0.5/0.3/0.2 (复用同一个均匀数做逆 CDF，各分支互斥，分布不变)
+        mass_market = np.where(rand < 0.5, 'Latte', np.where(rand < 0.8, 'Americano', 'Specialty'))
+        fav_type = np.select(
+            [
+                occupation == 'Student',
+                (occupation == 'Tech/Finance') & (caffeine_need == 'High'),
+                is_senior
+            ],
+            [
+                np.where(rand < 0.6, 'Specialty', 'Latte'),   # 学生喜欢生椰/果咖
+                np.where(rand < 0.5, 'Americano', 'Latte'),   # 程序员喝冰美式
+                np.where(rand < 0.3, 'Americano', 'Tea')      # 老上海喜欢清咖或茶
+            ],
+            default=mass_market
+        )
 
         # 3. 价格敏感度 (Price Sensitivity)
-        # 收入越高，敏感度越低。但上海人普遍精明 (Smart Shopper)
-        if income > 25000:
-            p_sens = 'Low' # 只看品质
-        elif income < 8000:
-            p_sens = 'High' # 9.9党
-        else:
-            # 中产阶级，看性价比
-            p_sens = 'Medium' 
-            
+        # 收入越高，敏感度越低 (>25000 只看品质，<8000 为 9.9 党)。中产阶级看性价比
+        p_sens = np.where(income > 25000, 'Low', np.where(income < 8000, 'High', 'Medium'))
+
         return fav_type, caffeine_need, p_sens
 
-    def _get_brand_preference(self):
+    def _draw_brand_preferences(self, n, rng):
         """基于市场分布生成品牌偏好与忠诚度"""
-        brands = list(self.brand_preference_weights.keys())
-        probs = list(self.brand_preference_weights.values())
-        preferred_brand = np.random.choice(brands, p=probs)
-        loyalty = round(float(np.random.uniform(0.2, 0.8)), 2)
+        brands = np.array(list(self.brand_preference_weights.keys()))
+        probs = np.array(list(self.brand_preference_weights.values()))
+        preferred_brand = brands[rng.choice(len(brands), size=n, p=probs / probs.sum())]
+        loyalty = np.round(rng.uniform(0.2, 0.8, size=n), 2)
         return preferred_brand, loyalty
 
-    def generate_population(self, n=100):
-        data = []
-        for _ in range(n):
-            age_group = np.random.choice(self.age_dist['groups'], p=self.age_dist['probs'])
-            occupation = self._get_occupation_by_age(age_group)
-            income = self._get_income(occupation)
-            fav_type, freq, p_sens = self._get_preferences(age_group, occupation, income)
-            preferred_brand, brand_loyalty = self._get_brand_preference()
-            preferred_brand_name = self.brand_name_map.get(preferred_brand, preferred_brand)
-            
-            # 生成 Prompt 描述
-            desc = (
-                f"你是一名{age_group}岁的{occupation}，生活在上海。"
-                f"月收入约{income}元。你对咖啡的需求频率是{freq}。"
-                f"你最喜欢的口味是{fav_type}。在价格方面，你的敏感度属于{p_sens}。"
-                f"你对{preferred_brand_name}有一定偏好，品牌忠诚度约{brand_loyalty}。"
+    def add_brand_preferences(self, df):
+        """为缺少品牌偏好列的旧版人口数据补齐 brand_preference / brand_loyalty (原地修改 df)"""
+        preferred_brand, brand_loyalty = self._draw_brand_preferences(len(df), self.rng)
+        df['brand_preference'] = preferred_brand
+        df['brand_loyalty'] = brand_loyalty
+        return df
+
+    def generate_population(self, n=100, seed=None, rng=None):
+        """
+        向量化生成 n 名顾客：每个属性整列抽样，再按列组装 DataFrame。
+        seed 为空时使用构造时的随机数生成器 (numpy.random.Generator)；rng 可直接传入生成器。
+        """
+        if rng is None:
+            rng = np.random.default_rng(seed) if seed is not None else self.rng
+        groups = np.array(self.age_dist['groups'])
+        occupations = np.array(self.occupations)
+
+        age_idx = rng.choice(len(groups), size=n, p=self.age_dist['probs'])
+        occ_idx = self._draw_occupations(age_idx, rng)
+        age_group = groups[age_idx]
+        occupation = occupations[occ_idx]
+        income = self._draw_incomes(occ_idx, rng)
+        fav_type, freq, p_sens = self._draw_preferences(age_group, occupation, income, rng)
+        preferred_brand, brand_loyalty = self._draw_brand_preferences(n, rng)
+
+        # 生成 Prompt 描述：pandas 字符串列逐列相加反而更慢，这里对整列数据做一次列表推导
+        brand_name = [self.brand_name_map.get(b, b) for b in preferred_brand.tolist()]
+        desc = [
+            PERSONA_TEMPLATE.format(age, occ, inc, f, fav, sens, name, loyalty)
+            for age, occ, inc, f, fav, sens, name, loyalty in zip(
+                age_group.tolist(), occupation.tolist(), income.tolist(), freq.tolist(),
+                fav_type.tolist(), p_sens.tolist(), brand_name, brand_loyalty.tolist()
             )
-            
-            data.append({
-                "id": len(data) + 1,
-                "age_group": age_group,
-                "occupation": occupation,
-                "income": income,
-                "preference": fav_type,
-                "frequency": freq,
-                "price_sensitivity": p_sens,
-                "brand_preference": preferred_brand,
-                "brand_loyalty": brand_loyalty,
-                "persona_description": desc
-            })
-            
-        return pd.DataFrame(data)
+        ]
+
+        return pd.DataFrame({
+            "id": np.arange(1, n + 1),
+            "age_group": age_group,
+            "occupation": occupation,
+            "income": income,
+            "preference": fav_type,
+            "frequency": freq,
+            "price_sensitivity": p_sens,
+            "brand_preference": preferred_brand,
+            "brand_loyalty": brand_loyalty,
+            "persona_description": desc
+        })
+
+    def categorical_dtypes(self):
+        """CATEGORICAL_COLUMNS 各列的固定类别，保证每个分块的字典编码一致"""
+        return {
+            "age_group": pd.CategoricalDtype(self.age_dist['groups']),
+            "occupation": pd.CategoricalDtype(self.occupations),
+            "preference": pd.CategoricalDtype(['Latte', 'Americano', 'Specialty', 'Tea']),
+            "brand_preference": pd.CategoricalDtype(list(self.brand_preference_weights)),
+        }
+
+    def iter_population(self, n, chunk_size=500000, seed=None):
+        """
+        流式生成 n 名顾客，每次产出最多 chunk_size 行的 DataFrame (分类列为 categorical)。
+        ID 跨分块连续编号；内存占用只与 chunk_size 有关，与 n 无关。
+        """
+        rng = np.random.default_rng(seed) if seed is not None else self.rng
+        dtypes = self.categorical_dtypes()
+        for start in range(0, n, chunk_size):
+            size = min(chunk_size, n - start)
+            chunk = self.generate_population(size, rng=rng)
+            chunk["id"] += start
+            yield chunk.astype(dtypes)
+
+    def write_population(self, path, n, chunk_size=500000, fmt="parquet", seed=None):
+        """
+        分块生成人口并写入目录 path：每块一个 part-00000.parquet (或 .arrow) 文件。
+        先写入 <path>.part 临时目录，全部写完后再替换为正式目录，中途失败不会留下半份数据。
+        返回写出的分块文件数。
+        """
+        require_pyarrow()
+        if fmt not in POPULATION_FORMATS:
+            raise ValueError(f"未知的人口数据格式: {fmt}。可选值: {list(POPULATION_FORMATS)}")
+        tmp_path = path.rstrip("/\\") + ".part"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        parts = 0
+        for chunk in self.iter_population(n, chunk_size, seed):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            part_path = os.path.join(tmp_path, f"part-{parts:05d}{POPULATION_FORMATS[fmt]}")
+            if fmt == "parquet":
+                pa_parquet.write_table(table, part_path)
+            else:
+                pa_feather.write_feather(table, part_path)
+            parts += 1
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return parts
 
 if __name__ == "__main__":
-    import os
-    
+    import argparse
+
+    parser = argparse.ArgumentParser(description="生成上海顾客仿真人口数据")
+    parser.add_argument("--n", type=int, default=1000, help="顾客人数 (默认: 1000)")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子 (默认: 随机)")
+    parser.add_argument("--format", choices=["csv"] + list(POPULATION_FORMATS), default="csv",
+                        help="输出格式：csv 单文件，parquet / arrow 为分块目录 (默认: csv)")
+    parser.add_argument("--chunk-size", type=int, default=500000, help="parquet / arrow 每个分块的行数 (默认: 500000)")
+    parser.add_argument("--output", default=None,
+                        help="输出路径 (默认: data/input/shanghai_population.csv 或 data/input/shanghai_population_<格式>/)")
+    args = parser.parse_args()
+
     # 1. 实例化生成器
-    gen = ShanghaiCustomerGenerator()
-    
-    # 2. 生成 1000 个顾客 (样本量大一点，统计特征更明显)
-    print("正在生成上海顾客仿真数据...")
-    df = gen.generate_population(1000)
-    
-    # 3. 确保 data/input 文件夹存在
+    gen = ShanghaiCustomerGenerator(seed=args.seed)
+
+    # 2. 确保 data/input 文件夹存在
     output_dir = "data/input"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         print(f"已创建目录: {output_dir}")
-    
-    # 4. 保存为 CSV
-    output_path = f"{output_dir}/shanghai_population.csv"
-    df.to_csv(output_path, index=False, encoding='utf-8-sig') # utf-8-sig 防止中文乱码
-    
+
+    print("正在生成上海顾客仿真数据...")
+    if args.format == "csv":
+        # 3. 一次生成 (样本量大一点，统计特征更明显) 并保存为 CSV
+        df = gen.generate_population(args.n)
+        output_path = args.output or f"{output_dir}/shanghai_population.csv"
+        df.to_csv(output_path, index=False, encoding='utf-8-sig') # utf-8-sig 防止中文乱码
+    else:
+        # 3. 千万级人口：分块生成、逐块写入，内存只占一个分块
+        output_path = args.output or f"{output_dir}/shanghai_population_{args.format}"
+        parts = gen.write_population(output_path, args.n, chunk_size=args.chunk_size, fmt=args.format)
+        print(f"共写入 {parts} 个分块文件")
+        # 预览只读第一个分块
+        df = read_population(os.path.join(output_path, f"part-00000{POPULATION_FORMATS[args.format]}"))
+
     print(f"✅ 成功！数据已保存至: {output_path}")
     print("\n--- 数据预览 ---")
-    print(df[['occupation', 'income', 'preference', 'price_sensitivity']].head())
\ No newline at end of file
+    print(df[['occupation', 'income', 'preference', 'price_sensitivity']].head())
@@ -0,0 +1,159 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# 对数分桶：第 k 个桶收 (BASE*GROWTH^(k-1), BASE*GROWTH^k] 毫秒的样本，分位数相对误差约 5%；
+# 桶边界固定，不同进程 (分片) 的直方图按桶号直接相加即可合并
+BUCKET_BASE_MS = 0.001
+BUCKET_GROWTH = 1.1
+QUANTILES = (50, 95, 99)
+
+# 各阶段在汇总打印中的名称 (未列出的阶段直接显示阶段名)
+STAGE_LABELS = {
+    "population_load": "人口加载",
+    "shortlist": "批量预筛",
+    "prompt_build": "提示词渲染",
+    "llm_call": "决策调用 (含缓存/重试)",
+    "rate_limit_wait": "限流排队",
+    "llm_network": "LLM 网络请求",
+    "json_parse": "JSON 解析",
+    "result_logging": "结果打印与写入",
+}
+
+
+def bucket_index(ms):
+    if ms <= BUCKET_BASE_MS:
+        return 0
+    return math.ceil(math.log(ms / BUCKET_BASE_MS, BUCKET_GROWTH))
+
+
+def bucket_upper_ms(k):
+    return BUCKET_BASE_MS * BUCKET_GROWTH ** k
+
+
+class LatencyHistogram:
+    """单个阶段的耗时直方图：计数、总耗时、最大值与对数分桶计数，内存占用与样本数无关"""
+
+    def __init__(self, count=0, total=0.0, maximum=0.0, buckets=None):
+        self.count = count
+        self.total = total
+        self.max = maximum
+        self.buckets = Counter(buckets or {})
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bucket_index(seconds * 1000)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets.update(other.buckets)
+
+    def quantile_ms(self, q):
+        """第 q 百分位数 (毫秒)，取所在桶的上界，且不超过实测最大值"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * q / 100)
+        seen = 0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if seen >= rank:
+                return min(bucket_upper_ms(k), self.max * 1000)
+        return self.max * 1000
+
+    def snapshot(self):
+        """可 JSON 序列化 / 跨进程传递的原始数据"""
+        return {"count": self.count, "total_s": self.total, "max_s": self.max,
+                "buckets": {str(k): n for k, n in sorted(self.buckets.items())}}
+
+    @classmethod
+    def from_snapshot(cls, data):
+        return cls(data["count"], data["total_s"], data["max_s"], {int(k): n for k, n in data["buckets"].items()})
+
+    def summary(self):
+        result = {
+            "count": self.count,
+            "total_s": round(self.total, 4),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+        }
+        for q in QUANTILES:
+            result[f"p{q}_ms"] = round(self.quantile_ms(q), 3)
+        result["max_ms"] = round(self.max * 1000, 3)
+        # 直方图：[(桶上界毫秒, 样本数), ...]
+        result["histogram"] = [[round(bucket_upper_ms(k), 4), n] for k, n in sorted(self.buckets.items())]
+        return result
+
+
+class RunTelemetry:
+    """
+    一次运行的分阶段计时与计数器。
+    CoffeeMarket 持有一份并挂到决策后端上 (backend.telemetry)；并发请求可能来自多个线程，记录时加锁。
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        with self._lock:
+            return {"stages": {stage: h.snapshot() for stage, h in self.stages.items()},
+                    "counters": dict(self.counters)}
+
+
+def merge_snapshots(snapshots):
+    """合并多个 RunTelemetry.snapshot() (如各分片进程的计时)"""
+    stages = {}
+    counters = Counter()
+    for snapshot in snapshots:
+        for stage, data in snapshot["stages"].items():
+            histogram = LatencyHistogram.from_snapshot(data)
+            if stage in stages:
+                stages[stage].merge(histogram)
+            else:
+                stages[stage] = histogram
+        counters.update(snapshot["counters"])
+    return {"stages": {stage: h.snapshot() for stage, h in stages.items()}, "counters": dict(counters)}
+
+
+def summarize(snapshot):
+    """snapshot -> {"stages": {阶段: 计数/总耗时/均值/p50/p95/p99/最大值/直方图}, "counters": {...}}"""
+    return {
+        "stages": {stage: LatencyHistogram.from_snapshot(data).summary() for stage, data in snapshot["stages"].items()},
+        "counters": dict(snapshot["counters"]),
+    }
+
+
+def write_run_metrics(path, metrics):
+    """写出 JSON 指标文件 (先写临时文件再原子替换)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)